@@ -1,47 +1,34 @@
-import os
+import argparse
+
 import nest_asyncio
 from dotenv import load_dotenv
-from llama_parse import LlamaParse
-from llama_index.core import SimpleDirectoryReader
-from pathlib import Path
 
 # Allow nested event loops
 nest_asyncio.apply()
 
-# Load environment variables
+# Load environment variables (before the ingestion settings are read)
 load_dotenv()
 
-# Initialize the parser with multimodal settings
-parser = LlamaParse(
-    api_key=os.getenv("LLAMA_CLOUD_API_KEY_3"),
-    use_vendor_multimodal_model=True,
-    vendor_multimodal_model_name="openai-gpt4o",
-    parsing_instruction = """
-                            This document presents comprehensive information on Peugeot's range of electric vehicles, including technical specifications, charging details, cost information and tax incentives, as well as associated services.
-                            It contains numerous structured sections, technical data tables, and information on different electric vehicle models.
-                            The document also covers topics such as vehicle range, battery technologies, connected mobility services, and the Peugeot Allure Care warranty program.
-                            It includes precise numerical data on vehicle performance, costs, and government incentives.Also at the end of each paragraph please add "<>end_paragraph<>" to separate the paragraphs.    
-                            """,
-
-    result_type="text",
-    
-
-)
-
-# Use SimpleDirectoryReader to parse the file
-file_extractor = {".pdf": parser}
-
-try:
-    raw_path = Path(__file__).parent
-    raw_path = raw_path / "raw_data"
-    
-    documents = SimpleDirectoryReader(raw_path, file_extractor=file_extractor).load_data()
-
-
-    # Save the parsed result to a file
-    with open('peugeot_data.txt', 'w') as result_file:
-        for doc in documents:
-            result_file.write(doc.text)
-except Exception as e:
-    print(f"Error while parsing the file: {e}")
-    
+from ingestion import INGESTION_PARSER, INGESTION_WORKERS, get_parser, run_ingestion
+
+# Parse raw_data/ into parsed_data/: only new or modified files are parsed (see ingestion.py)
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Incremental ingestion of raw_data/")
+    arguments.add_argument("--parser", default=INGESTION_PARSER, help="llamaparse or local")
+    arguments.add_argument("--workers", type=int, default=INGESTION_WORKERS)
+    arguments.add_argument("--force", action="store_true", help="parse every file again")
+    args = arguments.parse_args()
+
+    try:
+        report = run_ingestion(parser=get_parser(args.parser), workers=args.workers, force=args.force)
+        print(f"parsed: {report.parsed}")
+        print(f"unchanged: {report.unchanged}, removed: {report.removed}, failed: {list(report.failed)}")
+        print(f"{report.chunks} chunks, {report.paragraphs} paragraphs in the search index of {report.corpus_file}")
+        if report.context_served:
+            print(f"canonical context served: ~{report.context_tokens_after} tokens instead of ~{report.context_tokens_before} for the corpus")
+        elif report.context_tokens_after:
+            print(f"corpus served (~{report.context_tokens_before} tokens): the canonical context is not smaller or has conflicting figures")
+        else:
+            print(f"served context unchanged ({report.corpus_file} is the corpus of the offline parser)")
+    except Exception as e:
+        print(f"Error while parsing the file: {e}")
@@ -1,11 +1,11 @@
-from pathlib import Path
 import pandas as pd
 import streamlit as st
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.chat_history import InMemoryChatMessageHistory
 
 # Import des fonctions depuis utils.py
-from utils import add_message_to_history, run_chain, process_input, save_results_to_csv
+from utils import EXAMPLE_QUESTIONS, process_input, save_results_to_csv
+from metrics import get_metrics
 
 # Configuration de la page Streamlit
 st.set_page_config(page_title="B.O.B")
@@ -28,9 +28,6 @@ if "chat_history" not in st.session_state:
 if "metrics" not in st.session_state:
     st.session_state.metrics = []
 
-# Charger le contexte du document
-context = Path("parsed_data/peugeot_data.txt").read_text()
-
 # Afficher l'historique des messages
 for message in st.session_state.chat_history.messages:
     with st.chat_message("AI" if isinstance(message, AIMessage) else "Human"):
@@ -39,26 +36,21 @@ for message in st.session_state.chat_history.messages:
 # Entrée utilisateur
 user_input = st.chat_input("Posez votre question ici...")
 if user_input:
-    add_message_to_history(HumanMessage(content=user_input))
+    st.session_state.chat_history.add_message(HumanMessage(content=user_input))
     with st.chat_message("Human"):
         st.markdown(user_input)
     
+    # Le contexte est choisi par la route (retrieval / données capacité), chaque étape est mesurée
+    history = "\n".join(message.content for message in st.session_state.chat_history.messages)
     with st.chat_message("AI"):
-        response = process_input(user_input, context)
+        response = process_input(user_input, history)
         st.write(response)
     
-    add_message_to_history(AIMessage(content=response))
+    st.session_state.chat_history.add_message(AIMessage(content=response))
 
 # Exemples de questions
 st.markdown('<div class="QUESTIONS EXAMPLES">', unsafe_allow_html=True)
-questions = [
-    "Quel est le prix de la recharge ?",
-    "Bonjour, je souhaite savoir quelles sont les meilleures applications ?",
-    "Quel est le taux de satisfaction client parmi les utilisateurs français qui sont passés aux véhicules électriques ?",
-    "Pouvez-vous fournir un bref historique des véhicules électriques de Peugeot ?",
-    "Quels sont les principaux facteurs influençant l'autonomie d'un véhicule électrique ?",
-    "Dites-moi quel est le prix pour recharger ma e-208, puis le temps de recharge sur une borne."
-]
+questions = EXAMPLE_QUESTIONS
 
 for i, question in enumerate(questions, start=1):
     with st.expander(f"Question {i}"):
@@ -72,6 +64,10 @@ with st.sidebar:
         
         # Afficher les métriques
         st.dataframe(df)
+
+        # Appels, tokens et latence moyenne par modèle (small / large)
+        st.subheader("Par modèle")
+        st.dataframe(pd.DataFrame(get_metrics().tier_rows()))
         
         # Bouton de téléchargement
         csv = save_results_to_csv()
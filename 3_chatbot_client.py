@@ -1,15 +1,25 @@
+import asyncio
 import os
+import uuid
 from pathlib import Path
 
 import boto3
 import streamlit as st
 from langchain_core.messages import AIMessage, HumanMessage
+from history_compaction import HistoryCompactor
 from utils import (
-    check_question_type,
-    initialize_chain_commercial,
-    initialize_chain_experts_ev,
-    initialize_chain_expert_data_ev_capacity
+    DEFAULT_ROUTE,
+    ROUTES,
+    add_message_to_history,
+    classify_question,
+    get_chain_registry,
+    get_chat_messages,
+    route_and_answer_async,
+    stream_answer,
 )
+from metrics import get_metrics
+from response_cache import get_response_cache
+from semantic_cache import get_semantic_cache
 
 # Setup your Bedrock credentials from Streamlit secrets
 session = boto3.Session(
@@ -33,9 +43,33 @@ def load_css(file_path):
 
 load_css("style.css")
 
-# Initialize chat history if not present
+# Conversation id in the URL (?session=...): a page reload or a restart of the app resumes the conversation
+if "session_id" not in st.session_state:
+    st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+    st.query_params["session"] = st.session_state.session_id
+
+# Initialize chat history if not present, from the session store (persistent, see session_store.py)
 if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
+    st.session_state.chat_history = get_chat_messages(st.session_state.session_id)
+
+# Compaction of the history sent to the chains (recent turns verbatim + rolling summary of the older ones)
+if "history_compactor" not in st.session_state:
+    st.session_state.history_compactor = HistoryCompactor()
+
+# Per-turn speculation stats (async mode), to tune SPECULATION_WIDTH
+if "speculation_stats" not in st.session_state:
+    st.session_state.speculation_stats = []
+
+# Async mode: the LLM classifier and the most likely answer chain run at the same time
+with st.sidebar:
+    async_mode = st.toggle("Mode asynchrone (routage spéculatif)", value=False)
+    if st.session_state.speculation_stats:
+        turns = st.session_state.speculation_stats
+        st.caption(
+            f"Spéculation : {sum(stats.hit for stats in turns)}/{len(turns)} tours gagnants, "
+            f"{sum(stats.saved_seconds for stats in turns):.1f}s gagnées, "
+            f"{sum(stats.wasted_seconds for stats in turns):.1f}s de modèle perdues"
+        )
 
 # Function to display the chat history
 def display_chat_history():
@@ -60,90 +94,47 @@ if user_input:
     with st.chat_message("Human"):
         st.markdown(f"**You:** {user_input}")
 
-    # Format the history for context
-    chat_history_messages = [msg.content for msg in st.session_state.chat_history]
-    formatted_history = "\n".join(chat_history_messages)
-
-    # Determine if the question is relevant to experts or commercial
-    # relevance_result = check_question_type(user_input, formatted_history)
-
-    # # Initialize the correct chain based on relevance
-
-    # if relevance_result == "yes":
-    #         chain = initialize_chain_experts_ev(formatted_history, user_input)
-    #         print("chaine experts")
-    # elif relevance_result == "ok":
-    #     chain = initialize_chain_expert_data_ev_capacity(formatted_history, user_input)
-    #     print("chaine expert data EV capacity")
-    # elif relevance_result == "no":
-    #     chain = initialize_chain_commercial(formatted_history, user_input)
-    #     print("chaine commercial")
-    # else:
-    #     chain = initialize_chain_commercial(formatted_history, user_input)
-    #     print("chaine commercial")
-    
-
-    # # Invoke the chain and get the output
-    # result = chain.invoke({
-    #     "user_input": user_input,
-    #     "history": formatted_history,
-    #     "context": ""  # Assuming context is handled within the chain initialization
-    # })
-
-    # # Stream the AI's response
-    # with st.chat_message("AI"):
-    #     response_placeholder = st.empty()
-    #     response_text = result["response"]  # Extract the response
-    #     key_words = result["key_words"]  # Extract the key words
-
-    #     # Display the AI's response
-    #     response_placeholder.markdown(f"**Peugeot Expert:** {response_text}")
-        
-    #     # Optionally display the key words if needed
-    #     st.markdown(f"**Key Words:** {', '.join(key_words)}")
-
-    # # Add the AI's response to the chat history
-    # st.session_state.chat_history.append(AIMessage(content=response_text))
-    # Determine if the question is relevant to experts or commercial
-    relevance_result = check_question_type(user_input, formatted_history)
-
-    # Initialize the correct chain based on relevance
-    if relevance_result == "yes":
-        chain = initialize_chain_experts_ev(formatted_history, user_input)
-        print("chaine experts")
-    elif relevance_result == "ok":
-        chain = initialize_chain_expert_data_ev_capacity(formatted_history, user_input)
-        print("chaine expert data EV capacity")
-    elif relevance_result == "no":
-        chain = initialize_chain_commercial(formatted_history, user_input)
-        print("chaine commercial")
-    else:
-        chain = initialize_chain_commercial(formatted_history, user_input)
-        print("chaine commercial par defaut")
-
-    # Assurez-vous que chain est défini avant d'invoquer la chaîne
-    if chain is not None:
-        result = chain.invoke({
-            "user_input": user_input,
-            "history": formatted_history,
-            "context": ""  # Assuming context is handled within the chain initialization
-        })
-
-        # Stream the AI's response
+    # Format the history for context, within the token budget: the classifier gets a shorter view
+    history_views = st.session_state.history_compactor.compact(st.session_state.chat_history)
+    formatted_history = history_views.answer
+    print(
+        f"history tokens: {history_views.full_tokens} in the transcript, {history_views.answer_tokens} sent to the "
+        f"answer chain, {history_views.classifier_tokens} to the classifier"
+    )
+
+    # Determine if the question is relevant to experts or commercial (locally when the router is sure),
+    # then answer with the chain of that route: the chains are built once per process
+    registry = get_chain_registry()
+    with registry.call_counter.turn() as model_calls, get_metrics().turn(user_input) as turn_metrics:
         with st.chat_message("AI"):
             response_placeholder = st.empty()
-            response_text = result["response"]  # Extract the response
-            key_words = result["key_words"]  # Extract the key words
+
+            if async_mode:
+                decision, result, speculation = asyncio.run(
+                    route_and_answer_async(user_input, formatted_history, history_views.classifier)
+                )
+                if speculation is not None:
+                    st.session_state.speculation_stats.append(speculation)
+                response_text, key_words = result["response"], result["key_words"]
+            else:
+                # Stream the AI's response: the "response" field is rendered while the JSON is generated
+                decision = classify_question(user_input, history_views.classifier)
+                for response_text, key_words, done in stream_answer(decision.label, user_input, formatted_history):
+                    response_placeholder.markdown(f"**Peugeot Expert:** {response_text}" + ("" if done else " ▌"))
 
             # Display the AI's response
             response_placeholder.markdown(f"**Peugeot Expert:** {response_text}")
-            
-            # Optionally display the key words if needed
-            st.markdown(f"**Key Words:** {', '.join(key_words)}")
-
-        # Add the AI's response to the chat history
-        st.session_state.chat_history.append(AIMessage(content=response_text))
-    else:
-        st.error("Erreur: Chaîne non initialisée correctement.")
-
 
+            # Optionally display the key words if needed
+            if key_words:
+                st.markdown(f"**Key Words:** {', '.join(key_words)}")
+
+        print(f"route: {ROUTES.get(decision.label, DEFAULT_ROUTE)} ({decision.label}, decided by {decision.source})")
+    print(f"model calls this turn: {model_calls.count} (total: {registry.call_counter.total})")
+    print(f"metrics: {turn_metrics.as_row()}")
+    print(f"response cache: {get_response_cache().stats()}, semantic cache: {get_semantic_cache().stats()}")
+
+    # Add the AI's response to the chat history, and the turn to the session store (written in the background)
+    st.session_state.chat_history.append(AIMessage(content=response_text))
+    add_message_to_history("human", user_input, session_id=st.session_state.session_id)
+    add_message_to_history("assistant", response_text, session_id=st.session_state.session_id)
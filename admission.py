@@ -0,0 +1,298 @@
+import asyncio
+import hashlib
+import ipaddress
+import math
+import os
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, Deque, Dict, FrozenSet, List, Optional, Tuple, Union
+
+# Admission settings (per worker process: with N workers, a client gets up to N times the rate), overridable
+# from the environment
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("API_MAX_CONCURRENCY", "16"))  # model calls in flight
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))  # requests waiting for a slot, per lane
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))  # max seconds in the queue
+# A person asks a question every few seconds at most; one address can be a whole office or dealership (NAT).
+# The bucket only stops a runaway client, the model slots and the queue protect Bedrock
+ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", "2.0"))  # model calls per second per client (0: no limit)
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "20"))  # token bucket size per client
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))  # buckets kept, least recently used dropped
+
+# Client identity: an API key of ADMISSION_API_KEYS (X-API-Key header), else the client address, taken from
+# X-Forwarded-For only when the peer is one of ADMISSION_TRUSTED_PROXIES (addresses or networks, comma-separated)
+ADMISSION_API_KEYS = frozenset(key.strip() for key in os.getenv("ADMISSION_API_KEYS", "").split(",") if key.strip())
+ADMISSION_TRUSTED_PROXIES = os.getenv("ADMISSION_TRUSTED_PROXIES", "")
+
+# Lanes in priority order: a freed slot goes to the first waiting request of the first non-empty lane
+LANES = ("interactive", "batch")
+
+
+class AdmissionRejected(Exception):
+    """A request shed by admission control: 429 (client rate limit) or 503 (overloaded), with a Retry-After."""
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(f"Request rejected ({reason}), retry after {retry_after:.1f}s")
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def parse_networks(networks: str) -> List[Union[ipaddress.IPv4Network, ipaddress.IPv6Network]]:
+    return [ipaddress.ip_network(network.strip(), strict=False) for network in networks.split(",") if network.strip()]
+
+
+_TRUSTED_PROXIES = parse_networks(ADMISSION_TRUSTED_PROXIES)
+
+
+def client_identity(
+    peer: Optional[str],
+    forwarded_for: Optional[str] = None,
+    api_key: Optional[str] = None,
+    api_keys: Optional[FrozenSet[str]] = None,
+    trusted_proxies: Optional[List] = None,
+) -> str:
+    """
+    Key of the rate limit bucket of a request. Headers sent by the client are only believed when verifiable:
+    a configured API key (its hash is the key), or the X-Forwarded-For hops appended by trusted proxies, read
+    from the right up to the first address that is not a trusted proxy. Otherwise the peer address.
+    """
+    api_keys = ADMISSION_API_KEYS if api_keys is None else api_keys
+    trusted_proxies = _TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies
+    if api_key and api_key in api_keys:
+        return "key:" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+    if not peer:
+        return "anonymous"
+
+    def trusted(address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in trusted_proxies)
+
+    client = peer
+    if forwarded_for and trusted(peer):
+        for hop in reversed([hop.strip() for hop in forwarded_for.split(",")]):
+            try:
+                ipaddress.ip_address(hop)
+            except ValueError:
+                break  # not written by a proxy: the last trusted hop is the client as far as we know
+            client = hop
+            if not trusted(hop):
+                break
+    return client
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Take one token; returns 0, or the seconds until a token is available (nothing taken)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionSlot:
+    """A model slot granted by the controller; release() (or leaving `async with`) gives it back, once."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(time.monotonic() - self.started)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Admission control in front of the model calls of one worker (one event loop):
+    1. per-client token bucket (ADMISSION_RATE, ADMISSION_BURST): over the limit -> 429 at once
+    2. at most ADMISSION_MAX_IN_FLIGHT model calls; the others wait in a bounded FIFO queue per lane, each with a
+       deadline (ADMISSION_QUEUE_TIMEOUT). Queue full, deadline passed, or an expected wait already beyond the
+       deadline -> 503 at once, instead of every request slowing down
+    Answers that need no model call (FAQ, caches) never come here: they skip the queue.
+    Rejections carry a Retry-After: time to the next token (429), expected wait for a slot (503).
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        rate: float = ADMISSION_RATE,
+        burst: float = ADMISSION_BURST,
+        max_clients: int = ADMISSION_MAX_CLIENTS,
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.in_flight = 0
+        self.admitted = 0
+        self.queued = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = 0.0
+        self.shed: Counter = Counter()
+        self.hold_seconds = 1.0  # moving average of the time a slot is held, for the expected waits
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._queues: Dict[str, Deque[Tuple[asyncio.Future, float]]] = {lane: deque() for lane in LANES}
+
+    def check_rate(self, client: str) -> float:
+        """Seconds the client has to wait (0: within its rate limit, one token taken)."""
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.rate, self.burst)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket.take(time.monotonic())
+
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def expected_wait(self, lane: str) -> float:
+        """Expected seconds before a new request of this lane gets a slot (requests ahead / slots * hold time)."""
+        ahead = sum(len(self._queues[name]) for name in LANES[:LANES.index(lane) + 1])
+        return (ahead + 1) / self.max_in_flight * self.hold_seconds
+
+    def _reject(self, status_code: int, reason: str, retry_after: float):
+        self.shed[reason] += 1
+        raise AdmissionRejected(status_code, reason, retry_after)
+
+    async def admit(self, client: Optional[str] = None, lane: str = "interactive") -> AdmissionSlot:
+        """Wait for a model slot (or raise AdmissionRejected); the caller releases the returned slot."""
+        if client is not None and self.rate > 0:
+            retry_after = self.check_rate(client)
+            if retry_after:
+                self._reject(429, "rate_limited", retry_after)
+
+        if self.in_flight < self.max_in_flight and not self.queue_depth():
+            self.in_flight += 1
+            self.admitted += 1
+            return AdmissionSlot(self)
+
+        queue = self._queues[lane]
+        expected = self.expected_wait(lane)
+        if len(queue) >= self.queue_size:
+            self._reject(503, "queue_full", expected)
+        if expected > self.queue_timeout:
+            self._reject(503, "overloaded", expected)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, time.monotonic() + self.queue_timeout)
+        queue.append(entry)
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth())
+        started = time.monotonic()
+        try:
+            await asyncio.wait({future}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # Client gone while waiting: hand over a slot granted meanwhile
+            if future.done() and not future.cancelled():
+                self._release(None)
+            else:
+                self._drop(queue, entry)
+            raise
+        self.wait_seconds += time.monotonic() - started
+        # Not granted before the deadline (or dropped as expired by a release)
+        if not future.done() or future.cancelled():
+            self._drop(queue, entry)
+            self._reject(503, "deadline", self.expected_wait(lane))
+        self.admitted += 1
+        return AdmissionSlot(self)
+
+    @asynccontextmanager
+    async def slot(self, client: Optional[str] = None, lane: str = "interactive"):
+        slot = await self.admit(client, lane)
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    @staticmethod
+    def _drop(queue: Deque[Tuple[asyncio.Future, float]], entry: Tuple[asyncio.Future, float]):
+        entry[0].cancel()
+        if entry in queue:
+            queue.remove(entry)
+
+    def _release(self, held_seconds: Optional[float]):
+        if held_seconds is not None:
+            self.hold_seconds = 0.8 * self.hold_seconds + 0.2 * held_seconds
+        now = time.monotonic()
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue:
+                future, deadline = queue.popleft()
+                if not future.done() and deadline > now:
+                    future.set_result(None)  # the slot goes to this request, in_flight does not change
+                    return
+                if not future.done():
+                    future.cancel()
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": {lane: len(queue) for lane, queue in self._queues.items()},
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "average_wait_seconds": round(self.wait_seconds / self.queued, 4) if self.queued else 0.0,
+            "shed": dict(self.shed),
+            "clients": len(self._buckets),
+        }
+
+    def prometheus_lines(self) -> List[str]:
+        lines = [
+            "# HELP ev_admission_in_flight Model calls in flight in this worker.",
+            "# TYPE ev_admission_in_flight gauge",
+            f"ev_admission_in_flight {self.in_flight}",
+            "# HELP ev_admission_queue_depth Requests waiting for a model slot, by lane.",
+            "# TYPE ev_admission_queue_depth gauge",
+        ]
+        lines += [f'ev_admission_queue_depth{{lane="{lane}"}} {len(queue)}' for lane, queue in self._queues.items()]
+        lines += [
+            "# HELP ev_admission_admitted_total Requests given a model slot.",
+            "# TYPE ev_admission_admitted_total counter",
+            f"ev_admission_admitted_total {self.admitted}",
+            "# HELP ev_admission_shed_total Requests rejected by admission control, by reason.",
+            "# TYPE ev_admission_shed_total counter",
+        ]
+        lines += [
+            f'ev_admission_shed_total{{reason="{reason}"}} {self.shed[reason]}'
+            for reason in ("rate_limited", "queue_full", "overloaded", "deadline")
+        ]
+        return lines
+
+
+# One controller per worker process (the API event loop)
+@lru_cache(maxsize=None)
+def get_admission() -> AdmissionController:
+    return AdmissionController()
@@ -0,0 +1,235 @@
+"""
+Offline latency / throughput benchmark against the stub model (no Bedrock call, no server needed).
+
+    python benchmark.py --target chains api --concurrency 1 4 16 --latency 0.5 --output results.json
+    python benchmark.py --compare previous.json --output results.json
+
+Replays question sets against the utils.py pipeline (routing + answer chains) and the FastAPI /EV_response
+endpoint. Reports p50/p95/p99 latency, requests/s, errors and model calls per turn for each concurrency level.
+The response caches are cleared before each level, repeated questions inside a level can still hit them.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+ROOT_DIRECTORY = Path(__file__).resolve().parent
+QUESTION_FIELDS = ("question", "user_input", "input", "title")
+
+
+def configure_stub(latency, tokens_per_second, error_rate):
+    # Read by stub_llm.stub_model_from_env() when the apps build their model
+    os.environ["EV_STUB_MODEL"] = "1"
+    os.environ["EV_STUB_LATENCY"] = str(latency)
+    os.environ["EV_STUB_TOKENS_PER_SECOND"] = str(tokens_per_second)
+    os.environ["EV_STUB_ERROR_RATE"] = str(error_rate)
+    # All the in-process requests come from one client: no per-client rate limit (admission.py) unless set
+    os.environ.setdefault("ADMISSION_RATE", "0")
+
+
+def load_questions(sources: List[str]) -> List[str]:
+    """
+    Question sets: "examples" (2_chatbot_metrics.py), "router" (intent_router seed questions), or a file:
+    .jsonl (one of the fields question / user_input / input / title per line) or text (one question per line).
+    """
+    questions = []
+    for source in sources:
+        if source == "examples":
+            from utils import EXAMPLE_QUESTIONS
+            questions += EXAMPLE_QUESTIONS
+        elif source == "router":
+            from intent_router import TRAINING_QUESTIONS
+            questions += [question for question, _label in TRAINING_QUESTIONS]
+        elif source.endswith(".jsonl"):
+            for line in Path(source).read_text(encoding="utf-8").splitlines():
+                if line.strip():
+                    record = json.loads(line)
+                    question = next((record[field] for field in QUESTION_FIELDS if record.get(field)), None)
+                    if question:
+                        questions.append(question)
+        else:
+            questions += [line.strip() for line in Path(source).read_text(encoding="utf-8").splitlines() if line.strip()]
+    return questions
+
+
+def clear_caches():
+    from response_cache import get_response_cache
+    from semantic_cache import get_semantic_cache
+
+    get_response_cache().clear()
+    get_semantic_cache().clear()
+
+
+async def chains_request(question: str) -> int:
+    """One turn of the Streamlit pipeline; returns the number of model calls it made."""
+    from metrics import get_metrics
+    from utils import route_and_answer_async
+
+    with get_metrics().turn(question) as turn:
+        await route_and_answer_async(question, question)
+    return turn.model_calls
+
+
+def load_api():
+    """
+    Import the module of the FastAPI app in-process. Its own utils.py has the same module name as the root one:
+    it is loaded with fastapi-llm/ first on the path, then the root utils is put back.
+    """
+    root_utils = sys.modules.pop("utils", None)
+    sys.path.insert(0, str(ROOT_DIRECTORY / "fastapi-llm"))
+    try:
+        import app
+    finally:
+        sys.path.remove(str(ROOT_DIRECTORY / "fastapi-llm"))
+        sys.modules.pop("utils", None)
+        if root_utils is not None:
+            sys.modules["utils"] = root_utils
+    return app
+
+
+def make_api_request(client):
+    async def api_request(question: str) -> int:
+        response = await client.post("/EV_response", params={"user_input": question})
+        response.raise_for_status()
+        return -1  # counted from the metrics of the API (it opens its own turn)
+    return api_request
+
+
+async def run_level(request, questions: List[str], total_requests: int, concurrency: int) -> Dict:
+    from metrics import get_metrics
+
+    clear_caches()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, model_calls, errors = [], [], []
+    calls_before = get_metrics().model_calls_total
+
+    async def one_request(index):
+        question = questions[index % len(questions)]
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                calls = await request(question)
+            except Exception as e:
+                errors.append(str(e))
+                return
+            latencies.append(time.perf_counter() - started)
+            if calls >= 0:
+                model_calls.append(calls)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_request(index) for index in range(total_requests)))
+    elapsed = time.perf_counter() - started
+
+    total_calls = sum(model_calls) if model_calls else get_metrics().model_calls_total - calls_before
+    values = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total_requests / elapsed, 2),
+        "latency": {
+            name: round(float(value), 4)
+            for name, value in zip(("p50", "p95", "p99"), np.percentile(values, [50, 95, 99]))
+        } | {"mean": round(float(values.mean()), 4), "max": round(float(values.max()), 4)},
+        "model_calls_per_turn": round(total_calls / total_requests, 2),
+    }
+
+
+async def run_benchmark(targets, questions, total_requests, concurrency_levels) -> List[Dict]:
+    # One event loop for everything: the API's semaphore is bound to the loop that first uses it
+    results = []
+    for target in targets:
+        if target == "chains":
+            from utils import get_chain_registry
+            get_chain_registry()
+            request = chains_request
+            client = None
+        else:
+            import httpx
+
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=load_api().app), base_url="http://benchmark", timeout=None)
+            request = make_api_request(client)
+
+        for concurrency in concurrency_levels:
+            result = {"target": target} | await run_level(request, questions, total_requests, concurrency)
+            latency = result["latency"]
+            print(
+                f"{target:>6} concurrency {concurrency:>3}: {result['requests_per_second']:>7.1f} req/s, "
+                f"p50 {latency['p50'] * 1000:.0f} ms, p95 {latency['p95'] * 1000:.0f} ms, p99 {latency['p99'] * 1000:.0f} ms, "
+                f"{result['model_calls_per_turn']} model calls/turn, {result['errors']} errors"
+            )
+            results.append(result)
+        if client is not None:
+            await client.aclose()
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIRECTORY, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(previous: Dict, results: List[Dict]):
+    """Print the change of throughput and p95 latency against a previous results file."""
+    before = {(result["target"], result["concurrency"]): result for result in previous["results"]}
+    print(f"compared with {previous.get('commit') or 'previous run'}:")
+    for result in results:
+        old = before.get((result["target"], result["concurrency"]))
+        if old is None:
+            continue
+        rps_change = (result["requests_per_second"] / old["requests_per_second"] - 1) * 100
+        p95_change = (result["latency"]["p95"] / old["latency"]["p95"] - 1) * 100 if old["latency"]["p95"] else 0.0
+        print(f"{result['target']:>6} concurrency {result['concurrency']:>3}: req/s {rps_change:+.1f}%, p95 {p95_change:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", nargs="+", choices=["chains", "api"], default=["chains", "api"])
+    parser.add_argument("--questions", nargs="+", default=["examples", "router"],
+                        help="examples, router, or .jsonl / .txt files")
+    parser.add_argument("--requests", type=int, default=64, help="requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--latency", type=float, default=0.5, help="stub model latency in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="stub token rate (0: instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of failing stub model calls")
+    parser.add_argument("--output", help="JSON file of the results")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+
+    configure_stub(args.latency, args.tokens_per_second, args.error_rate)
+    questions = load_questions(args.questions)
+    results = asyncio.run(run_benchmark(args.target, questions, args.requests, args.concurrency))
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "questions": args.questions,
+            "distinct_questions": len(set(questions)),
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "error_rate": args.error_rate,
+        },
+        "results": results,
+    }
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), results)
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    SystemMessagePromptTemplate,
+)
+
+from prompt_cache import prefix_fingerprint, split_static_dynamic
+
+ROOT_DIRECTORY = Path(__file__).resolve().parent
+
+
+@dataclass
+class TurnCalls:
+    """Model calls made while handling one user turn."""
+    count: int = 0
+
+
+class ModelCallCounter(BaseCallbackHandler):
+    """Callback counting every model call, in total and for the current turn."""
+
+    def __init__(self):
+        self.total = 0
+        self._lock = threading.Lock()
+        self._current_turn = contextvars.ContextVar("model_calls_turn", default=None)
+
+    def _record_call(self):
+        with self._lock:
+            self.total += 1
+        turn = self._current_turn.get()
+        if turn is not None:
+            turn.count += 1
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._record_call()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._record_call()
+
+    @contextmanager
+    def turn(self):
+        """Count the model calls made inside the block: `with counter.turn() as calls: ...; calls.count`"""
+        calls = TurnCalls()
+        token = self._current_turn.set(calls)
+        try:
+            yield calls
+        finally:
+            self._current_turn.reset(token)
+
+
+@dataclass
+class RouteSpec:
+    """
+    Everything needed to compile the chain of a route.
+    The system prompt is read from system_prompt_file (or given inline with system_prompt).
+    static_context_file is inlined in the system prompt at build time, otherwise {context} stays a variable.
+    The prompt is laid out prefix-first: every block without a per-request variable goes, in order, into the
+    system message (byte-identical on every request, cacheable), the blocks with variables into the human message.
+    tier is the model tier of the route; escalate_to the tier that answers again when the output fails to parse.
+    """
+    instructions: str
+    output_parser: Any
+    system_prompt_file: Optional[str] = None
+    system_prompt: str = ""
+    static_context_file: Optional[str] = None
+    tier: str = "large"
+    escalate_to: Optional[str] = None
+
+
+class ChainRegistry:
+    """
+    Read the prompt files once and compile each route into a reusable runnable (prompt | model | parser).
+    Building a chain never calls the model, the caller invokes it exactly once per turn.
+    """
+
+    def __init__(
+        self,
+        model_factory: Callable[[str], Any],
+        root_directory: Path = ROOT_DIRECTORY,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
+    ):
+        self.model_factory = model_factory
+        self.root_directory = root_directory
+        self.call_counter = ModelCallCounter()
+        self.callbacks = [self.call_counter] + list(callbacks or [])
+        self.system_prompts: Dict[str, str] = {}
+        self.prefix_fingerprints: Dict[str, str] = {}
+        self._specs: Dict[str, RouteSpec] = {}
+        self._chains: Dict[str, Any] = {}
+        self._model_chains: Dict[str, Any] = {}
+        self._parts: Dict[str, tuple] = {}
+        self._escalation_models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def register(self, route: str, spec: RouteSpec):
+        self._specs[route] = spec
+
+    @property
+    def routes(self) -> List[str]:
+        return list(self._specs)
+
+    def _read_file(self, relative_path: str) -> str:
+        path = self.root_directory / relative_path
+        if not path.exists():
+            raise FileNotFoundError(f"{path.name} not found.")
+        return path.read_text()
+
+    def _build(self, route: str):
+        spec = self._specs[route]
+        system_prompt = self._read_file(spec.system_prompt_file) if spec.system_prompt_file else spec.system_prompt
+        if spec.static_context_file:
+            system_prompt = system_prompt.replace("{context}", self._read_file(spec.static_context_file))
+        self.system_prompts[route] = system_prompt
+
+        static_system, dynamic_system = split_static_dynamic(system_prompt)
+        static_instructions, dynamic_instructions = split_static_dynamic(spec.instructions)
+        partial_variables = {"format_instructions": spec.output_parser.get_format_instructions()}
+        static_prompt = "\n\n".join(filter(None, [static_system, static_instructions]))
+        prefix = SystemMessagePromptTemplate.from_template(static_prompt)
+        prompt = ChatPromptTemplate(
+            messages=[
+                *([prefix] if static_prompt else []),  # no empty system message
+                HumanMessagePromptTemplate.from_template("\n\n".join(filter(None, [dynamic_system, dynamic_instructions]))),
+            ],
+            partial_variables=partial_variables,
+        )
+        # Same fingerprint on every request of the route: its prefix can be served from the prompt cache
+        self.prefix_fingerprints[route] = prefix_fingerprint(prefix.format(**partial_variables).content if static_prompt else "")
+        model = self._model(spec.tier)
+        if spec.escalate_to and spec.escalate_to != spec.tier:
+            self._escalation_models[route] = self._model(spec.escalate_to)
+        self._parts[route] = (prompt, model, spec.output_parser)
+        self._model_chains[route] = prompt | model
+        self._chains[route] = self._model_chains[route] | spec.output_parser
+
+    def _model(self, tier: str):
+        # The tier goes in the run metadata: the metrics callback counts tokens and latency per tier
+        return self.model_factory(tier).with_config(callbacks=self.callbacks, metadata={"tier": tier})
+
+    def _get_built(self, chains: Dict[str, Any], route: str):
+        if route not in self._specs:
+            raise KeyError(f"Unknown route: {route}")
+        chain = chains.get(route)
+        if chain is None:
+            with self._lock:
+                if route not in chains:
+                    self._build(route)
+                chain = chains[route]
+        return chain
+
+    def get(self, route: str):
+        """Return the compiled chain of the route, building it on first use."""
+        return self._get_built(self._chains, route)
+
+    def get_model_chain(self, route: str):
+        """Return the chain of the route without its output parser (prompt | model), to stream raw tokens."""
+        return self._get_built(self._model_chains, route)
+
+    def get_parts(self, route: str) -> tuple:
+        """Return the (prompt, model, output parser) of the route, to run and time each step separately."""
+        return self._get_built(self._parts, route)
+
+    def get_escalation_model(self, route: str):
+        """Return the model that answers again when the output of the route fails to parse, or None."""
+        self._get_built(self._parts, route)
+        return self._escalation_models.get(route)
+
+    def tier(self, route: str) -> str:
+        return self._specs[route].tier
+
+    def warm_up(self):
+        """Compile every registered route (at startup)."""
+        for route in self._specs:
+            self.get(route)
@@ -0,0 +1,14 @@
+import os
+import tempfile
+
+# The tests run offline against the stub model, and the files the apps write (sessions, prompt log, index
+# artifacts) go to a temporary directory. Set before the modules read their settings at import.
+TEST_DIRECTORY = tempfile.mkdtemp(prefix="ev-tests-")
+os.environ["EV_STUB_MODEL"] = "1"
+os.environ.setdefault("EV_STUB_LATENCY", "0")
+# Every in-process request comes from the same address: no per-client rate limit (test_admission.py tests it)
+os.environ.setdefault("ADMISSION_RATE", "0")
+os.environ["HISTORY_STORE_FILE"] = os.path.join(TEST_DIRECTORY, "sessions.sqlite3")
+os.environ["PROMPT_LOG_FILE"] = os.path.join(TEST_DIRECTORY, "prompts.jsonl")
+os.environ["RETRIEVAL_INDEX_DIR"] = os.path.join(TEST_DIRECTORY, "index")
+os.environ["RESPONSE_CACHE_FILE"] = ""
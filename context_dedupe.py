@@ -0,0 +1,333 @@
+import argparse
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from retrieval import CANONICAL_CONTEXT_PATH, PARAGRAPH_SEPARATOR, estimate_tokens, get_index, normalize_text
+
+ROOT_DIRECTORY = Path(__file__).resolve().parent
+
+# Deduplication settings, overridable from the environment
+# Sources in order of preference (the first copy of a unit is the one kept). The first one is the corpus served
+# without the canonical context; its copies (parsed_data/peugeot_data_fiexed.txt, the context block of
+# prompt/formatted_system_prompt.txt) can be added, their units conflicting with the corpus are reported
+CONTEXT_SOURCES = os.getenv("CONTEXT_SOURCES", "parsed_data/peugeot_data.txt").split(",")
+DEDUPE_THRESHOLD = float(os.getenv("DEDUPE_THRESHOLD", "0.8"))  # min Jaccard similarity of near duplicates
+DEDUPE_MIN_WORDS = int(os.getenv("DEDUPE_MIN_WORDS", "8"))  # shorter units are never deduplicated
+MINHASH_PERMUTATIONS = 128
+LSH_BANDS = 32  # 32 bands of 4 rows: pairs above ~0.5 similarity become candidates, then are checked
+SHINGLE_WORDS = 3
+
+# Navigation / call-to-action lines of the scraped pages (compared after normalize_key)
+BOILERPLATE_LINES = {
+    "en savoir plus",
+    "configurez et commandez",
+    "new",
+    "reservez votre essai",
+    "decouvrez nos vehicules electriques",
+    "end paragraph",
+}
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+SPACES_PATTERN = re.compile(r"[ \t\u00a0\u202f]+")
+TABLE_SEPARATOR_CELL = re.compile(r"^:?-+:?$")
+HASH_PRIME = (1 << 32) + 15  # > the 32-bit shingle hashes, a * x + b stays in 64 bits
+
+
+def normalize_key(text: str) -> str:
+    """Words of the text, lowercase and without accents or punctuation: the key of exact duplicates."""
+    return " ".join(WORD_PATTERN.findall(normalize_text(text)))
+
+
+def read_source(path: Path) -> str:
+    """Text of a source; for a prompt file, only its <context>...</context> block."""
+    text = path.read_text(encoding="utf-8")
+    start, end = text.find("<context>"), text.rfind("</context>")
+    if start != -1 and end > start:
+        return text[start + len("<context>"):end]
+    return text
+
+
+def compact_table(lines: List[str]) -> str:
+    """Markdown table without cell padding and empty rows, separator rows reduced to |---|."""
+    rows = []
+    for line in lines:
+        cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+        if not any(cells):
+            continue
+        if all(TABLE_SEPARATOR_CELL.match(cell) for cell in cells):
+            cells = ["---"] * len(cells)
+        rows.append("| " + " | ".join(cells) + " |")
+    return "\n".join(rows)
+
+
+def split_units(section: str) -> List[str]:
+    """Normalized units of a section: one per non-empty line, consecutive table lines grouped in one unit."""
+    units = []
+    table: List[str] = []
+    for line in section.splitlines():
+        line = SPACES_PATTERN.sub(" ", line).strip()
+        if line.startswith("|"):
+            table.append(line)
+            continue
+        if table:
+            units.append(compact_table(table))
+            table = []
+        if line:
+            units.append(line)
+    if table:
+        units.append(compact_table(table))
+    return [unit for unit in units if unit]
+
+
+class MinHasher:
+    """MinHash signatures of word shingles (universal hashing a * x + b mod p, fixed seed: reproducible)."""
+
+    def __init__(self, permutations: int = MINHASH_PERMUTATIONS, shingle_words: int = SHINGLE_WORDS, seed: int = 1):
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, 1 << 31, size=permutations).astype(np.uint64)
+        self.b = generator.randint(0, 1 << 31, size=permutations).astype(np.uint64)
+        self.shingle_words = shingle_words
+
+    def shingles(self, words: List[str]) -> np.ndarray:
+        size = min(self.shingle_words, len(words))
+        return np.array(
+            sorted({
+                int.from_bytes(hashlib.blake2b(" ".join(words[index:index + size]).encode(), digest_size=4).digest(), "big")
+                for index in range(len(words) - size + 1)
+            }),
+            dtype=np.uint64,
+        )
+
+    def signature(self, words: List[str]) -> np.ndarray:
+        values = self.shingles(words)
+        # One row per permutation, the min over the shingles
+        hashed = (np.outer(self.a, values) + self.b[:, None]) % np.uint64(HASH_PRIME)
+        return hashed.min(axis=1)
+
+
+class NearDuplicateIndex:
+    """LSH over MinHash signatures: only units sharing a band are compared."""
+
+    def __init__(self, threshold: float = DEDUPE_THRESHOLD, bands: int = LSH_BANDS, hasher: Optional[MinHasher] = None):
+        self.threshold = threshold
+        self.hasher = hasher or MinHasher()
+        self.bands = bands
+        self.rows = len(self.hasher.a) // bands
+        self.buckets: Dict[tuple, List[int]] = {}
+        self.signatures: List[np.ndarray] = []
+        self.figures: List[tuple] = []
+        self.sources: List[int] = []
+
+    def _band_keys(self, signature: np.ndarray) -> List[tuple]:
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def similar(self, signature: np.ndarray) -> List[int]:
+        """Ids of the stored units similar enough, in insertion order."""
+        candidates = {unit_id for key in self._band_keys(signature) for unit_id in self.buckets.get(key, [])}
+        return [
+            unit_id for unit_id in sorted(candidates)
+            if np.mean(self.signatures[unit_id] == signature) >= self.threshold
+        ]
+
+    def find(self, signature: np.ndarray, figures: tuple) -> Optional[int]:
+        """Id of a stored unit similar enough with the same figures, or None."""
+        return next((unit_id for unit_id in self.similar(signature) if self.figures[unit_id] == figures), None)
+
+    def add(self, signature: np.ndarray, figures: tuple, source: int = 0) -> int:
+        unit_id = len(self.signatures)
+        self.signatures.append(signature)
+        self.figures.append(figures)
+        self.sources.append(source)
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, []).append(unit_id)
+        return unit_id
+
+
+@dataclass
+class DedupeReport:
+    tokens_before: Dict[str, int]  # per source
+    tokens_served: int  # the corpus served without the canonical context (first source)
+    tokens_after: int
+    units: int
+    boilerplate: int
+    exact_duplicates: int
+    near_duplicates: int
+    orphan_lines: int
+    dropped_sections: int
+    sections: int
+    conflicts: List[Tuple[str, str]]  # (unit of a later source, unit kept) similar text with other figures
+    written: bool = False
+
+    @property
+    def servable(self) -> bool:
+        """The canonical context replaces the served corpus only when smaller and without conflicting figures."""
+        return self.tokens_after < self.tokens_served and not self.conflicts
+
+    def print(self):
+        for source, tokens in self.tokens_before.items():
+            print(f"{source}: ~{tokens} tokens")
+        print(
+            f"served corpus: ~{self.tokens_served} tokens, canonical context: ~{self.tokens_after} tokens "
+            f"({self.tokens_after / max(1, self.tokens_served):.0%})"
+        )
+        print(
+            f"{self.units} units: {self.boilerplate} boilerplate, {self.exact_duplicates} exact and "
+            f"{self.near_duplicates} near duplicates, {self.orphan_lines} headings of removed content removed, "
+            f"{len(self.conflicts)} conflicting figures; {self.sections} sections kept, {self.dropped_sections} dropped"
+        )
+        for unit, kept in self.conflicts[:10]:
+            print(f"conflict: {unit[:100]!r}\n     kept: {kept[:100]!r}")
+        if not self.servable:
+            reason = "conflicting figures" if self.conflicts else "not smaller than the served corpus"
+            print(f"canonical context not served ({reason})" + ("" if self.written else ", not written"))
+
+
+def dedupe_sections(sources: Dict[str, str], threshold: float = DEDUPE_THRESHOLD, min_words: int = DEDUPE_MIN_WORDS):
+    """Canonical sections of the sources (dict name -> text, in order of preference) and the removal counts."""
+    near_duplicates = NearDuplicateIndex(threshold)
+    kept_units: List[str] = []  # text of each unit of the near duplicate index
+    seen = set()
+    seen_short = set()
+    counts = {
+        "units": 0, "boilerplate": 0, "exact_duplicates": 0, "near_duplicates": 0, "orphan_lines": 0, "dropped_sections": 0,
+    }
+    conflicts: List[Tuple[str, str]] = []
+    sections = []
+
+    for source, text in enumerate(sources.values()):
+        for section in text.split(PARAGRAPH_SEPARATOR):
+            # Status of each unit: "short" (heading, value), "kept" or removed ("boilerplate", "exact", "near")
+            units = []
+            for unit in split_units(section):
+                counts["units"] += 1
+                key = normalize_key(unit)
+                words = key.split()
+                if key in BOILERPLATE_LINES:
+                    counts["boilerplate"] += 1
+                    continue
+                if len(words) < min_words and not unit.startswith("|"):
+                    units.append((unit, key, "short"))
+                    continue
+                if key in seen:
+                    counts["exact_duplicates"] += 1
+                    units.append((unit, key, "exact"))
+                    continue
+                seen.add(key)
+                # Tables only go away when identical: two spec tables differ by a few figures only
+                if not unit.startswith("|"):
+                    signature = near_duplicates.hasher.signature(words)
+                    figures = tuple(sorted(word for word in words if word.isdigit()))
+                    similar = near_duplicates.similar(signature)
+                    if any(near_duplicates.figures[unit_id] == figures for unit_id in similar):
+                        counts["near_duplicates"] += 1
+                        units.append((unit, key, "near"))
+                        continue
+                    # Same text as a unit of an earlier source but other figures: the earlier source wins
+                    earlier = [unit_id for unit_id in similar if near_duplicates.sources[unit_id] < source]
+                    if earlier:
+                        conflicts.append((unit, kept_units[earlier[0]]))
+                        units.append((unit, key, "conflict"))
+                        continue
+                    near_duplicates.add(signature, figures, source)
+                    kept_units.append(unit)
+                units.append((unit, key, "kept"))
+
+            # A run of short lines goes with its content: dropped when the content around it was all removed
+            kept = []
+            index = 0
+            while index < len(units):
+                if units[index][2] != "short":
+                    if units[index][2] == "kept":
+                        kept.append(units[index])
+                    index += 1
+                    continue
+                end = index
+                while end < len(units) and units[end][2] == "short":
+                    end += 1
+                neighbours = [units[position][2] for position in (index - 1, end) if 0 <= position < len(units)]
+                if neighbours and "kept" not in neighbours:
+                    counts["orphan_lines"] += end - index
+                else:
+                    kept.extend(units[index:end])
+                index = end
+
+            # Sections of short lines only are dropped when everything in them was already seen
+            if kept and all(status == "short" for _unit, _key, status in kept):
+                if len(kept) < len(units) or all(key in seen_short for _unit, key, _status in kept):
+                    counts["dropped_sections"] += 1
+                    continue
+            seen_short.update(key for _unit, key, status in kept if status == "short")
+            if kept:
+                sections.append("\n".join(unit for unit, _key, _status in kept))
+    return sections, counts, conflicts
+
+
+def build_canonical_context(
+    sources: Iterable[str] = CONTEXT_SOURCES,
+    output_path: Path = CANONICAL_CONTEXT_PATH,
+    threshold: float = DEDUPE_THRESHOLD,
+    min_words: int = DEDUPE_MIN_WORDS,
+    force: bool = False,
+) -> DedupeReport:
+    """
+    Build the canonical context (same <>end_paragraph<> format as the corpus) and report the tokens against the
+    served corpus (first source). It is only written when servable (or with force); otherwise a previous
+    artifact is removed, so that retrieval.py keeps serving the corpus.
+    """
+    texts = {}
+    for source in sources:
+        path = Path(source) if Path(source).is_absolute() else ROOT_DIRECTORY / source
+        if path.exists():
+            texts[source] = read_source(path)
+        else:
+            print(f"Context source {source} not found, skipped")
+
+    sections, counts, conflicts = dedupe_sections(texts, threshold, min_words)
+    content = "".join(section + "\n" + PARAGRAPH_SEPARATOR + "\n" for section in sections)
+    tokens_before = {source: estimate_tokens(text) for source, text in texts.items()}
+    report = DedupeReport(
+        tokens_before=tokens_before,
+        tokens_served=next(iter(tokens_before.values()), 0),
+        tokens_after=estimate_tokens(content),
+        sections=len(sections),
+        conflicts=conflicts,
+        **counts,
+    )
+
+    output_path = Path(output_path)
+    if report.servable or force:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        # Readers (the apps loading their index) never see a half-written file
+        temporary = output_path.with_name(output_path.name + ".tmp")
+        temporary.write_text(content, encoding="utf-8")
+        os.replace(temporary, output_path)
+        report.written = True
+    else:
+        output_path.unlink(missing_ok=True)
+    get_index.cache_clear()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicate the parsed context into the canonical context")
+    parser.add_argument("--sources", nargs="+", default=CONTEXT_SOURCES, help="in order of preference, served corpus first")
+    parser.add_argument("--output", default=str(CANONICAL_CONTEXT_PATH))
+    parser.add_argument("--threshold", type=float, default=DEDUPE_THRESHOLD, help="near duplicate Jaccard similarity")
+    parser.add_argument("--min-words", type=int, default=DEDUPE_MIN_WORDS, help="shorter units are always kept")
+    parser.add_argument("--force", action="store_true", help="write the output even when it is not servable")
+    args = parser.parse_args()
+
+    report = build_canonical_context(args.sources, Path(args.output), args.threshold, args.min_words, args.force)
+    report.print()
+    if report.written:
+        print(f"canonical context: {args.output} ({len(get_index(args.output).paragraphs)} paragraphs in the search index)")
+
+
+if __name__ == "__main__":
+    main()
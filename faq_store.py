@@ -0,0 +1,174 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from ingestion import MANIFEST_FILE
+from model_client import MODEL_TIERS, ROUTE_MODEL_TIERS, is_canned_answer
+from response_cache import normalize_question
+from stub_llm import stub_model_enabled
+
+ROOT_DIRECTORY = Path(__file__).resolve().parent
+
+# FAQ answer store settings, overridable from the environment
+FAQ_STORE_FILE = os.getenv("FAQ_STORE_FILE", str(ROOT_DIRECTORY / "faq" / "answers.json"))  # empty: no FAQ store
+# The answers are valid for one version of these directories (prompts and parsed context), of the code that
+# routes and builds the chains, and of the models; bump FAQ_SCHEMA_VERSION when the stored answers change shape
+FAQ_VERSIONED_DIRECTORIES = ("prompt", "parsed_data")
+FAQ_VERSIONED_FILES = ("utils.py", "fastapi-llm/utils.py", "chain_registry.py", "intent_router.py", "spec_store.py")
+FAQ_UNVERSIONED_FILES = {MANIFEST_FILE}  # ingestion bookkeeping: rewritten by a run that changes nothing
+FAQ_SCHEMA_VERSION = "2"
+
+# Known frequent questions, answered by the warm-up job besides utils.EXAMPLE_QUESTIONS and the mined ones
+FAQ_QUESTIONS = [
+    "Quels sont les modèles électriques Peugeot ?",
+    "Quelle est la gamme de véhicules électriques Peugeot ?",
+    "Combien coûte une recharge ?",
+    "Combien coûte la recharge à domicile ?",
+    "Quel est le prix de la recharge sur une borne publique ?",
+    "Quelle est la garantie de la batterie ?",
+    "Qu'est-ce que Peugeot Allure Care ?",
+    "Quelle est la garantie des véhicules électriques Peugeot ?",
+]
+
+
+def model_settings() -> Dict[str, Any]:
+    """What decides which model answers: the model ids of the tiers, the tier of each route, the stub."""
+    return {
+        "models": MODEL_TIERS,
+        "route_tiers": ROUTE_MODEL_TIERS,
+        "stub": stub_model_enabled(),
+    }
+
+
+def content_version(
+    directories: Iterable[str] = FAQ_VERSIONED_DIRECTORIES,
+    root: Path = ROOT_DIRECTORY,
+    files: Iterable[str] = FAQ_VERSIONED_FILES,
+    settings: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Hash of the path and content of every file in the directories and of the code files, of the model settings
+    and of the schema version: any change gives a new version.
+    """
+    digest = hashlib.sha256(FAQ_SCHEMA_VERSION.encode("utf-8") + b"\0")
+    digest.update(json.dumps(model_settings() if settings is None else settings, sort_keys=True).encode("utf-8"))
+    paths = [path for directory in directories for path in sorted((root / directory).rglob("*"))]
+    paths += [root / name for name in files if (root / name).exists()]
+    for path in paths:
+        if not path.is_file() or path.name.startswith(".") or path.suffix == ".tmp" or path.name in FAQ_UNVERSIONED_FILES:
+            continue
+        digest.update(path.relative_to(root).as_posix().encode("utf-8") + b"\0")
+        digest.update(hashlib.sha256(path.read_bytes()).digest())
+    return digest.hexdigest()[:16]
+
+
+def is_valid_answer(answer: Any) -> bool:
+    """An answer worth serving: the JSON of the chains ({"response", "key_words"}) or the API text, not canned."""
+    if isinstance(answer, dict):
+        return (
+            isinstance(answer.get("response"), str)
+            and bool(answer["response"].strip())
+            and isinstance(answer.get("key_words"), list)
+            and not is_canned_answer(answer)
+        )
+    return isinstance(answer, str) and bool(answer.strip()) and not is_canned_answer(answer)
+
+
+def mine_frequent_questions(log_files: Iterable[Path], top: int = 50, min_count: int = 3) -> List[str]:
+    """Most frequent questions of the prompt logs (prompt_log.py JSONL, rotated files included)."""
+    counts: Counter = Counter()
+    first_seen: Dict[str, str] = {}
+    for log_file in log_files:
+        if not Path(log_file).exists():
+            continue
+        for line in Path(log_file).read_text(encoding="utf-8").splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            question = record.get("user_input") if record.get("type") == "request" else None
+            if question:
+                key = normalize_question(question)
+                counts[key] += 1
+                first_seen.setdefault(key, question)
+    return [first_seen[key] for key, count in counts.most_common(top) if count >= min_count]
+
+
+class FaqStore:
+    """
+    Answers of known questions, computed offline by warm_faq.py and served without any model call.
+    Entries are grouped by app ("chains": Streamlit chains, "api": FastAPI) and keyed by normalized question.
+    A store written for another content version (prompts, parsed context, chain code, models) is stale: not served.
+    """
+
+    def __init__(self, version: str, entries: Optional[Dict[str, Dict[str, Dict]]] = None, created_at: str = ""):
+        self.version = version
+        self.entries: Dict[str, Dict[str, Dict]] = entries or {}
+        self.created_at = created_at
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str = FAQ_STORE_FILE, version: Optional[str] = None) -> "FaqStore":
+        """Load the store; empty when the file is missing or was written for another content version."""
+        version = version or content_version()
+        if not path or not Path(path).exists():
+            return cls(version)
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if data.get("version") != version:
+            print(f"FAQ store {path} is stale (version {data.get('version')}, content is {version}): not served")
+            return cls(version)
+        return cls(version, data.get("entries", {}), data.get("created_at", ""))
+
+    def get(self, app: str, question: str, count: bool = True) -> Optional[Dict]:
+        entry = self.entries.get(app, {}).get(normalize_question(question))
+        if not count:
+            return copy.deepcopy(entry)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return copy.deepcopy(entry)
+
+    def add(self, app: str, question: str, answer: Any, **fields: Any) -> bool:
+        """Store a validated answer; returns False (nothing stored) when the answer is not valid."""
+        if not is_valid_answer(answer):
+            return False
+        self.entries.setdefault(app, {})[normalize_question(question)] = {"question": question, "answer": answer, **fields}
+        return True
+
+    def save(self, path: str = FAQ_STORE_FILE):
+        data = {
+            "version": self.version,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "entries": self.entries,
+        }
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Instances reading the store at startup never see a half-written file
+        temporary = path.with_name(path.name + ".tmp")
+        temporary.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(temporary, path)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "entries": {app: len(entries) for app, entries in self.entries.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# One store per process, loaded at startup
+@lru_cache(maxsize=None)
+def get_faq_store() -> FaqStore:
+    return FaqStore.load()
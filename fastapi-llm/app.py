@@ -1,34 +1,336 @@
-from fastapi import FastAPI, HTTPException
-from utils import initialize_chain, add_message_to_history
+import asyncio
+import json
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from utils import initialize_chain, add_message_to_history, get_context, get_history_messages, warm_up
 from botocore.exceptions import ClientError
+from pydantic import BaseModel
+from admission import AdmissionRejected, client_identity, get_admission
+from faq_store import get_faq_store
+from history_store import get_history_store
+from intent_router import get_intent_router
+from response_cache import get_response_cache, normalize_question
+from semantic_cache import get_semantic_cache
+from metrics import get_metrics
+from model_client import is_canned_answer, is_retryable, prometheus_lines
 import os
 
+# Batch endpoint: max questions per request, and max model calls in flight per batch (within API_MAX_CONCURRENCY)
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+# Warm-up state of this worker process, reported by /ready
+warmup_state = {"ready": False, "timings": {}, "error": None, "worker": os.getpid()}
+
+
+async def run_warm_up():
+    started = time.perf_counter()
+    try:
+        # Blocking file reads and index build: in a thread, so /ready answers during the warm-up
+        warmup_state["timings"] = await asyncio.to_thread(warm_up)
+        warmup_state["timings"]["total"] = time.perf_counter() - started
+        warmup_state["ready"] = True
+        print(f"Warm-up done: {warmup_state['timings']}")
+    except Exception as e:
+        warmup_state["error"] = str(e)
+        print(f"Warm-up failed: {e}")
+
+
+# Preload the chain, the model client and the retrieval index once, at startup
+@asynccontextmanager
+async def lifespan(app):
+    warmup_task = asyncio.create_task(run_warm_up())
+    yield
+    warmup_task.cancel()
+    # Write the conversation messages still pending (persistent session store)
+    get_history_store().close()
+
+
 # Initialize FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Check the current working directory
 print(f"Current working directory: {os.getcwd()}")  # <-- Print the current working directory
 
+
+# The helpers below read or write the session store and the response cache (SQLite files shared by the workers,
+# waiting up to 5 s on a lock): the routes call them in a thread (asyncio.to_thread), never on the event loop
+
+# Answer of the FAQ store, or cached answer (exact or paraphrase) of a question in this conversation, or None
+def get_cached_text(user_input, history):
+    metrics = get_metrics()
+    with metrics.stage("cache"):
+        faq = get_faq_store().get("api", user_input)
+        if faq is not None:
+            metrics.record_cache("faq")
+            return faq["answer"]
+        cache = get_response_cache()
+        text = cache.get("api", user_input, history)
+        if text is not None:
+            metrics.record_cache("exact")
+            return text
+        # Paraphrase of a question already answered
+        match = get_semantic_cache().lookup("api", user_input, history)
+        if match is not None:
+            text = match[0]
+            cache.set("api", user_input, history, text)
+            metrics.record_cache("semantic")
+    return text
+
+
+def cache_text(user_input, history, text):
+    # The canned answer of the circuit breaker is not an answer to this question
+    if is_canned_answer(text):
+        return
+    get_response_cache().set("api", user_input, history, text)
+    get_semantic_cache().add("api", user_input, history, text)
+
+
+def store_text(session_id, user_input, history, text):
+    cache_text(user_input, history, text)
+    # Add the user input and AI response to the chat history of the session
+    add_message_to_history(session_id, "human", user_input)
+    add_message_to_history(session_id, "assistant", text)
+
+
+# True when the answer is in the FAQ store or the response cache (a peek: counters unchanged)
+def is_cached(session_id, user_input):
+    if get_faq_store().get("api", user_input, count=False) is not None:
+        return True
+    history = "\n".join(message.content for message in get_history_messages(session_id))
+    return get_response_cache().get("api", user_input, history, count=False) is not None
+
+
+# Client of a request, for the per-client rate limit: a configured API key, else the client address (forwarded
+# by a trusted proxy). A header the client can set freely (X-Client-Id) would let it pick its own bucket
+def client_id(request):
+    return client_identity(
+        request.client.host if request.client else None,
+        forwarded_for=request.headers.get("x-forwarded-for"),
+        api_key=request.headers.get("x-api-key"),
+    )
+
+
+# Requests shed by admission control (admission.py): 429 (client over its rate) or 503 (overloaded), never queued
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected(request, e):
+    return JSONResponse(
+        {"detail": str(e), "reason": e.reason},
+        status_code=e.status_code,
+        headers={"Retry-After": e.retry_after_header},
+    )
+
+
+# Chain inputs and history text (for the cache keys) of a question in a session (no session: no history)
+def prepare_inputs(session_id, user_input):
+    history_messages = get_history_messages(session_id) if session_id else []
+    history = "\n".join(message.content for message in history_messages)
+    with get_metrics().stage("retrieval"):
+        context = get_context(user_input)
+    inputs = {"input": user_input, "context": context, "history": history_messages}
+    return inputs, history
+
+
+# Readiness probe: 200 once the warm-up is done, 503 before (or if it failed)
+@app.get("/ready")
+async def ready():
+    return JSONResponse(warmup_state, status_code=200 if warmup_state["ready"] else 503)
+
+
+# Prometheus metrics of this worker: turns by route and cache result, model calls, tokens, stage durations
+@app.get("/metrics")
+async def prometheus_metrics():
+    text = get_metrics().prometheus_text() + "\n".join(prometheus_lines() + get_admission().prometheus_lines()) + "\n"
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
 # Route to get a response from the Claude model
+# Without session_id a new conversation is started, its id is returned to continue it
+# Answers from the FAQ store or the caches skip admission control; model calls go through it (429/503 when shed)
 @app.post("/EV_response")
-async def get_response(user_input: str):
+async def get_response(request: Request, user_input: str, session_id: Optional[str] = None):
+    session_id = session_id or uuid.uuid4().hex
+    metrics = get_metrics()
     try:
-        # Initialize the chain with user input
-        chain = initialize_chain()
-        
-        print(f"Type of chain in app: {type(chain)}")
-        # Invoke the chain to process the input and get the response
-        response = chain.invoke({"input": user_input})
+        with metrics.turn(user_input):
+            metrics.set_route("api")
+            inputs, history = await asyncio.to_thread(prepare_inputs, session_id, user_input)
 
-        # Add the user input and AI response to the chat history
-        add_message_to_history("human", user_input)
-        add_message_to_history("assistant", response)
+            # Common questions are answered from the shared response cache, without calling the model
+            text = await asyncio.to_thread(get_cached_text, user_input, history)
+            if text is None:
+                # Chain built once at startup (initialize_chain is cached)
+                chain = initialize_chain()
 
-        return {"response": response}
+                # Invoke the chain without blocking the event loop, once admitted (rate limit, model slot)
+                with metrics.stage("admission"):
+                    slot = await get_admission().admit(client_id(request))
+                async with slot:
+                    with metrics.stage("model_call"):
+                        text = await chain.ainvoke(inputs)
+            await asyncio.to_thread(store_text, session_id, user_input, history, text)
 
+        return {"response": {"input": user_input, "text": text}, "session_id": session_id}
+
+    except AdmissionRejected:
+        raise
     except FileNotFoundError as e:
         raise HTTPException(status_code=500, detail=str(e))
-    except ClientError as e:
-        raise HTTPException(status_code=500, detail=f"AWS Client Error: {str(e)}")
     except Exception as e:
+        # Still throttled (or Bedrock unavailable) after the retries of the model client
+        if is_retryable(e):
+            raise HTTPException(status_code=503, detail="Model temporarily unavailable", headers={"Retry-After": "5"})
+        if isinstance(e, ClientError):
+            raise HTTPException(status_code=500, detail=f"AWS Client Error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
+
+
+# Format a Server-Sent Event
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+# Route to stream the response token by token (Server-Sent Events): "data" events carry the tokens,
+# a final "done" event carries the whole text and the session id, an "error" event is sent if the call fails
+@app.api_route("/EV_response/stream", methods=["GET", "POST"])
+async def stream_response(request: Request, user_input: str, session_id: Optional[str] = None):
+    session_id = session_id or uuid.uuid4().hex
+    # Admitted before the stream starts, so that a shed request gets a real 429/503 (cached answers skip it)
+    cached = await asyncio.to_thread(is_cached, session_id, user_input)
+    slot = None if cached else await get_admission().admit(client_id(request))
+
+    async def events(slot):
+        metrics = get_metrics()
+        try:
+            with metrics.turn(user_input):
+                metrics.set_route("api_stream")
+                inputs, history = await asyncio.to_thread(prepare_inputs, session_id, user_input)
+                text = await asyncio.to_thread(get_cached_text, user_input, history)
+                if text is not None:
+                    if slot is not None:
+                        slot.release()
+                    await asyncio.to_thread(store_text, session_id, user_input, history, text)
+                    yield sse_event({"token": text})
+                    yield sse_event({"input": user_input, "text": text, "session_id": session_id}, event="done")
+                    return
+
+                tokens = []
+                try:
+                    chain = initialize_chain()
+                    # Cache entry gone since the peek: admitted now
+                    slot = slot or await get_admission().admit(client_id(request))
+                    with metrics.stage("model_call"):
+                        async for token in chain.astream(inputs):
+                            tokens.append(token)
+                            yield sse_event({"token": token})
+                except Exception as e:
+                    yield sse_event({"detail": str(e)}, event="error")
+                    return
+                slot.release()
+
+                text = "".join(tokens)
+                await asyncio.to_thread(store_text, session_id, user_input, history, text)
+                yield sse_event({"input": user_input, "text": text, "session_id": session_id}, event="done")
+        finally:
+            # Error, client gone or cached answer: the slot is given back (release() only acts once)
+            if slot is not None:
+                slot.release()
+
+    # Also given back after the response when the stream never started (client gone before the first event)
+    background = BackgroundTask(slot.release) if slot is not None else None
+    return StreamingResponse(events(slot), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}, background=background)
+
+
+class BatchRequest(BaseModel):
+    questions: List[str]
+    concurrency: int = BATCH_MAX_CONCURRENCY
+    stream: bool = False
+
+
+# Answer one distinct question of a batch (no conversation history), errors are returned, not raised
+async def answer_batch_question(user_input, route, batch_slots):
+    started = time.perf_counter()
+    metrics = get_metrics()
+    try:
+        with metrics.turn(user_input):
+            metrics.set_route("api_batch", route.source)
+            inputs, history = await asyncio.to_thread(prepare_inputs, None, user_input)
+            text = await asyncio.to_thread(get_cached_text, user_input, history)
+            cached = text is not None
+            if text is None:
+                chain = initialize_chain()
+                # Batch lane: a freed model slot goes to the interactive requests first, no per-client rate limit
+                async with batch_slots, get_admission().slot(lane="batch"):
+                    with metrics.stage("model_call"):
+                        text = await chain.ainvoke(inputs)
+                await asyncio.to_thread(cache_text, user_input, history, text)
+        return {"text": text, "cached": cached, "error": None, "seconds": round(time.perf_counter() - started, 4)}
+    except Exception as e:
+        return {"text": None, "cached": False, "error": str(e), "seconds": round(time.perf_counter() - started, 4)}
+
+
+# Route to answer a list of independent questions (QA and content checks):
+# identical questions (after normalization) are answered once, all are routed in one local classification pass,
+# at most `concurrency` model calls run at the same time. Results come back in input order, with
+# "stream": true as NDJSON lines in completion order (each with its index), then a summary line.
+@app.post("/EV_response/batch")
+async def batch_response(batch: BatchRequest):
+    if len(batch.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    started = time.perf_counter()
+
+    # Dedupe: index of the questions sharing each normalized form, the first one is answered
+    groups = {}
+    for index, question in enumerate(batch.questions):
+        groups.setdefault(normalize_question(question), []).append(index)
+    unique = list(groups.values())
+    routes = get_intent_router().route_batch([batch.questions[indexes[0]] for indexes in unique])
+    batch_slots = asyncio.Semaphore(max(1, min(batch.concurrency, BATCH_MAX_CONCURRENCY)))
+
+    async def answer(indexes, route):
+        answered = await answer_batch_question(batch.questions[indexes[0]], route, batch_slots)
+        return [
+            {
+                "index": index,
+                "input": batch.questions[index],
+                "route": route.label,
+                "duplicate_of": indexes[0] if index != indexes[0] else None,
+                **answered,
+            }
+            for index in indexes
+        ]
+
+    tasks = [asyncio.create_task(answer(indexes, route)) for indexes, route in zip(unique, routes)]
+
+    def summary(results):
+        return {
+            "questions": len(batch.questions),
+            "unique_questions": len(unique),
+            "errors": sum(1 for result in results if result["error"]),
+            "seconds": round(time.perf_counter() - started, 4),
+        }
+
+    if batch.stream:
+        async def lines():
+            results = []
+            try:
+                for task in asyncio.as_completed(tasks):
+                    for result in await task:
+                        results.append(result)
+                        yield json.dumps(result, ensure_ascii=False) + "\n"
+                yield json.dumps({"done": True, **summary(results)}, ensure_ascii=False) + "\n"
+            finally:
+                # Client gone: stop the questions not answered yet
+                for task in tasks:
+                    task.cancel()
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    results = sorted((result for group in await asyncio.gather(*tasks) for result in group), key=lambda result: result["index"])
+    return {"results": results, **summary(results)}
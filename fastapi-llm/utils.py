@@ -1,73 +1,119 @@
-import contextvars
+import os
+import time
+from functools import lru_cache
 from pathlib import Path
 import boto3
-from langchain_aws import ChatBedrock
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.output_parsers import StrOutputParser
 from langchain.memory import ConversationBufferMemory
 from langchain.chains import LLMChain
 from botocore.exceptions import ClientError
+from faq_store import get_faq_store
+from history_store import get_history_store
+from metrics import get_metrics
+from retrieval import DEFAULT_CONTEXT_PATH, get_index, retrieve_context
+from model_client import get_tier_model, route_tier
+from prompt_cache import split_static_dynamic
 
-# Set up a context variable to manage chat history
-chat_history_var = contextvars.ContextVar("chat_history", default=[])
-
-# Function to choose the Claude model from Bedrock
+# Function to choose the Claude model from Bedrock (or the offline stub, EV_STUB_MODEL=1), tier of the "api"
+# route in ROUTE_MODEL_TIERS. One model (and pooled boto3 client, retries, circuit breaker: model_client.py) per process
 def choose_model():
-    return ChatBedrock(model_id="anthropic.claude-3-5-sonnet-20240620-v1:0")
+    return get_tier_model(route_tier("api"))
 
 # Function to manage memory for conversation
 def get_memory():
     return ConversationBufferMemory(return_messages=True)
 
-# Function to initialize the chain with system prompt, context, and memory
+# Function to initialize the chain with system prompt and context
+# Built once per process (at startup, see warm_up) and shared read-only by all the requests
+@lru_cache(maxsize=None)
 def initialize_chain():
     """
     Initialize the conversation chain with system prompt, context, message history, and user input.
+    The {context} placeholder stays a prompt variable: it is filled per question by get_context().
     """
     current_directory = Path(__file__).resolve().parent.parent  # Adjust based on your directory structure
     print(f"Current directory for utils.py: {current_directory}")  # <-- Print the current directory
 
     system_prompt_path = current_directory / "prompt/system_prompt.txt"
-    context_path = current_directory / "parsed_data/peugeot_data.txt"
+    context_path = DEFAULT_CONTEXT_PATH  # canonical context (context_dedupe.py), else parsed_data/peugeot_data.txt
 
     print(f"System prompt path: {system_prompt_path}")  # <-- Print the path to system_prompt.txt
-    print(f"Context path: {context_path}")  # <-- Print the path to peugeot_data.txt
+    print(f"Context path: {context_path}")  # <-- Print the path to the context file
 
     if not system_prompt_path.exists():
         raise FileNotFoundError("System prompt file not found.")
     if not context_path.exists():
         raise FileNotFoundError("Context file not found.")
 
-    # Read system prompt and context from files
+    # Read system prompt from file and build the retrieval index over the context
     system_prompt = system_prompt_path.read_text()
-    context = context_path.read_text()
-
-    # Replace placeholder {context} in system prompt with actual context content
-    formatted_system_prompt = system_prompt.replace("{context}", context)
+    get_index(str(context_path))
 
-    # Define the prompt with system prompt and user input
+    # Define the prompt with system prompt, the session history and user input.
+    # The system message only holds the static blocks of the system prompt (same bytes on every request, so
+    # the model can cache it), the blocks reading {context} go with the user input.
+    static_prompt, dynamic_prompt = split_static_dynamic(system_prompt)
     prompt = ChatPromptTemplate.from_messages([
-        ("system", formatted_system_prompt),
-        ("human", "{input}")
+        *([("system", static_prompt)] if static_prompt else []),
+        MessagesPlaceholder("history", optional=True),
+        ("human", "\n\n".join(filter(None, [dynamic_prompt, "{input}"])))
     ])
 
-    # Get the Bedrock model
-    bedrock_llm = choose_model()
-
-    # Create a chain with memory and a prompt
-    memory = get_memory()
-    chain = LLMChain(
-        llm=bedrock_llm,
-        prompt=prompt,
-        memory=memory,
-        output_parser=StrOutputParser()
-    )
+    # Get the Bedrock model (its calls, tokens and latency are counted in the metrics, by model tier)
+    bedrock_llm = choose_model().with_config(callbacks=[get_metrics().callback], metadata={"tier": route_tier("api")})
+
+    # Create a runnable chain with the prompt: it supports ainvoke and token streaming (astream),
+    # which LLMChain does not. It returns the text of the answer.
+    chain = prompt | bedrock_llm | StrOutputParser()
     print(f"Type of chain: {type(chain)}")
     return chain
 
 
-# Function to add message to chat history
-def add_message_to_history(role, content):
-    chat_history = chat_history_var.get()
-    chat_history.append({"role": role, "content": content})
-    chat_history_var.set(chat_history)
+# Function to preload everything a request needs, so that per-request work is only the model call
+def warm_up():
+    """
+    Build the chain (prompt files, model client) and the retrieval index, run one retrieval, load the FAQ store.
+    With API_WARMUP_MODEL_CALL=1, also send one short request to the model to open its connection.
+    Returns the duration of each step in seconds.
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    chain = initialize_chain()
+    timings["chain"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    get_context("autonomie recharge batterie")
+    timings["retrieval_index"] = time.perf_counter() - started
+
+    # Answers of the known questions, computed offline by warm_faq.py
+    started = time.perf_counter()
+    get_faq_store()
+    timings["faq_store"] = time.perf_counter() - started
+
+    if os.getenv("API_WARMUP_MODEL_CALL", "0") == "1":
+        started = time.perf_counter()
+        chain.invoke({"input": "Bonjour", "context": ""})
+        timings["model_call"] = time.perf_counter() - started
+
+    return timings
+
+
+# Function to get the relevant context paragraphs for a question
+def get_context(user_input):
+    return retrieve_context(user_input)
+
+
+# Function to add message to the chat history of a session
+def add_message_to_history(session_id, role, content):
+    get_history_store().append(session_id, role, content)
+
+
+# Function to get the chat history of a session, as messages for the prompt
+def get_history_messages(session_id):
+    return [
+        HumanMessage(content=message["content"]) if message["role"] == "human" else AIMessage(content=message["content"])
+        for message in get_history_store().get(session_id)
+    ]
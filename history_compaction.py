@@ -0,0 +1,136 @@
+import os
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, List, Sequence, Tuple
+
+from retrieval import estimate_tokens
+
+# Compaction settings, overridable from the environment
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", "3"))  # turns kept verbatim for the answer chains
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))  # answer view: summary + recent turns
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "400"))  # max size of the rolling summary
+HISTORY_SUMMARY_CHARS = int(os.getenv("HISTORY_SUMMARY_CHARS", "160"))  # max size of one summarized message
+CLASSIFIER_HISTORY_TURNS = int(os.getenv("CLASSIFIER_HISTORY_TURNS", "1"))
+CLASSIFIER_HISTORY_TOKENS = int(os.getenv("CLASSIFIER_HISTORY_TOKENS", "300"))
+
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+SENTENCE_END_PATTERN = re.compile(r"(?<=[.!?])\s")
+ROLE_LABELS = {"human": "Client", "ai": "Expert", "assistant": "Expert"}
+
+
+@dataclass
+class HistoryViews:
+    """The history sent to the answer chains, the shorter one sent to the classifier, and their sizes."""
+    answer: str
+    classifier: str
+    full_tokens: int
+    answer_tokens: int
+    classifier_tokens: int
+
+
+def _role_and_content(message: Any) -> Tuple[str, str]:
+    # HumanMessage/AIMessage, {"role", "content"} dicts (history_store) or plain strings
+    if isinstance(message, dict):
+        return message.get("role", ""), str(message.get("content", ""))
+    if hasattr(message, "content"):
+        return getattr(message, "type", ""), str(message.content)
+    return "", str(message)
+
+
+def summarize_message(role: str, content: str, max_chars: int = HISTORY_SUMMARY_CHARS) -> str:
+    """One summary line of a message: its first sentence, clipped. Local, no model call."""
+    text = " ".join(content.split())
+    first_sentence = SENTENCE_END_PATTERN.split(text, maxsplit=1)[0]
+    if len(first_sentence) > max_chars:
+        first_sentence = first_sentence[:max_chars].rsplit(" ", 1)[0] + "..."
+    label = ROLE_LABELS.get(role)
+    return f"{label}: {first_sentence}" if label else first_sentence
+
+
+class HistoryCompactor:
+    """
+    Keep the prompt history under a token budget instead of re-sending the whole transcript every turn.
+    The last HISTORY_RECENT_TURNS turns are kept verbatim; older messages are folded into a rolling summary,
+    only when they leave the window, so each message is summarized once. One compactor per conversation.
+    The classifier gets a shorter view: the last CLASSIFIER_HISTORY_TURNS turns, without the summary.
+    """
+
+    def __init__(
+        self,
+        recent_turns: int = HISTORY_RECENT_TURNS,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        summary_tokens: int = HISTORY_SUMMARY_TOKENS,
+        classifier_turns: int = CLASSIFIER_HISTORY_TURNS,
+        classifier_tokens: int = CLASSIFIER_HISTORY_TOKENS,
+        summarize: Callable[[str, str], str] = summarize_message,
+    ):
+        self.recent_turns = recent_turns
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.classifier_turns = classifier_turns
+        self.classifier_tokens = classifier_tokens
+        self.summarize = summarize
+        self.reset()
+
+    def reset(self):
+        self.summary: Deque[Tuple[str, int]] = deque()  # (line, tokens)
+        self._summary_size = 0
+        self.folded = 0  # messages of the conversation already folded into the summary
+        self._seen = 0
+        self._full_tokens = 0  # size of the whole transcript, for the logs
+
+    def _fold(self, role: str, content: str):
+        line = self.summarize(role, content)
+        tokens = estimate_tokens(line)
+        self.summary.append((line, tokens))
+        self._summary_size += tokens
+        # The summary is bounded too: the oldest lines go first
+        while self._summary_size > self.summary_tokens and len(self.summary) > 1:
+            self._summary_size -= self.summary.popleft()[1]
+
+    def compact(self, messages: Sequence[Any]) -> HistoryViews:
+        """
+        Views of the conversation, given all its messages (the current question last). Messages are only
+        ever appended, so the work per turn is bounded by the window, not by the length of the conversation.
+        """
+        if len(messages) < self._seen:
+            # Another (shorter) conversation: start over
+            self.reset()
+        pairs = [_role_and_content(message) for message in messages[self.folded:]]
+        recent_tokens = [estimate_tokens(content) for _, content in pairs]
+        self._full_tokens += sum(recent_tokens[self._seen - self.folded:])
+        self._seen = len(messages)
+
+        # Last N turns (question + answer) plus the current question
+        window = 2 * self.recent_turns + 1
+        while len(pairs) > 1 and (
+            len(pairs) > window or self._summary_size + sum(recent_tokens) > self.token_budget
+        ):
+            self._fold(*pairs.pop(0))
+            recent_tokens.pop(0)
+            self.folded += 1
+
+        lines = [content for _, content in pairs]
+        answer = "\n".join(lines)
+        if self.summary:
+            answer = "\n".join([SUMMARY_HEADER + " " + " ".join(line for line, _ in self.summary)] + lines)
+
+        classifier = self._classifier_view(lines, recent_tokens)
+        return HistoryViews(
+            answer=answer,
+            classifier=classifier,
+            full_tokens=self._full_tokens,
+            answer_tokens=estimate_tokens(answer),
+            classifier_tokens=estimate_tokens(classifier),
+        )
+
+    def _classifier_view(self, lines: List[str], tokens: List[int]) -> str:
+        kept: List[str] = []
+        size = 0
+        for line, line_tokens in zip(reversed(lines[-(2 * self.classifier_turns + 1):]), reversed(tokens)):
+            if kept and size + line_tokens > self.classifier_tokens:
+                break
+            kept.append(line)
+            size += line_tokens
+        return "\n".join(reversed(kept))
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Tuple
+
+from retrieval import estimate_tokens
+
+# History settings, overridable from the environment
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "20"))  # per session
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "4000"))  # per session
+HISTORY_IDLE_TTL = float(os.getenv("HISTORY_IDLE_TTL", "1800"))  # seconds without a message
+HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "10000"))
+# SQLite file of the persistent session store (session_store.py), empty: history in memory only, lost on restart
+HISTORY_STORE_FILE = os.getenv("HISTORY_STORE_FILE", str(Path(__file__).resolve().parent / "data" / "sessions.sqlite3"))
+
+
+class _Session:
+    def __init__(self, max_messages: int):
+        self.messages: Deque[Tuple[str, Any, int]] = deque(maxlen=max_messages)  # (role, content, tokens)
+        self.tokens = 0
+        self.last_seen = time.monotonic()
+        self.pending = 0  # messages not written to the persistent store yet
+        self.synced = 0.0  # update time of the persistent copy this one matches
+
+
+class SessionHistoryStore:
+    """
+    Conversation history per session id, bounded in messages and tokens per session.
+    Sessions are kept in least-recently-used order: idle ones (HISTORY_IDLE_TTL) and the oldest ones beyond
+    HISTORY_MAX_SESSIONS are evicted from the front. Appending a message is O(1) amortized.
+    """
+
+    def __init__(
+        self,
+        max_messages: int = HISTORY_MAX_MESSAGES,
+        max_tokens: int = HISTORY_MAX_TOKENS,
+        idle_ttl: float = HISTORY_IDLE_TTL,
+        max_sessions: int = HISTORY_MAX_SESSIONS,
+    ):
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.evicted_sessions = 0
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - session.last_seen < self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self.evicted_sessions += 1
+
+    def append(self, session_id: str, role: str, content: Any):
+        tokens = estimate_tokens(str(content))
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session(self.max_messages)
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_seen = now
+
+            if len(session.messages) == session.messages.maxlen:
+                session.tokens -= session.messages[0][2]
+            session.messages.append((role, content, tokens))
+            session.tokens += tokens
+            # Keep at least the last message, even if it is bigger than the budget
+            while session.tokens > self.max_tokens and len(session.messages) > 1:
+                session.tokens -= session.messages.popleft()[2]
+
+            self._evict(now)
+
+    def get(self, session_id: str) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return []
+            return [{"role": role, "content": content} for role, content, _ in session.messages]
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def close(self):
+        # Nothing to write: the in-memory store has no backend
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "messages": sum(len(session.messages) for session in self._sessions.values()),
+                "evicted_sessions": self.evicted_sessions,
+            }
+
+
+# One history store per process, persistent (SQLite, shared by the processes of the host) with HISTORY_STORE_FILE
+@lru_cache(maxsize=None)
+def get_history_store() -> SessionHistoryStore:
+    if HISTORY_STORE_FILE:
+        from session_store import PersistentSessionStore, SqliteSessionBackend
+
+        return PersistentSessionStore(SqliteSessionBackend(HISTORY_STORE_FILE))
+    return SessionHistoryStore()
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from xml.etree import ElementTree
+
+from context_dedupe import CONTEXT_SOURCES, build_canonical_context
+from retrieval import CANONICAL_CONTEXT_PATH, PARAGRAPH_SEPARATOR, get_index
+
+ROOT_DIRECTORY = Path(__file__).resolve().parent
+RAW_DATA_DIRECTORY = ROOT_DIRECTORY / "raw_data"
+PARSED_DATA_DIRECTORY = ROOT_DIRECTORY / "parsed_data"
+
+# Ingestion settings, overridable from the environment
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "4"))
+# "llamaparse" (remote, needs LLAMA_CLOUD_API_KEY_3) or "local" (docx/txt extractor, offline)
+INGESTION_PARSER = os.getenv("INGESTION_PARSER", "llamaparse" if os.getenv("LLAMA_CLOUD_API_KEY_3") else "local")
+
+MANIFEST_FILE = "ingestion_manifest.json"
+CHUNKS_FILE = "chunks.jsonl"
+CORPUS_FILE = "peugeot_data.txt"  # served corpus (LlamaParse), first source of the canonical context
+LOCAL_CORPUS_FILE = "peugeot_data_local.txt"  # corpus of the offline parser, never replaces the served one
+SOURCES_DIRECTORY = "sources"  # parsed text of each source file, reused while the file does not change
+
+LLAMAPARSE_INSTRUCTION = """
+                            This document presents comprehensive information on Peugeot's range of electric vehicles, including technical specifications, charging details, cost information and tax incentives, as well as associated services.
+                            It contains numerous structured sections, technical data tables, and information on different electric vehicle models.
+                            The document also covers topics such as vehicle range, battery technologies, connected mobility services, and the Peugeot Allure Care warranty program.
+                            It includes precise numerical data on vehicle performance, costs, and government incentives.Also at the end of each paragraph please add "<>end_paragraph<>" to separate the paragraphs.
+                            """
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class LlamaParseParser:
+    """Remote parser (LlamaParse, multimodal), one request per file. Emits the <>end_paragraph<> markers itself."""
+
+    name = "llamaparse"
+    extensions = {".pdf", ".docx", ".doc", ".pptx", ".txt"}
+    corpus_file = CORPUS_FILE
+
+    def __init__(self):
+        from llama_parse import LlamaParse
+
+        self.parser = LlamaParse(
+            api_key=os.getenv("LLAMA_CLOUD_API_KEY_3"),
+            use_vendor_multimodal_model=True,
+            vendor_multimodal_model_name="openai-gpt4o",
+            parsing_instruction=LLAMAPARSE_INSTRUCTION,
+            result_type="text",
+        )
+
+    def parse(self, path: Path) -> str:
+        return "".join(document.text for document in self.parser.load_data(str(path)))
+
+
+class LocalParser:
+    """
+    Offline extractor for .docx (paragraph text read from word/document.xml) and .txt/.md files.
+    A section ends before each heading, like the <>end_paragraph<> markers LlamaParse is asked to add.
+    """
+
+    name = "local"
+    extensions = {".docx", ".txt", ".md"}
+    corpus_file = LOCAL_CORPUS_FILE
+
+    def parse(self, path: Path) -> str:
+        if path.suffix.lower() == ".docx":
+            return self._parse_docx(path)
+        return path.read_text(encoding="utf-8")
+
+    def _parse_docx(self, path: Path) -> str:
+        with zipfile.ZipFile(path) as archive:
+            root = ElementTree.fromstring(archive.read("word/document.xml"))
+
+        sections: List[List[str]] = [[]]
+        for paragraph in root.iter(WORD_NAMESPACE + "p"):
+            style = paragraph.find(f"{WORD_NAMESPACE}pPr/{WORD_NAMESPACE}pStyle")
+            is_heading = style is not None and style.get(WORD_NAMESPACE + "val", "").startswith("Heading")
+            text = "".join(
+                node.text or "" if node.tag == WORD_NAMESPACE + "t" else "\n"
+                for node in paragraph.iter()
+                if node.tag in (WORD_NAMESPACE + "t", WORD_NAMESPACE + "br")
+            ).strip()
+            if not text:
+                continue
+            if is_heading and sections[-1]:
+                sections.append([])
+            sections[-1].append(text)
+
+        return "".join("\n".join(lines) + "\n" + PARAGRAPH_SEPARATOR + "\n" for lines in sections if lines)
+
+
+PARSERS = {
+    LlamaParseParser.name: LlamaParseParser,
+    LocalParser.name: LocalParser,
+}
+
+
+def get_parser(name: str = INGESTION_PARSER):
+    if name not in PARSERS:
+        raise ValueError(f"Unknown parser {name!r}, expected one of {sorted(PARSERS)}")
+    return PARSERS[name]()
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_records(source: str, text: str) -> List[Dict]:
+    """One record per <>end_paragraph<> section, with its character offsets in the parsed text of the source."""
+    records = []
+    start = 0
+    while start < len(text):
+        end = text.find(PARAGRAPH_SEPARATOR, start)
+        if end == -1:
+            end = len(text)
+        section = text[start:end]
+        stripped = section.strip()
+        if stripped:
+            offset = start + section.index(stripped)
+            records.append({
+                "source": source,
+                "chunk": len(records),
+                "start": offset,
+                "end": offset + len(stripped),
+                "text": stripped,
+            })
+        start = end + len(PARAGRAPH_SEPARATOR)
+    return records
+
+
+def _write_atomic(path: Path, content: str):
+    # Readers (the chatbot reloading its artifacts) never see a half-written file
+    temporary = path.with_name(path.name + ".tmp")
+    temporary.write_text(content, encoding="utf-8")
+    os.replace(temporary, path)
+
+
+@dataclass
+class IngestionReport:
+    parsed: List[str]
+    unchanged: List[str]
+    removed: List[str]
+    failed: Dict[str, str]
+    chunks: int
+    paragraphs: int
+    corpus_file: str = CORPUS_FILE
+    context_tokens_before: int = 0  # served corpus
+    context_tokens_after: int = 0  # canonical context
+    context_served: bool = False  # the canonical context replaces the corpus (smaller, no conflicting figures)
+
+
+def _source_files(raw_directory: Path, extensions: Iterable[str]) -> List[Path]:
+    return sorted(
+        path for path in raw_directory.iterdir()
+        if path.is_file() and path.suffix.lower() in extensions and not path.name.startswith(("~$", "."))
+    )
+
+
+def run_ingestion(
+    raw_directory: Path = RAW_DATA_DIRECTORY,
+    output_directory: Path = PARSED_DATA_DIRECTORY,
+    parser=None,
+    workers: int = INGESTION_WORKERS,
+    force: bool = False,
+) -> IngestionReport:
+    """
+    Incremental ingestion of raw_data/:
+    1. hash every source file and skip the ones whose content (and parser) did not change
+    2. parse the changed files in a worker pool
+    3. write the chunks JSONL (one record per section, with source and offsets)
+    4. rebuild the corpus file of the parser and check that its search index builds
+    5. rebuild the deduplicated canonical context loaded by retrieval.py (context_dedupe.py), only from the
+       served corpus: the offline parser writes its own corpus file and leaves the served context alone
+    """
+    parser = parser or get_parser()
+    output_directory.mkdir(parents=True, exist_ok=True)
+    sources_directory = output_directory / SOURCES_DIRECTORY
+    sources_directory.mkdir(exist_ok=True)
+
+    manifest_path = output_directory / MANIFEST_FILE
+    manifest: Dict[str, Dict] = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+
+    # 1. Content hashes
+    files = _source_files(raw_directory, parser.extensions)
+    hashes = {path.name: file_hash(path) for path in files}
+    changed = [
+        path for path in files
+        if force
+        or manifest.get(path.name, {}).get("sha256") != hashes[path.name]
+        or manifest.get(path.name, {}).get("parser") != parser.name
+        or not (sources_directory / manifest[path.name]["parsed_file"]).exists()
+    ]
+    removed = sorted(set(manifest) - set(hashes))
+
+    # 2. Parse the changed files in parallel (LlamaParse calls are network bound)
+    failed: Dict[str, str] = {}
+
+    def parse_one(path: Path) -> Optional[str]:
+        try:
+            return parser.parse(path)
+        except Exception as e:
+            failed[path.name] = str(e)
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        texts = dict(zip((path.name for path in changed), pool.map(parse_one, changed)))
+
+    for name, text in texts.items():
+        if text is None:
+            print(f"Error while parsing {name}: {failed[name]}")
+            continue
+        # The extension stays in the name: a.docx and a.txt do not overwrite each other
+        parsed_file = name + ".txt"
+        _write_atomic(sources_directory / parsed_file, text)
+        previous = manifest.get(name, {}).get("parsed_file")
+        if previous and previous != parsed_file:
+            (sources_directory / previous).unlink(missing_ok=True)
+        manifest[name] = {"sha256": hashes[name], "parser": parser.name, "parsed_file": parsed_file}
+    for name in removed:
+        (sources_directory / manifest.pop(name)["parsed_file"]).unlink(missing_ok=True)
+
+    # 3. Chunks of every source (unchanged ones are read back from their parsed text)
+    records = []
+    corpus = []
+    for name in sorted(manifest):
+        text = (sources_directory / manifest[name]["parsed_file"]).read_text(encoding="utf-8")
+        source_records = chunk_records(name, text)
+        manifest[name]["chunks"] = len(source_records)
+        records.extend(source_records)
+        corpus.extend(record["text"] for record in source_records)
+    _write_atomic(output_directory / CHUNKS_FILE, "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+
+    # 4. Search artifacts: the corpus file read by retrieval.py, then a check that its index builds
+    corpus_path = output_directory / parser.corpus_file
+    _write_atomic(corpus_path, "".join(section + "\n" + PARAGRAPH_SEPARATOR + "\n" for section in corpus))
+    get_index.cache_clear()
+    paragraphs = len(get_index(str(corpus_path)).paragraphs)
+    _write_atomic(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2))
+
+    # 5. Canonical context: the new corpus first, then the other copies of the context
+    dedupe = None
+    if parser.corpus_file == CORPUS_FILE:
+        sources = [str(corpus_path)] + [source for source in CONTEXT_SOURCES if Path(source).name != CORPUS_FILE]
+        dedupe = build_canonical_context(sources, output_directory / CANONICAL_CONTEXT_PATH.name)
+
+    return IngestionReport(
+        parsed=sorted(name for name, text in texts.items() if text is not None),
+        unchanged=sorted(set(hashes) - {path.name for path in changed}),
+        removed=removed,
+        failed=failed,
+        chunks=len(records),
+        paragraphs=paragraphs,
+        corpus_file=parser.corpus_file,
+        context_tokens_before=dedupe.tokens_served if dedupe else 0,
+        context_tokens_after=dedupe.tokens_after if dedupe else 0,
+        context_served=dedupe.written if dedupe else False,
+    )
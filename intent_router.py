@@ -0,0 +1,174 @@
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from retrieval import normalize_text
+from semantic_cache import HashingVectorizer
+
+# Labels are the ones of the LLM classifier (check_question_type):
+# "yes" -> expert chain, "ok" -> capacity chain, "no" -> commercial chain
+LABELS = ["yes", "ok", "no"]
+
+# Below this probability the local classifier is unsure and the LLM classifier decides
+ROUTER_CONFIDENCE = float(os.getenv("ROUTER_CONFIDENCE", "0.8"))
+
+GREETING_PATTERN = re.compile(
+    r"^\s*(bonjour|bonsoir|salut|coucou|hello|hi|hey|merci( beaucoup)?|thanks?( you)?|au revoir|bye|"
+    r"bonne (journee|soiree)|ca va|comment ca va|parfait|super|top|ok)\b[\s!.,?]*"
+)
+MODEL_PATTERN = re.compile(r"\b(e[\s-]?)?(208|2008|308|3008|408|5008|expert|partner)\b")
+CAPACITY_PATTERN = re.compile(r"\b(autonomie|recharg\w*|batterie\w*|capacite|wltp|kwh|km|charge|borne\w*)\b")
+EV_PATTERN = re.compile(r"\b(voiture|vehicule|electrique|peugeot|ev|batterie|recharg\w*|autonomie|garantie|bonus)\b")
+
+# Seed questions for the linear classifier, labelled like the LLM classifier would
+TRAINING_QUESTIONS: List[Tuple[str, str]] = [
+    ("Quel est le prix de la recharge ?", "yes"),
+    ("Quelles sont les meilleures applications Peugeot ?", "yes"),
+    ("Quel est le taux de satisfaction client des utilisateurs de véhicules électriques ?", "yes"),
+    ("Pouvez-vous fournir un bref historique des véhicules électriques de Peugeot ?", "yes"),
+    ("Quels sont les services connectés Peugeot ?", "yes"),
+    ("Comment fonctionne le bonus écologique pour une voiture électrique ?", "yes"),
+    ("Quelles aides de l'état pour acheter un véhicule électrique ?", "yes"),
+    ("Comment entretenir une voiture électrique ?", "yes"),
+    ("Quels sont les modèles électriques Peugeot disponibles ?", "yes"),
+    ("Peut-on recharger sa voiture sur une prise domestique ?", "yes"),
+    ("Comment installer une wallbox à la maison ?", "yes"),
+    ("Quel est le coût d'entretien d'une voiture électrique ?", "yes"),
+    ("Je voudrais essayer une voiture électrique", "yes"),
+    ("Quelles sont les différences entre hybride et électrique ?", "yes"),
+    ("Quelle est l'autonomie de la e-208 ?", "ok"),
+    ("Combien de temps pour recharger une e-2008 ?", "ok"),
+    ("Quelle est la capacité de la batterie de la e-308 ?", "ok"),
+    ("Autonomie WLTP du E-3008 ?", "ok"),
+    ("Temps de recharge de la Peugeot e-Expert sur borne rapide", "ok"),
+    ("Combien de km avec une charge complète de la e-Partner ?", "ok"),
+    ("Quels sont les principaux facteurs influençant l'autonomie d'un véhicule électrique ?", "ok"),
+    ("Quels sont les avantages de la recharge d'un véhicule électrique ?", "ok"),
+    ("Quelle économie avec une voiture électrique ?", "ok"),
+    ("Quel est l'impact environnemental d'une voiture électrique ?", "ok"),
+    ("Quelle est la garantie de la batterie ?", "ok"),
+    ("Combien de temps dure la recharge à domicile ?", "ok"),
+    ("Bonjour", "no"),
+    ("Merci beaucoup !", "no"),
+    ("Salut, comment ça va ?", "no"),
+    ("Au revoir et bonne journée", "no"),
+    ("Hello", "no"),
+    ("Où est le concessionnaire le plus proche de chez moi ?", "no"),
+    ("Quel temps fait-il aujourd'hui ?", "no"),
+    ("Raconte-moi une blague", "no"),
+    ("Je me sens mal", "no"),
+    ("Qui es-tu ?", "no"),
+    ("Quelle est ta voiture préférée ?", "no"),
+    ("Super, merci pour ces informations", "no"),
+]
+
+
+@dataclass
+class RouteDecision:
+    """Route chosen for a question, with the path that decided ("rules", "classifier" or "llm")."""
+    label: str
+    confidence: float
+    source: str
+
+
+class LinearIntentClassifier:
+    """Softmax regression over the hashing vectorizer features, trained once at startup (well under a second)."""
+
+    def __init__(self, vectorizer: Optional[HashingVectorizer] = None, labels: List[str] = LABELS):
+        self.vectorizer = vectorizer or HashingVectorizer()
+        self.labels = labels
+        self.weights = np.zeros((self.vectorizer.dimension, len(labels)), dtype=np.float32)
+        self.bias = np.zeros(len(labels), dtype=np.float32)
+
+    def fit(self, examples: List[Tuple[str, str]], epochs: int = 300, learning_rate: float = 0.5, l2: float = 1e-3):
+        features = np.stack([self.vectorizer.transform(question) for question, _ in examples])
+        targets = np.zeros((len(examples), len(self.labels)), dtype=np.float32)
+        for row, (_, label) in enumerate(examples):
+            targets[row, self.labels.index(label)] = 1.0
+
+        for _ in range(epochs):
+            probabilities = self._softmax(features @ self.weights + self.bias)
+            gradient = (probabilities - targets) / len(examples)
+            self.weights -= learning_rate * (features.T @ gradient + l2 * self.weights)
+            self.bias -= learning_rate * gradient.sum(axis=0)
+        return self
+
+    @staticmethod
+    def _softmax(scores: np.ndarray) -> np.ndarray:
+        scores = scores - scores.max(axis=-1, keepdims=True)
+        exponentials = np.exp(scores)
+        return exponentials / exponentials.sum(axis=-1, keepdims=True)
+
+    def predict_proba(self, question: str) -> Dict[str, float]:
+        probabilities = self._softmax(self.vectorizer.transform(question) @ self.weights + self.bias)
+        return {label: float(probability) for label, probability in zip(self.labels, probabilities)}
+
+    def predict_proba_batch(self, questions: List[str]) -> np.ndarray:
+        """Probabilities of many questions in one matrix product: one row per question, one column per label."""
+        features = np.stack([self.vectorizer.transform(question) for question in questions])
+        return self._softmax(features @ self.weights + self.bias)
+
+
+class IntentRouter:
+    """
+    Local fast path in front of the LLM classifier.
+    Clear cases are decided by keyword rules, then by the linear classifier when it is confident enough;
+    route() returns None when the LLM classifier has to decide.
+    """
+
+    def __init__(self, classifier: LinearIntentClassifier, confidence_threshold: float = ROUTER_CONFIDENCE):
+        self.classifier = classifier
+        self.confidence_threshold = confidence_threshold
+
+    def rule_decision(self, question: str) -> Optional[RouteDecision]:
+        text = normalize_text(question)
+        if MODEL_PATTERN.search(text) and CAPACITY_PATTERN.search(text):
+            return RouteDecision("ok", 1.0, "rules")
+        # A greeting or a thank you alone, without any question about vehicles or a model
+        if (
+            GREETING_PATTERN.match(text)
+            and not EV_PATTERN.search(text)
+            and not MODEL_PATTERN.search(text)
+            and len(text.split()) <= 6
+        ):
+            return RouteDecision("no", 1.0, "rules")
+        return None
+
+    def predict_proba(self, question: str) -> Dict[str, float]:
+        decision = self.rule_decision(question)
+        if decision is not None:
+            return {label: float(label == decision.label) for label in LABELS}
+        return self.classifier.predict_proba(question)
+
+    def route(self, question: str) -> Optional[RouteDecision]:
+        decision = self.rule_decision(question)
+        if decision is not None:
+            return decision
+        probabilities = self.classifier.predict_proba(question)
+        label = max(probabilities, key=probabilities.get)
+        if probabilities[label] >= self.confidence_threshold:
+            return RouteDecision(label, probabilities[label], "classifier")
+        return None
+
+    def route_batch(self, questions: List[str]) -> List[RouteDecision]:
+        """
+        Route many questions in one local pass (no LLM classifier): rules first, then the classifier.
+        A question the classifier is not confident about still gets its most probable label.
+        """
+        decisions: List[Optional[RouteDecision]] = [self.rule_decision(question) for question in questions]
+        undecided = [index for index, decision in enumerate(decisions) if decision is None]
+        if undecided:
+            probabilities = self.classifier.predict_proba_batch([questions[index] for index in undecided])
+            for index, row in zip(undecided, probabilities):
+                best = int(row.argmax())
+                decisions[index] = RouteDecision(self.classifier.labels[best], float(row[best]), "classifier")
+        return decisions
+
+
+@lru_cache(maxsize=None)
+def get_intent_router() -> IntentRouter:
+    return IntentRouter(LinearIntentClassifier().fit(TRAINING_QUESTIONS))
@@ -0,0 +1,268 @@
+import contextvars
+import os
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Deque, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from retrieval import estimate_tokens
+
+# Stages of a turn, in pipeline order
+STAGES = ("routing", "retrieval", "cache", "prompt_build", "model_call", "parsing")
+# Model tiers (model_client.MODEL_TIERS), one group of columns each
+TIERS = ("small", "large")
+METRICS_MAX_TURNS = int(os.getenv("METRICS_MAX_TURNS", "1000"))  # turns kept for the tables / CSV export
+# Upper bounds (seconds) of the stage duration histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+@dataclass
+class TurnMetrics:
+    """What one user turn cost: duration of each stage, tokens, cache hit and model calls."""
+    question: str
+    route: str = ""
+    routing_source: str = ""
+    cache: str = ""  # "", "exact", "semantic", "spec"...
+    stages: Dict[str, float] = field(default_factory=dict)
+    input_tokens: int = 0
+    output_tokens: int = 0
+    model_calls: int = 0
+    escalations: int = 0  # small model outputs that failed to parse, answered again by the large model
+    tiers: Dict[str, Dict[str, float]] = field(default_factory=dict)  # tier -> calls, tokens, seconds
+    total_seconds: float = 0.0
+    started_at: float = field(default_factory=time.time)
+
+    def as_row(self) -> Dict[str, Any]:
+        """Flat dict, one column per stage: a row of the metrics dataframe / CSV."""
+        row = {
+            "question": self.question,
+            "route": self.route,
+            "routing_source": self.routing_source,
+            "cache": self.cache,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "model_calls": self.model_calls,
+            "escalations": self.escalations,
+            "total_seconds": round(self.total_seconds, 4),
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+        }
+        row.update({f"{stage}_seconds": round(self.stages.get(stage, 0.0), 4) for stage in STAGES})
+        for tier in TIERS:
+            usage = self.tiers.get(tier, {})
+            row[f"{tier}_calls"] = int(usage.get("calls", 0))
+            row[f"{tier}_input_tokens"] = int(usage.get("input_tokens", 0))
+            row[f"{tier}_output_tokens"] = int(usage.get("output_tokens", 0))
+            row[f"{tier}_model_seconds"] = round(usage.get("seconds", 0.0), 4)
+        return row
+
+
+class _Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class MetricsRecorder:
+    """
+    Per-turn instrumentation shared by every chain. `turn()` opens the record of a user turn, `stage()` times a
+    step of it, the callback handler counts the model calls and their tokens. Outside of a turn everything is a
+    no-op. Finished turns are kept for the tables and aggregated for the Prometheus endpoint.
+    """
+
+    def __init__(self, max_turns: int = METRICS_MAX_TURNS):
+        self.turns: Deque[TurnMetrics] = deque(maxlen=max_turns)
+        self.callback = MetricsCallbackHandler(self)
+        self._current = contextvars.ContextVar("metrics_turn", default=None)
+        self._lock = threading.Lock()
+        self._turn_counts: Counter = Counter()  # (route, cache) -> turns
+        self._tokens: Counter = Counter()  # (tier, direction) -> tokens
+        self._model_calls: Counter = Counter()  # tier -> calls
+        self._escalations = 0
+        self._stage_histograms: Dict[str, _Histogram] = {}
+        self._model_call_histograms: Dict[str, _Histogram] = {}  # tier -> call durations
+        self._turn_histogram = _Histogram()
+
+    @property
+    def model_calls_total(self) -> int:
+        return sum(self._model_calls.values())
+
+    @property
+    def current(self) -> Optional[TurnMetrics]:
+        return self._current.get()
+
+    @contextmanager
+    def turn(self, question: str):
+        metrics = TurnMetrics(question=question)
+        token = self._current.set(metrics)
+        started = time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            metrics.total_seconds = time.perf_counter() - started
+            self._current.reset(token)
+            self._finish(metrics)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a stage of the current turn (durations add up when a stage runs several times)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            metrics = self._current.get()
+            if metrics is not None:
+                metrics.stages[name] = metrics.stages.get(name, 0.0) + time.perf_counter() - started
+
+    def set_route(self, route: str, source: str = ""):
+        metrics = self._current.get()
+        if metrics is not None:
+            metrics.route, metrics.routing_source = route, source
+
+    def record_cache(self, kind: str):
+        metrics = self._current.get()
+        if metrics is not None:
+            metrics.cache = kind
+
+    def record_model_call(self, input_tokens: int, output_tokens: int, tier: str = "", seconds: float = 0.0):
+        tier = tier or "unknown"
+        with self._lock:
+            self._model_calls[tier] += 1
+            self._tokens[(tier, "input")] += input_tokens
+            self._tokens[(tier, "output")] += output_tokens
+            self._model_call_histograms.setdefault(tier, _Histogram()).observe(seconds)
+        metrics = self._current.get()
+        if metrics is not None:
+            metrics.model_calls += 1
+            metrics.input_tokens += input_tokens
+            metrics.output_tokens += output_tokens
+            usage = metrics.tiers.setdefault(tier, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "seconds": 0.0})
+            usage["calls"] += 1
+            usage["input_tokens"] += input_tokens
+            usage["output_tokens"] += output_tokens
+            usage["seconds"] += seconds
+
+    def record_escalation(self):
+        with self._lock:
+            self._escalations += 1
+        metrics = self._current.get()
+        if metrics is not None:
+            metrics.escalations += 1
+
+    def _finish(self, metrics: TurnMetrics):
+        with self._lock:
+            self.turns.append(metrics)
+            self._turn_counts[(metrics.route or "unknown", metrics.cache or "none")] += 1
+            self._turn_histogram.observe(metrics.total_seconds)
+            for stage, seconds in metrics.stages.items():
+                self._stage_histograms.setdefault(stage, _Histogram()).observe(seconds)
+
+    def rows(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [metrics.as_row() for metrics in self.turns]
+
+    def tier_rows(self) -> List[Dict[str, Any]]:
+        """One row per model tier: calls, tokens and mean call duration since the start of the process."""
+        with self._lock:
+            return [
+                {
+                    "tier": tier,
+                    "calls": calls,
+                    "input_tokens": self._tokens[(tier, "input")],
+                    "output_tokens": self._tokens[(tier, "output")],
+                    "mean_seconds": round(self._model_call_histograms[tier].sum / calls, 4),
+                }
+                for tier, calls in sorted(self._model_calls.items())
+            ]
+
+    def prometheus_text(self) -> str:
+        """Aggregated metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP ev_turns_total User turns handled, by route and cache result.",
+            "# TYPE ev_turns_total counter",
+        ]
+        with self._lock:
+            for (route, cache), count in sorted(self._turn_counts.items()):
+                lines.append(f'ev_turns_total{{route="{route}",cache="{cache}"}} {count}')
+            lines += ["# HELP ev_model_calls_total Model calls, by model tier.", "# TYPE ev_model_calls_total counter"]
+            lines += [f'ev_model_calls_total{{tier="{tier}"}} {count}' for tier, count in sorted(self._model_calls.items())]
+            lines += ["# HELP ev_tokens_total Model tokens, by model tier and direction.", "# TYPE ev_tokens_total counter"]
+            lines += [
+                f'ev_tokens_total{{tier="{tier}",direction="{direction}"}} {count}'
+                for (tier, direction), count in sorted(self._tokens.items())
+            ]
+            lines += [
+                "# HELP ev_escalations_total Small model outputs that failed to parse, retried on the large model.",
+                "# TYPE ev_escalations_total counter",
+                f"ev_escalations_total {self._escalations}",
+            ]
+            lines += _histogram_lines("ev_turn_seconds", "Duration of a user turn.", {"": self._turn_histogram})
+            lines += _histogram_lines("ev_stage_seconds", "Duration of a pipeline stage.", self._stage_histograms, "stage")
+            lines += _histogram_lines("ev_model_call_seconds", "Duration of a model call.", self._model_call_histograms, "tier")
+        return "\n".join(lines) + "\n"
+
+
+def _histogram_lines(name: str, help_text: str, histograms: Dict[str, _Histogram], label: str = "") -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for value, histogram in sorted(histograms.items()):
+        labels = f'{label}="{value}",' if label else ""
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {histogram.count}')
+        suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Count the tokens and time of every model call: tokens from the usage the model reports, else estimated from
+    the text. The model tier comes from the "tier" metadata of the model (ChainRegistry sets it).
+    """
+
+    def __init__(self, recorder: MetricsRecorder):
+        self.recorder = recorder
+        self._runs: Dict[Any, tuple] = {}  # run_id -> (estimated input tokens, tier, start time)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        text = "".join(str(message.content) for batch in messages for message in batch)
+        self._runs[run_id] = (estimate_tokens(text), (metadata or {}).get("tier", ""), time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        self._runs[run_id] = (estimate_tokens("".join(prompts)), (metadata or {}).get("tier", ""), time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        input_tokens, tier, started = self._runs.pop(run_id, (0, "", time.perf_counter()))
+        output_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    input_tokens = usage.get("input_tokens", input_tokens)
+                    output_tokens += usage.get("output_tokens", 0)
+                else:
+                    output_tokens += estimate_tokens(generation.text)
+        self.recorder.record_model_call(input_tokens, output_tokens, tier, time.perf_counter() - started)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._runs.pop(run_id, None)
+
+
+# One recorder per process
+@lru_cache(maxsize=None)
+def get_metrics() -> MetricsRecorder:
+    return MetricsRecorder()
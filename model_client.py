@@ -0,0 +1,422 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter, deque
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Iterator, List, Optional
+
+import numpy as np
+from botocore.exceptions import ClientError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from prompt_cache import BEDROCK_PROMPT_CACHE, BedrockPromptCacheModel
+from stub_llm import stub_model_enabled, stub_model_from_env
+
+# Model client settings, overridable from the environment
+BEDROCK_MODEL_ID = os.getenv("BEDROCK_MODEL_ID", "anthropic.claude-3-5-sonnet-20240620-v1:0")
+BEDROCK_SMALL_MODEL_ID = os.getenv("BEDROCK_SMALL_MODEL_ID", "anthropic.claude-3-haiku-20240307-v1:0")
+MODEL_TIERS = {"small": BEDROCK_SMALL_MODEL_ID, "large": BEDROCK_MODEL_ID}
+# Connections of the shared boto3 client: the worker's model calls in flight (API_MAX_CONCURRENCY), twice for hedges
+BEDROCK_POOL_SIZE = int(os.getenv("BEDROCK_POOL_SIZE", str(2 * int(os.getenv("API_MAX_CONCURRENCY", "16")))))
+BEDROCK_TIMEOUT = float(os.getenv("BEDROCK_TIMEOUT", "60"))
+BEDROCK_MAX_RETRIES = int(os.getenv("BEDROCK_MAX_RETRIES", "3"))  # retries of a throttled / unavailable call
+BEDROCK_BACKOFF_BASE = float(os.getenv("BEDROCK_BACKOFF_BASE", "0.5"))  # seconds, doubled at each retry
+BEDROCK_BACKOFF_MAX = float(os.getenv("BEDROCK_BACKOFF_MAX", "8"))
+# Hedged requests: a second identical call when the first one is slower than this percentile of the recent
+# latencies (0: no hedging). Only for the non-streaming async calls.
+BEDROCK_HEDGE_PERCENTILE = float(os.getenv("BEDROCK_HEDGE_PERCENTILE", "0"))
+BEDROCK_HEDGE_MIN_SAMPLES = int(os.getenv("BEDROCK_HEDGE_MIN_SAMPLES", "20"))
+# Circuit breaker: open after this many failed calls in a row, one trial call after the reset delay
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+CANNED_ANSWER = os.getenv(
+    "CANNED_ANSWER",
+    "Notre assistant est momentanément indisponible. Merci de réessayer dans quelques instants.",
+)
+# Same answer for the Streamlit chains: valid for their ResponseModel JSON parser
+CANNED_JSON_ANSWER = json.dumps({"response": CANNED_ANSWER, "key_words": []}, ensure_ascii=False)
+
+
+def parse_route_tiers(text: str) -> Dict[str, str]:
+    """Parse "route=tier" pairs: "classifier=small,commercial=small" -> {"classifier": "small", ...}"""
+    tiers = {}
+    for pair in filter(None, (pair.strip() for pair in text.split(","))):
+        route, _, tier = (part.strip() for part in pair.partition("="))
+        if tier not in MODEL_TIERS:
+            raise ValueError(f"Unknown model tier {tier!r} for route {route!r}, expected one of {sorted(MODEL_TIERS)}")
+        tiers[route] = tier
+    return tiers
+
+
+# Model tier of each route; the routes not listed (expert, capacity, API) use the large model
+ROUTE_MODEL_TIERS = parse_route_tiers(os.getenv("ROUTE_MODEL_TIERS", "classifier=small,commercial=small"))
+
+
+def route_tier(route: str) -> str:
+    return ROUTE_MODEL_TIERS.get(route, "large")
+
+
+# Bedrock errors worth retrying: the service is throttling or unhealthy, the request itself is fine
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+}
+CONNECTION_ERRORS = (EndpointConnectionError, ConnectTimeoutError, ReadTimeoutError)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    True for throttling, unavailable service and connection errors. ChatBedrock wraps the boto3 errors in a
+    ValueError: the chain of causes is followed, then the error code is looked for in the message.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, ClientError):
+            return error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+        if isinstance(error, CONNECTION_ERRORS):
+            return True
+        if any(code in str(error) for code in RETRYABLE_ERROR_CODES):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def backoff_seconds(attempt: int, base: float = BEDROCK_BACKOFF_BASE, maximum: float = BEDROCK_BACKOFF_MAX) -> float:
+    """Exponential backoff with full jitter: retries of many callers do not hit Bedrock at the same time."""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+def is_canned_answer(result: Any) -> bool:
+    """True for the answer returned while the circuit is open (never cached)."""
+    if isinstance(result, dict):
+        result = result.get("response")
+    return result == CANNED_ANSWER
+
+
+class CircuitBreaker:
+    """
+    closed: calls go through. open (after `failure_threshold` failures in a row): calls fail fast.
+    half_open (`reset_seconds` after opening): one trial call. Its success closes the circuit, any other outcome
+    (retryable or not, cancelled, abandoned stream) reopens it: the caller always ends with record_success or
+    record_abandoned.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"CIRCUIT BREAKER => open after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def record_abandoned(self):
+        """End of a call let through without a success: the trial call reopens the circuit."""
+        with self._lock:
+            if self.state == "half_open":
+                print("CIRCUIT BREAKER => trial call failed, open again")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """Recent successful call durations, for the hedging delay."""
+
+    def __init__(self, percentile: float = BEDROCK_HEDGE_PERCENTILE, min_samples: int = BEDROCK_HEDGE_MIN_SAMPLES, window: int = 200):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.percentile or len(self._samples) < self.min_samples:
+            return None
+        return float(np.percentile(list(self._samples), self.percentile))
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Wraps the chat model of the apps (ChatBedrock, BedrockPromptCacheModel or the stub) with:
+    - retries of throttled / unavailable calls, with jittered exponential backoff
+    - hedged requests (async, non-streaming): a second call when the first passes the latency percentile
+    - a circuit breaker: while Bedrock is unhealthy, calls return `fallback_response` without waiting
+    A streamed call is only retried until its first token.
+    """
+
+    model: Any
+    fallback_response: str = CANNED_ANSWER
+    max_retries: int = BEDROCK_MAX_RETRIES
+    breaker: Any = None
+    latencies: Any = None
+    counters: Any = None
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.breaker = self.breaker or CircuitBreaker()
+        self.latencies = self.latencies or LatencyTracker()
+        self.counters = Counter()
+
+    @property
+    def _llm_type(self) -> str:
+        return f"resilient-{self.model._llm_type}"
+
+    def stats(self) -> dict:
+        return {"circuit": self.breaker.state, **self.counters}
+
+    def _fallback_result(self) -> ChatResult:
+        self.counters["fallbacks"] += 1
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.fallback_response))])
+
+    def _failed(self, error: Exception, attempt: int) -> bool:
+        """Record a failed attempt; True when it should be retried."""
+        if not is_retryable(error):
+            self.counters["errors"] += 1
+            return False
+        if attempt < self.max_retries:
+            self.counters["retries"] += 1
+            return True
+        self.counters["errors"] += 1
+        self.breaker.record_failure()
+        return False
+
+    def _succeeded(self, seconds: Optional[float] = None):
+        self.breaker.record_success()
+        if seconds is not None:
+            self.latencies.add(seconds)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if not self.breaker.allow():
+            return self._fallback_result()
+        succeeded = False
+        try:
+            attempt = 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    result = self.model._generate(messages, stop=stop, **kwargs)
+                except Exception as e:
+                    if not self._failed(e, attempt):
+                        raise
+                    time.sleep(backoff_seconds(attempt))
+                    attempt += 1
+                    continue
+                self._succeeded(time.perf_counter() - started)
+                succeeded = True
+                return result
+        finally:
+            if not succeeded:
+                self.breaker.record_abandoned()
+
+    async def _hedged(self, call: Callable) -> ChatResult:
+        first = asyncio.ensure_future(call())
+        pending = {first}
+        # Whatever happens (including the caller being cancelled while it waits), no call is left running
+        try:
+            delay = self.latencies.hedge_delay()
+            if delay is None:
+                return await first
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                return first.result()
+
+            self.counters["hedges"] += 1
+            second = asyncio.ensure_future(call())
+            pending = {first, second}
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+                if not pending:
+                    raise done.pop().exception()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if not self.breaker.allow():
+            return self._fallback_result()
+        succeeded = False
+        try:
+            attempt = 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    result = await self._hedged(lambda: self.model._agenerate(messages, stop=stop, **kwargs))
+                except Exception as e:
+                    if not self._failed(e, attempt):
+                        raise
+                    await asyncio.sleep(backoff_seconds(attempt))
+                    attempt += 1
+                    continue
+                self._succeeded(time.perf_counter() - started)
+                succeeded = True
+                return result
+        finally:
+            # Also on cancellation (speculative routing, client gone): a trial call never stays pending
+            if not succeeded:
+                self.breaker.record_abandoned()
+
+    def _fallback_chunk(self) -> ChatGenerationChunk:
+        self.counters["fallbacks"] += 1
+        return ChatGenerationChunk(message=AIMessageChunk(content=self.fallback_response))
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        if not self.breaker.allow():
+            chunk = self._fallback_chunk()
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            return
+        started = False
+        try:
+            attempt = 0
+            while True:
+                try:
+                    for chunk in self.model._stream(messages, stop=stop, **kwargs):
+                        if not started:
+                            # First token: the model answers, the call is not retried any more
+                            started = True
+                            self._succeeded()
+                        if run_manager:
+                            run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                        yield chunk
+                except Exception as e:
+                    if started or not self._failed(e, attempt):
+                        raise
+                    time.sleep(backoff_seconds(attempt))
+                    attempt += 1
+                    continue
+                if not started:
+                    started = True
+                    self._succeeded()
+                return
+        finally:
+            if not started:
+                self.breaker.record_abandoned()
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        if not self.breaker.allow():
+            chunk = self._fallback_chunk()
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+            return
+        started = False
+        try:
+            attempt = 0
+            while True:
+                try:
+                    async for chunk in self.model._astream(messages, stop=stop, **kwargs):
+                        if not started:
+                            started = True
+                            self._succeeded()
+                        if run_manager:
+                            await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                        yield chunk
+                except Exception as e:
+                    if started or not self._failed(e, attempt):
+                        raise
+                    await asyncio.sleep(backoff_seconds(attempt))
+                    attempt += 1
+                    continue
+                if not started:
+                    started = True
+                    self._succeeded()
+                return
+        finally:
+            if not started:
+                self.breaker.record_abandoned()
+
+
+_models: List[ResilientChatModel] = []
+
+
+# One boto3 bedrock-runtime client per process: its connection pool is shared by every model call.
+# Retries are done by ResilientChatModel, not by botocore.
+@lru_cache(maxsize=None)
+def get_bedrock_client():
+    import boto3
+    from botocore.config import Config
+
+    config = Config(
+        max_pool_connections=BEDROCK_POOL_SIZE,
+        read_timeout=BEDROCK_TIMEOUT,
+        retries={"total_max_attempts": 1, "mode": "standard"},
+    )
+    return boto3.client("bedrock-runtime", config=config)
+
+
+# One model (and circuit breaker) per process and fallback answer
+@lru_cache(maxsize=None)
+def get_model(fallback_response: str = CANNED_ANSWER, model_id: str = BEDROCK_MODEL_ID) -> ResilientChatModel:
+    """The offline stub (EV_STUB_MODEL=1), BedrockPromptCacheModel (BEDROCK_PROMPT_CACHE=1) or ChatBedrock."""
+    if stub_model_enabled():
+        model = stub_model_from_env()
+    elif BEDROCK_PROMPT_CACHE:
+        # Cache checkpoint after the static prefix of the prompts
+        model = BedrockPromptCacheModel(model_id=model_id, client=get_bedrock_client())
+    else:
+        from langchain_aws import ChatBedrock
+
+        model = ChatBedrock(model_id=model_id, client=get_bedrock_client())
+    resilient = ResilientChatModel(model=model, fallback_response=fallback_response)
+    _models.append(resilient)
+    return resilient
+
+
+def get_tier_model(tier: str = "large", fallback_response: str = CANNED_ANSWER) -> ResilientChatModel:
+    return get_model(fallback_response, MODEL_TIERS[tier])
+
+
+def prometheus_lines() -> List[str]:
+    """Retry / hedge / circuit breaker counters of the models built in this process."""
+    models = list(_models)
+    lines = [
+        "# HELP ev_model_client_events_total Model client events (retries, hedges, hedge_wins, fallbacks, errors).",
+        "# TYPE ev_model_client_events_total counter",
+    ]
+    for event in ("retries", "hedges", "hedge_wins", "fallbacks", "errors"):
+        lines.append(f'ev_model_client_events_total{{event="{event}"}} {sum(model.counters[event] for model in models)}')
+    lines += [
+        "# HELP ev_model_circuit_open 1 while a circuit breaker is open.",
+        "# TYPE ev_model_circuit_open gauge",
+        f"ev_model_circuit_open {int(any(model.breaker.state != 'closed' for model in models))}",
+    ]
+    return lines
@@ -0,0 +1,195 @@
+import hashlib
+import io
+import json
+import os
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from stub_llm import STUB_RESPONSE
+
+# BEDROCK_PROMPT_CACHE=1 sends the requests through BedrockPromptCacheModel, with a cache checkpoint
+# after the static prefix (system message) of every prompt
+BEDROCK_PROMPT_CACHE = os.getenv("BEDROCK_PROMPT_CACHE", "0") not in ("", "0", "false")
+BEDROCK_MAX_TOKENS = int(os.getenv("BEDROCK_MAX_TOKENS", "2048"))
+ANTHROPIC_VERSION = "bedrock-2023-05-31"
+CACHE_CHECKPOINT = {"type": "ephemeral"}
+
+VARIABLE_PATTERN = re.compile(r"(?<!\{)\{([A-Za-z_][A-Za-z0-9_]*)\}(?!\})")
+BLOCK_SEPARATOR_PATTERN = re.compile(r"\n[ \t]*\n")
+
+
+def template_variables(template: str) -> List[str]:
+    return VARIABLE_PATTERN.findall(template)
+
+
+def split_static_dynamic(template: str, static_variables: Tuple[str, ...] = ("format_instructions",)) -> Tuple[str, str]:
+    """
+    Split a prompt template on its blank lines into (static blocks, dynamic blocks), each kept in order.
+    A block is dynamic when it reads a per-request variable ({history}, {user_input}, {context}...): such a
+    variable goes in a block of its own, otherwise the instructions around it leave the cacheable prefix.
+    """
+    static, dynamic = [], []
+    for block in BLOCK_SEPARATOR_PATTERN.split(template):
+        if not block.strip():
+            continue
+        is_dynamic = any(variable not in static_variables for variable in template_variables(block))
+        (dynamic if is_dynamic else static).append(block)
+    return "\n\n".join(static), "\n\n".join(dynamic)
+
+
+def prefix_fingerprint(prefix: str) -> str:
+    """Short hash of a rendered prompt prefix: the same fingerprint on two requests means a reusable cache entry."""
+    return hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:16]
+
+
+def anthropic_request_body(messages: List[BaseMessage], max_tokens: int = BEDROCK_MAX_TOKENS, **parameters: Any) -> Dict:
+    """
+    Bedrock Anthropic Messages body of a prompt. The system message is the static prefix: it becomes one text
+    block ending with a cache checkpoint, the conversation turns follow it. An empty system message is left
+    out (no block, no checkpoint).
+    """
+    body: Dict[str, Any] = {"anthropic_version": ANTHROPIC_VERSION, "max_tokens": max_tokens, **parameters}
+    turns: List[Dict] = []
+    for message in messages:
+        if message.type == "system":
+            if message.content.strip():
+                body["system"] = [{"type": "text", "text": message.content, "cache_control": CACHE_CHECKPOINT}]
+            continue
+        role = "assistant" if message.type == "ai" else "user"
+        text = message.content if isinstance(message.content, str) else json.dumps(message.content, ensure_ascii=False)
+        # Consecutive messages of the same role are merged, the API wants them alternated
+        if turns and turns[-1]["role"] == role:
+            turns[-1]["content"][0]["text"] += "\n\n" + text
+        else:
+            turns.append({"role": role, "content": [{"type": "text", "text": text}]})
+    body["messages"] = turns
+    return body
+
+
+def system_prefix(body: Dict) -> str:
+    return "".join(block["text"] for block in body.get("system", []))
+
+
+class BedrockPromptCacheModel(BaseChatModel):
+    """
+    Claude on Bedrock through the Messages API, with prompt caching: the system message (static prefix of
+    the route) carries a cache checkpoint. Logs the prefix fingerprint and the cache usage of every request.
+    `client` is a boto3 bedrock-runtime client (or RecordingBedrockClient to test offline).
+    """
+
+    model_id: str
+    max_tokens: int = BEDROCK_MAX_TOKENS
+    temperature: Optional[float] = None
+    client: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "bedrock-prompt-cache"
+
+    def _get_client(self):
+        if self.client is None:
+            import boto3
+
+            self.client = boto3.client("bedrock-runtime")
+        return self.client
+
+    def _body(self, messages: List[BaseMessage], stop: Optional[List[str]]) -> Dict:
+        parameters: Dict[str, Any] = {}
+        if self.temperature is not None:
+            parameters["temperature"] = self.temperature
+        if stop:
+            parameters["stop_sequences"] = stop
+        body = anthropic_request_body(messages, self.max_tokens, **parameters)
+        print(f"PROMPT PREFIX => {prefix_fingerprint(system_prefix(body))} ({len(system_prefix(body))} chars)")
+        return body
+
+    @staticmethod
+    def _log_usage(usage: Dict):
+        print(
+            f"PROMPT CACHE => read {usage.get('cache_read_input_tokens', 0)}, "
+            f"written {usage.get('cache_creation_input_tokens', 0)}, uncached {usage.get('input_tokens', 0)} tokens"
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        response = self._get_client().invoke_model(
+            modelId=self.model_id,
+            body=json.dumps(self._body(messages, stop)),
+            contentType="application/json",
+            accept="application/json",
+        )
+        payload = json.loads(response["body"].read())
+        usage = payload.get("usage", {})
+        self._log_usage(usage)
+        text = "".join(block.get("text", "") for block in payload.get("content", []) if block.get("type") == "text")
+        input_tokens = sum(usage.get(key, 0) for key in ("input_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"))
+        usage_metadata = {
+            "input_tokens": input_tokens,
+            "output_tokens": usage.get("output_tokens", 0),
+            "total_tokens": input_tokens + usage.get("output_tokens", 0),
+        }
+        message = AIMessage(content=text, usage_metadata=usage_metadata)
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"usage": usage})
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        response = self._get_client().invoke_model_with_response_stream(
+            modelId=self.model_id,
+            body=json.dumps(self._body(messages, stop)),
+            contentType="application/json",
+            accept="application/json",
+        )
+        for event in response["body"]:
+            data = json.loads(event["chunk"]["bytes"])
+            if data.get("type") == "message_start":
+                self._log_usage(data.get("message", {}).get("usage", {}))
+            elif data.get("type") == "content_block_delta" and data.get("delta", {}).get("text"):
+                token = data["delta"]["text"]
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+                if run_manager:
+                    run_manager.on_llm_new_token(token, chunk=chunk)
+                yield chunk
+
+
+class RecordingBedrockClient:
+    """
+    Local stand-in for the bedrock-runtime client: records every request body and answers `response`.
+    The usage it returns simulates the cache: a prefix seen before is reported as read from the cache.
+    """
+
+    def __init__(self, response: str = STUB_RESPONSE):
+        self.response = response
+        self.requests: List[Dict] = []
+        self._prefixes = set()
+
+    def _usage(self, body: Dict) -> Dict:
+        prefix = system_prefix(body)
+        prefix_tokens = len(prefix) // 4
+        cached = prefix in self._prefixes
+        self._prefixes.add(prefix)
+        uncached = sum(len(turn["content"][0]["text"]) for turn in body["messages"]) // 4
+        return {
+            "input_tokens": uncached,
+            "cache_read_input_tokens": prefix_tokens if cached else 0,
+            "cache_creation_input_tokens": 0 if cached else prefix_tokens,
+            "output_tokens": len(self.response) // 4,
+        }
+
+    def invoke_model(self, modelId: str, body: str, **kwargs: Any) -> Dict:
+        request = json.loads(body)
+        self.requests.append(request)
+        payload = {"content": [{"type": "text", "text": self.response}], "usage": self._usage(request)}
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8"))}
+
+    def invoke_model_with_response_stream(self, modelId: str, body: str, **kwargs: Any) -> Dict:
+        request = json.loads(body)
+        self.requests.append(request)
+        events = [{"type": "message_start", "message": {"usage": self._usage(request)}}]
+        events += [
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": self.response[start:start + 4]}}
+            for start in range(0, len(self.response), 4)
+        ]
+        events.append({"type": "message_stop"})
+        return {"body": [{"chunk": {"bytes": json.dumps(event).encode("utf-8")}} for event in events]}
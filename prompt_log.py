@@ -0,0 +1,188 @@
+import atexit
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Prompt log settings, overridable from the environment
+PROMPT_LOG_FILE = os.getenv("PROMPT_LOG_FILE", "logs/prompts.jsonl")  # empty: no prompt log
+PROMPT_LOG_SAMPLE_RATE = float(os.getenv("PROMPT_LOG_SAMPLE_RATE", "1.0"))  # share of the requests logged
+PROMPT_LOG_MAX_BYTES = int(os.getenv("PROMPT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # rotation size
+PROMPT_LOG_BACKUPS = int(os.getenv("PROMPT_LOG_BACKUPS", "3"))  # rotated files kept (prompts.jsonl.1, .2...)
+PROMPT_LOG_QUEUE_SIZE = int(os.getenv("PROMPT_LOG_QUEUE_SIZE", "1000"))  # records waiting; beyond, they are dropped
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+class PromptLogger:
+    """
+    Background JSONL log of the prompts sent to the model. `log()` only puts the request on a bounded queue
+    (never waits: when the queue is full the record is dropped and counted), a writer thread does the hashing
+    and the disk I/O.
+
+    Each record references the system prompt and the context by hash. The text of a system prompt is written
+    once per file, in a {"type": "prompt"} record, the first time its hash appears.
+    """
+
+    def __init__(
+        self,
+        path: str = PROMPT_LOG_FILE,
+        sample_rate: float = PROMPT_LOG_SAMPLE_RATE,
+        max_bytes: int = PROMPT_LOG_MAX_BYTES,
+        backups: int = PROMPT_LOG_BACKUPS,
+        queue_size: int = PROMPT_LOG_QUEUE_SIZE,
+    ):
+        self.path = Path(path) if path else None
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.logged = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.rotations = 0
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=queue_size)
+        self._prompts_in_file = set()
+        self._file = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None and self.sample_rate > 0
+
+    def log(self, route: str, system_prompt: str, user_input: str, history: Any = "", context: str = "", **fields: Any):
+        if not self.enabled:
+            return
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        self._start()
+        request = {
+            "ts": time.time(),
+            "route": route,
+            "system_prompt": system_prompt,
+            "user_input": user_input,
+            "history": history,
+            "context": context,
+            **fields,
+        }
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="prompt-log-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            try:
+                if request is None:
+                    return
+                self._write(request)
+            except Exception as e:
+                print(f"Error while writing the prompt log: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _open(self):
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("a", encoding="utf-8")
+        return self._file
+
+    def _rotate(self):
+        # prompts.jsonl -> prompts.jsonl.1 -> prompts.jsonl.2 ..., the oldest one is deleted
+        self._file.close()
+        self._file = None
+        for index in range(self.backups, 0, -1):
+            source = self.path.with_name(f"{self.path.name}.{index - 1}") if index > 1 else self.path
+            if source.exists():
+                os.replace(source, self.path.with_name(f"{self.path.name}.{index}"))
+        if self.backups == 0:
+            self.path.unlink(missing_ok=True)
+        self._prompts_in_file.clear()
+        self.rotations += 1
+
+    def _write(self, request: Dict[str, Any]):
+        file = self._open()
+        if self.max_bytes and file.tell() >= self.max_bytes:
+            self._rotate()
+            file = self._open()
+
+        system_prompt = request.pop("system_prompt")
+        prompt_hash = text_hash(system_prompt)
+        lines = []
+        if prompt_hash not in self._prompts_in_file:
+            lines.append({"type": "prompt", "prompt_hash": prompt_hash, "text": system_prompt})
+            self._prompts_in_file.add(prompt_hash)
+
+        context = request.pop("context") or ""
+        history = request.pop("history")
+        history = history if isinstance(history, str) else str(history)
+        lines.append({
+            "type": "request",
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(request.pop("ts"))),
+            "route": request.pop("route"),
+            "prompt_hash": prompt_hash,
+            "context_hash": text_hash(context) if context else "",
+            "context_chars": len(context),
+            "history_chars": len(history),
+            "user_input": request.pop("user_input"),
+            **request,
+        })
+        file.write("".join(json.dumps(line, ensure_ascii=False, default=str) + "\n" for line in lines))
+        file.flush()
+        self.logged += 1
+
+    def flush(self, timeout: float = 5.0):
+        """Wait (at most `timeout` seconds) until the queued records are written."""
+        deadline = time.monotonic() + timeout
+        while self._thread is not None and self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        if self._thread is None:
+            return
+        self.flush()
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self._thread.join(timeout=1.0)
+        self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": str(self.path) if self.path else "",
+            "sample_rate": self.sample_rate,
+            "logged": self.logged,
+            "sampled_out": self.sampled_out,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "rotations": self.rotations,
+        }
+
+
+# One prompt log writer per process
+@lru_cache(maxsize=None)
+def get_prompt_logger() -> PromptLogger:
+    return PromptLogger()
@@ -0,0 +1,215 @@
+import copy
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+from retrieval import normalize_text
+
+# Cache settings, overridable from the environment
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+# Number of previous history lines that take part in the key (0: the answer never depends on history)
+RESPONSE_CACHE_HISTORY_LINES = int(os.getenv("RESPONSE_CACHE_HISTORY_LINES", "2"))
+# SQLite file shared by the worker processes of a host (empty: in-process cache, one per process)
+RESPONSE_CACHE_FILE = os.getenv("RESPONSE_CACHE_FILE", "")
+
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s-]")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Normalize a question so trivial variants share a key ("Quel est le prix ?" == "quel est le PRIX")."""
+    question = PUNCTUATION_PATTERN.sub(" ", normalize_text(question))
+    return WHITESPACE_PATTERN.sub(" ", question).strip()
+
+
+def history_digest(history: str, question: str = "", last_lines: int = RESPONSE_CACHE_HISTORY_LINES) -> str:
+    """
+    Digest of the end of the conversation history.
+    The history sent by the Streamlit client ends with the current question, it is left out of the digest.
+    """
+    lines = [line for line in (history or "").splitlines() if line.strip()]
+    normalized_question = normalize_question(question)
+    while lines and normalize_question(lines[-1]) == normalized_question:
+        lines.pop()
+    relevant = [normalize_question(line) for line in lines[-last_lines:]] if last_lines > 0 else []
+    return hashlib.sha1("\n".join(relevant).encode("utf-8")).hexdigest()[:16]
+
+
+def make_key(route: str, question: str, history: str = "") -> Tuple[str, str, str]:
+    return (route, normalize_question(question), history_digest(history, question))
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of answers with a time to live and hit/miss counters."""
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, route: str, question: str, history: str = "", count: bool = True) -> Optional[Any]:
+        """Cached value or None; with count=False (a peek) the counters and the LRU order are left as they are."""
+        key = make_key(route, question, history)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if not count:
+                return None if entry is None else copy.deepcopy(entry[1])
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def set(self, route: str, question: str, history: str, value: Any):
+        key = make_key(route, question, history)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+class SharedResponseCache:
+    """
+    Same interface as ResponseCache, entries in a local SQLite file (WAL mode) shared by the worker processes:
+    an answer computed by one worker is served by all of them. Values are stored as JSON.
+    Entries expire after the TTL; beyond max_size the oldest written ones are evicted (checked every 64 writes,
+    a hit does not write). A SQLite error counts as a miss, the request goes on without the cache.
+    """
+
+    TRIM_EVERY = 64
+
+    def __init__(self, path: str = RESPONSE_CACHE_FILE, max_size: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+        self._writes = 0
+        self._local = threading.local()  # one connection per thread
+        self._lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires REAL, written REAL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _error(self, e: Exception):
+        with self._lock:
+            self.errors += 1
+        print(f"Error in the shared response cache: {e}")
+
+    def get(self, route: str, question: str, history: str = "", count: bool = True) -> Optional[Any]:
+        key = "|".join(make_key(route, question, history))
+        try:
+            row = self._connection().execute("SELECT value, expires FROM responses WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            self._error(e)
+            row = None
+        if row is not None and row[1] < time.time():
+            row = None
+        if count:
+            with self._lock:
+                if row is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return None if row is None else json.loads(row[0])
+
+    def set(self, route: str, question: str, history: str, value: Any):
+        key = "|".join(make_key(route, question, history))
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl, now),
+            )
+            with self._lock:
+                self._writes += 1
+                trim = self._writes % self.TRIM_EVERY == 0
+            if trim:
+                connection.execute("DELETE FROM responses WHERE expires < ?", (now,))
+                evicted = connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY written DESC LIMIT -1 OFFSET ?)",
+                    (self.max_size,),
+                ).rowcount
+                with self._lock:
+                    self.evictions += evicted
+        except sqlite3.Error as e:
+            self._error(e)
+
+    def clear(self):
+        try:
+            self._connection().execute("DELETE FROM responses")
+        except sqlite3.Error as e:
+            self._error(e)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            size = self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        except sqlite3.Error as e:
+            self._error(e)
+            size = -1
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "errors": self.errors,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+# One cache per process, shared by the Streamlit apps and the API. With RESPONSE_CACHE_FILE, the entries are
+# in a SQLite file shared by every process of the host (the API workers)
+@lru_cache(maxsize=None)
+def get_response_cache() -> Union[ResponseCache, SharedResponseCache]:
+    if RESPONSE_CACHE_FILE:
+        return SharedResponseCache(RESPONSE_CACHE_FILE)
+    return ResponseCache()
@@ -0,0 +1,287 @@
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Sequence, Tuple, Union
+
+import numpy as np
+
+# Paragraph separator emitted by 1_parse_doc.py (see the LlamaParse parsing_instruction)
+PARAGRAPH_SEPARATOR = "<>end_paragraph<>"
+
+CORPUS_CONTEXT_PATH = Path(__file__).resolve().parent / "parsed_data/peugeot_data.txt"
+# Deduplicated and compacted corpus (context_dedupe.py), only written when smaller and without conflicting figures
+CANONICAL_CONTEXT_PATH = Path(__file__).resolve().parent / "parsed_data/context_canonical.txt"
+# The canonical context when it was built, else the parsed corpus (RETRIEVAL_CONTEXT_FILE forces a file)
+DEFAULT_CONTEXT_PATH = Path(
+    os.getenv("RETRIEVAL_CONTEXT_FILE") or (CANONICAL_CONTEXT_PATH if CANONICAL_CONTEXT_PATH.exists() else CORPUS_CONTEXT_PATH)
+)
+
+# Retrieval settings, overridable from the environment
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", "3000"))
+# Some parsed sections are huge (the first one is ~110 KB), they are split further on line boundaries
+MAX_CHUNK_CHARS = int(os.getenv("RETRIEVAL_MAX_CHUNK_CHARS", "1500"))
+# Directory of the memory-mapped index artifacts, shared by the worker processes (empty: in-memory index per process)
+RETRIEVAL_INDEX_DIRECTORY = os.getenv("RETRIEVAL_INDEX_DIR", str(Path(__file__).resolve().parent / "artifacts" / "index"))
+INDEX_ARTIFACT_VERSION = "1"  # bump when the layout of the artifacts changes
+
+# Small French/English stop word list, enough to keep BM25 from scoring on filler words
+STOP_WORDS = {
+    "a", "au", "aux", "avec", "ce", "ces", "c", "d", "dans", "de", "des", "du", "elle", "en", "est",
+    "et", "etre", "il", "ils", "je", "l", "la", "le", "les", "leur", "lui", "ma", "mais", "me", "mes",
+    "mon", "n", "ne", "nos", "notre", "nous", "on", "ou", "par", "pas", "pour", "qu", "que", "qui",
+    "s", "sa", "se", "ses", "son", "sur", "t", "ta", "te", "tu", "un", "une", "vos", "votre", "vous",
+    "y", "quel", "quelle", "quels", "quelles", "the", "of", "and", "to", "is", "what",
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase the text and strip accents ("Électrique" -> "electrique")."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> List[str]:
+    """Split a text into normalized search tokens, without stop words."""
+    return [token for token in TOKEN_PATTERN.findall(normalize_text(text)) if token not in STOP_WORDS]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for budgeting prompts."""
+    return max(1, len(text) // 4)
+
+
+def truncate_to_tokens(text: str, token_budget: int) -> str:
+    """Beginning of the text within the token budget, cut at the end of a line when there is one."""
+    max_chars = token_budget * 4
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    line_end = cut.rfind("\n")
+    return cut[:line_end].rstrip() if line_end > 0 else cut
+
+
+def split_paragraphs(text: str, max_chars: int = MAX_CHUNK_CHARS) -> List[str]:
+    """Split the parsed corpus on the end-of-paragraph markers, then split oversize sections on lines."""
+    chunks = []
+    for paragraph in text.split(PARAGRAPH_SEPARATOR):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            chunks.append(paragraph)
+            continue
+
+        current = []
+        current_size = 0
+        for line in paragraph.splitlines():
+            if current and current_size + len(line) > max_chars:
+                chunks.append("\n".join(current).strip())
+                current, current_size = [], 0
+            current.append(line)
+            current_size += len(line) + 1
+        if current and "\n".join(current).strip():
+            chunks.append("\n".join(current).strip())
+    return chunks
+
+
+class BM25Index:
+    """In-memory Okapi BM25 index over the corpus paragraphs."""
+
+    def __init__(self, paragraphs: List[str], k1: float = 1.5, b: float = 0.75):
+        self.paragraphs = paragraphs
+        self.k1 = k1
+        self.b = b
+
+        self.term_frequencies: List[Counter] = [Counter(tokenize(paragraph)) for paragraph in paragraphs]
+        self.lengths = [sum(frequencies.values()) for frequencies in self.term_frequencies]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+        # Inverted index: term -> list of (paragraph id, term frequency)
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for paragraph_id, frequencies in enumerate(self.term_frequencies):
+            for term, frequency in frequencies.items():
+                self.postings.setdefault(term, []).append((paragraph_id, frequency))
+
+        document_count = len(paragraphs)
+        self.idf = {
+            term: math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K) -> List[Tuple[int, float]]:
+        """Return the (paragraph id, score) pairs of the best matching paragraphs."""
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for paragraph_id, frequency in postings:
+                length_norm = 1 - self.b + self.b * self.lengths[paragraph_id] / self.average_length
+                score = idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+                scores[paragraph_id] = scores.get(paragraph_id, 0.0) + score
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+class MappedParagraphs(Sequence):
+    """Paragraph texts read from a memory-mapped UTF-8 file: the pages are shared by every process mapping it."""
+
+    def __init__(self, text: np.ndarray, offsets: np.ndarray):
+        self.text = text
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, paragraph_id: int) -> str:
+        if not 0 <= paragraph_id < len(self):
+            raise IndexError(paragraph_id)
+        return self.text[self.offsets[paragraph_id]:self.offsets[paragraph_id + 1]].tobytes().decode("utf-8")
+
+
+class MappedBM25Index:
+    """
+    Read-only BM25 index over memory-mapped NumPy artifacts (postings in CSR form, paragraph texts), same
+    search as BM25Index. Worker processes mapping the same files share one copy in the page cache: only the
+    vocabulary (term -> id) is held per process.
+    """
+
+    FILES = ("offsets", "doc_ids", "frequencies", "idf", "doc_norms", "paragraph_offsets")
+
+    def __init__(self, directory: Path):
+        meta = json.loads((directory / "meta.json").read_text())
+        self.k1 = meta["k1"]
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r") for name in self.FILES}
+        self.offsets = arrays["offsets"]
+        self.doc_ids = arrays["doc_ids"]
+        self.frequencies = arrays["frequencies"]
+        self.idf = arrays["idf"]
+        self.doc_norms = arrays["doc_norms"]  # k1 * (1 - b + b * length / average length), per paragraph
+        text_path = directory / "paragraphs.bin"
+        text = np.memmap(text_path, dtype=np.uint8, mode="r") if text_path.stat().st_size else np.zeros(0, np.uint8)
+        self.paragraphs = MappedParagraphs(text, arrays["paragraph_offsets"])
+        terms = (directory / "terms.txt").read_text(encoding="utf-8").split("\n") if meta["terms"] else []
+        self.term_ids = {term: term_id for term_id, term in enumerate(terms)}
+
+    @staticmethod
+    def write(index: BM25Index, directory: Path):
+        """Write the artifacts of an in-memory index."""
+        terms = sorted(index.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(index.postings[term]) for term in terms])
+        postings = [posting for term in terms for posting in index.postings[term]]
+        encoded = [paragraph.encode("utf-8") for paragraph in index.paragraphs]
+        paragraph_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        paragraph_offsets[1:] = np.cumsum([len(paragraph) for paragraph in encoded])
+        lengths = np.array(index.lengths, dtype=np.float64)
+        average_length = index.average_length or 1.0
+
+        arrays = {
+            "offsets": offsets,
+            "doc_ids": np.array([paragraph_id for paragraph_id, _ in postings], dtype=np.int32),
+            "frequencies": np.array([frequency for _, frequency in postings], dtype=np.float64),
+            "idf": np.array([index.idf[term] for term in terms], dtype=np.float64),
+            "doc_norms": index.k1 * (1 - index.b + index.b * lengths / average_length),
+            "paragraph_offsets": paragraph_offsets,
+        }
+        for name, array in arrays.items():
+            np.save(directory / f"{name}.npy", array)
+        (directory / "paragraphs.bin").write_bytes(b"".join(encoded))
+        (directory / "terms.txt").write_text("\n".join(terms), encoding="utf-8")
+        meta = {"k1": index.k1, "b": index.b, "paragraphs": len(encoded), "terms": len(terms)}
+        (directory / "meta.json").write_text(json.dumps(meta))
+
+    @classmethod
+    def load_or_build(cls, context_path: Path, index_directory: Path) -> "MappedBM25Index":
+        """
+        Map the artifacts of this version of the context, building them first if needed. The build goes to a
+        private directory renamed in place: concurrent workers never see partial artifacts, the first rename wins.
+        """
+        digest = hashlib.sha256(context_path.read_bytes())
+        digest.update(f"{MAX_CHUNK_CHARS}|{INDEX_ARTIFACT_VERSION}".encode())
+        directory = index_directory / f"{context_path.stem}-{digest.hexdigest()[:16]}"
+        if not directory.exists():
+            index_directory.mkdir(parents=True, exist_ok=True)
+            temporary = index_directory / f".{directory.name}.{os.getpid()}.tmp"
+            shutil.rmtree(temporary, ignore_errors=True)
+            temporary.mkdir()
+            cls.write(BM25Index(split_paragraphs(context_path.read_text())), temporary)
+            try:
+                os.rename(temporary, directory)
+            except OSError:
+                shutil.rmtree(temporary, ignore_errors=True)  # built by another worker meanwhile
+            # Older versions of this context: processes still mapping them keep their pages until they exit
+            for stale in index_directory.glob(f"{context_path.stem}-*"):
+                if stale != directory:
+                    shutil.rmtree(stale, ignore_errors=True)
+        return cls(directory)
+
+    def search(self, query: str, top_k: int = RETRIEVAL_TOP_K) -> List[Tuple[int, float]]:
+        """Return the (paragraph id, score) pairs of the best matching paragraphs."""
+        scores = np.zeros(len(self.doc_norms), dtype=np.float64)
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            paragraph_ids = self.doc_ids[start:end]
+            frequencies = self.frequencies[start:end]
+            scores[paragraph_ids] += self.idf[term_id] * frequencies * (self.k1 + 1) / (frequencies + self.doc_norms[paragraph_ids])
+
+        matched = np.flatnonzero(scores)
+        best = matched[np.argsort(-scores[matched], kind="stable")[:top_k]]
+        return [(int(paragraph_id), float(scores[paragraph_id])) for paragraph_id in best]
+
+
+# Build the index once per process (at startup or on first use). With RETRIEVAL_INDEX_DIR, the first process
+# writes the memory-mapped artifacts and the others only map them
+@lru_cache(maxsize=None)
+def get_index(context_path: str = str(DEFAULT_CONTEXT_PATH)) -> Union[BM25Index, MappedBM25Index]:
+    path = Path(context_path)
+    if not path.exists():
+        raise FileNotFoundError("Context file not found.")
+    if RETRIEVAL_INDEX_DIRECTORY:
+        return MappedBM25Index.load_or_build(path, Path(RETRIEVAL_INDEX_DIRECTORY))
+    return BM25Index(split_paragraphs(path.read_text()))
+
+
+def retrieve_context(
+    question: str,
+    top_k: int = RETRIEVAL_TOP_K,
+    token_budget: int = RETRIEVAL_TOKEN_BUDGET,
+    context_path: str = str(DEFAULT_CONTEXT_PATH),
+) -> str:
+    """
+    Return the most relevant paragraphs for the question, joined in document order.
+    Paragraphs are taken by decreasing score until top_k, skipping those over the token budget; when the best
+    paragraph alone is over it, only its beginning is sent.
+    """
+    index = get_index(context_path)
+
+    selected: Dict[int, str] = {}
+    used_tokens = 0
+    for paragraph_id, _score in index.search(question, top_k=top_k):
+        paragraph = index.paragraphs[paragraph_id]
+        paragraph_tokens = estimate_tokens(paragraph)
+        if used_tokens + paragraph_tokens > token_budget:
+            if selected:
+                continue
+            paragraph = truncate_to_tokens(paragraph, token_budget)
+            if not paragraph:
+                break
+            paragraph_tokens = estimate_tokens(paragraph)
+        selected[paragraph_id] = paragraph
+        used_tokens += paragraph_tokens
+
+    return "\n\n".join(selected[paragraph_id] for paragraph_id in sorted(selected))
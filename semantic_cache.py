@@ -0,0 +1,220 @@
+import copy
+import os
+import re
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from faq_store import content_version
+from response_cache import RESPONSE_CACHE_TTL, history_digest
+from retrieval import STOP_WORDS, TOKEN_PATTERN, normalize_text
+
+# Semantic cache settings, overridable from the environment
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))  # max entries per route
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", str(RESPONSE_CACHE_TTL)))  # seconds
+SEMANTIC_CACHE_VERSION_INTERVAL = float(os.getenv("SEMANTIC_CACHE_VERSION_INTERVAL", "60"))  # seconds between checks
+VECTOR_DIMENSION = 2 ** 12
+STEM_LENGTH = 5  # "recharger" and "recharge" are the same content word
+
+# Model names and numbers ("e208", "2008", "50") must match exactly: "autonomie e-208" is close to
+# "autonomie e-2008" for the vectorizer but the answer is not the same
+KEY_TOKEN_PATTERN = re.compile(r"\d")
+# Negations and restrictions change the answer ("je ne veux pas acheter"): not stop words here
+NEGATION_WORDS = {"ne", "n", "pas", "plus", "jamais", "rien", "aucun", "aucune", "sans", "sauf", "non", "ni"}
+QUESTION_STOP_WORDS = STOP_WORDS - NEGATION_WORDS
+
+
+def _question_tokens(question: str) -> List[str]:
+    # "e-208" and "e208" are the same model
+    text = normalize_text(re.sub(r"\b([a-z])-(\d)", r"\1\2", question.lower()))
+    return [token for token in TOKEN_PATTERN.findall(text) if token not in QUESTION_STOP_WORDS]
+
+
+def key_tokens(question: str) -> frozenset:
+    return frozenset(token for token in _question_tokens(question) if KEY_TOKEN_PATTERN.search(token))
+
+
+def content_stems(question: str) -> frozenset:
+    return frozenset(token[:STEM_LENGTH] for token in _question_tokens(question))
+
+
+def scope_of(question: str, history: str) -> str:
+    """
+    Entries are only compared with questions of the same recent history, the same key tokens and the same
+    content words (up to inflection and word order): a qualifier ("rapidement") or a negation is another question.
+    """
+    return "|".join([
+        history_digest(history, question),
+        ",".join(sorted(key_tokens(question))),
+        ",".join(sorted(content_stems(question))),
+    ])
+
+
+class HashingVectorizer:
+    """
+    Local, offline vectorizer: words and character 3-grams of words hashed into a fixed size vector.
+    crc32 is used instead of hash() so vectors are stable across processes.
+    """
+
+    def __init__(self, dimension: int = VECTOR_DIMENSION, ngram: int = 3):
+        self.dimension = dimension
+        self.ngram = ngram
+
+    def _features(self, question: str) -> List[Tuple[str, float]]:
+        features = []
+        for token in _question_tokens(question):
+            features.append(("w:" + token, 1.0))
+            padded = f"<{token}>"
+            for start in range(max(1, len(padded) - self.ngram + 1)):
+                features.append(("c:" + padded[start:start + self.ngram], 0.5))
+        return features
+
+    def transform(self, question: str) -> np.ndarray:
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature, weight in self._features(question):
+            vector[zlib.crc32(feature.encode("utf-8")) % self.dimension] += weight
+        # Sublinear term frequency, then L2 normalization so a dot product is a cosine similarity
+        np.log1p(vector, out=vector)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class _RouteEntries:
+    """Vectors of the cached questions of one route, rows of a matrix grown by doubling up to max_entries."""
+
+    def __init__(self, dimension: int, max_entries: int, initial_capacity: int = 32):
+        self.max_entries = max_entries
+        self.matrix = np.zeros((min(initial_capacity, max_entries), dimension), dtype=np.float32)
+        self.scope_ids = np.zeros(len(self.matrix), dtype=np.uint32)  # crc32 of the scope, for masking
+        self.expires = np.zeros(len(self.matrix), dtype=np.float64)  # time.monotonic() deadlines
+        self.scopes: List[str] = []
+        self.questions: List[str] = []
+        self.answers: List[Any] = []
+        self.next_slot = 0  # once full, the oldest entry is overwritten
+
+    @property
+    def count(self) -> int:
+        return len(self.questions)
+
+    def add(self, vector: np.ndarray, scope: str, question: str, answer: Any, expires: float):
+        if self.count < self.max_entries:
+            if self.count == len(self.matrix):
+                capacity = min(2 * len(self.matrix), self.max_entries)
+                self.matrix = np.vstack([self.matrix, np.zeros((capacity - len(self.matrix), self.matrix.shape[1]), dtype=np.float32)])
+                self.scope_ids = np.concatenate([self.scope_ids, np.zeros(capacity - len(self.scope_ids), dtype=np.uint32)])
+                self.expires = np.concatenate([self.expires, np.zeros(capacity - len(self.expires), dtype=np.float64)])
+            slot = self.count
+            self.scopes.append(scope)
+            self.questions.append(question)
+            self.answers.append(answer)
+        else:
+            slot = self.next_slot
+            self.scopes[slot] = scope
+            self.questions[slot] = question
+            self.answers[slot] = answer
+            self.next_slot = (slot + 1) % self.max_entries
+        self.matrix[slot] = vector
+        self.scope_ids[slot] = zlib.crc32(scope.encode("utf-8"))
+        self.expires[slot] = expires
+
+    def best_match(self, vector: np.ndarray, scope: str, now: float) -> Tuple[int, float]:
+        """Vectorized top-1: cosine similarities of all the rows, rows of other scopes or expired masked out."""
+        similarities = self.matrix[:self.count] @ vector
+        similarities[self.scope_ids[:self.count] != zlib.crc32(scope.encode("utf-8"))] = -1.0
+        similarities[self.expires[:self.count] < now] = -1.0
+        best = int(np.argmax(similarities))
+        return best, float(similarities[best])
+
+
+class SemanticCache:
+    """
+    Cache of answers for paraphrased questions: a question is served the answer of the most similar cached
+    question of the same route (and same recent history), when the cosine similarity passes the threshold.
+    Entries expire after the TTL and belong to a content version (prompts, context, models, code: see
+    faq_store.content_version): a new version (checked every SEMANTIC_CACHE_VERSION_INTERVAL seconds with the
+    version provider, or given to set_version) drops them.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries_per_route: int = SEMANTIC_CACHE_SIZE,
+        vectorizer: Optional[HashingVectorizer] = None,
+        ttl: float = SEMANTIC_CACHE_TTL,
+        version_provider: Optional[Callable[[], str]] = None,
+        version_interval: float = SEMANTIC_CACHE_VERSION_INTERVAL,
+    ):
+        self.threshold = threshold
+        self.max_entries_per_route = max_entries_per_route
+        self.vectorizer = vectorizer or HashingVectorizer()
+        self.ttl = ttl
+        self.version_provider = version_provider
+        self.version_interval = version_interval
+        self.version = version_provider() if version_provider else ""
+        self._next_version_check = time.monotonic() + version_interval
+        self.hits = 0
+        self.misses = 0
+        self._routes: Dict[str, _RouteEntries] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, route: str, question: str, history: str = "") -> Optional[Tuple[Any, float, str]]:
+        """Return (answer, similarity, cached question) of the best match, or None."""
+        self._check_version()
+        vector = self.vectorizer.transform(question)
+        scope = scope_of(question, history)
+
+        with self._lock:
+            entries = self._routes.get(route)
+            if entries is not None and entries.count:
+                best, similarity = entries.best_match(vector, scope, time.monotonic())
+                if similarity >= self.threshold and entries.scopes[best] == scope:
+                    self.hits += 1
+                    return copy.deepcopy(entries.answers[best]), similarity, entries.questions[best]
+            self.misses += 1
+            return None
+
+    def add(self, route: str, question: str, history: str, answer: Any):
+        self._check_version()
+        vector = self.vectorizer.transform(question)
+        with self._lock:
+            entries = self._routes.get(route)
+            if entries is None:
+                entries = self._routes[route] = _RouteEntries(self.vectorizer.dimension, self.max_entries_per_route)
+            entries.add(vector, scope_of(question, history), question, copy.deepcopy(answer), time.monotonic() + self.ttl)
+
+    def _check_version(self):
+        if self.version_provider is None or time.monotonic() < self._next_version_check:
+            return
+        self._next_version_check = time.monotonic() + self.version_interval
+        self.set_version(self.version_provider())
+
+    def set_version(self, version: str):
+        """Content version of the answers; the entries of another version are dropped."""
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._routes.clear()
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "version": self.version,
+                "entries": {route: entries.count for route, entries in self._routes.items()},
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+# One semantic cache per process, shared by the Streamlit apps and the API
+@lru_cache(maxsize=None)
+def get_semantic_cache() -> SemanticCache:
+    return SemanticCache(version_provider=content_version)
@@ -0,0 +1,342 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from history_store import HISTORY_IDLE_TTL, HISTORY_MAX_MESSAGES, HISTORY_MAX_SESSIONS, HISTORY_MAX_TOKENS, SessionHistoryStore, _Session
+from retrieval import estimate_tokens
+
+# Persistent session store settings, overridable from the environment
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.5"))  # seconds between two batched writes
+HISTORY_FLUSH_BATCH = int(os.getenv("HISTORY_FLUSH_BATCH", "256"))  # pending messages that trigger a write early
+HISTORY_RETENTION = float(os.getenv("HISTORY_RETENTION", str(7 * 24 * 3600)))  # idle seconds before deletion on disk
+HISTORY_EXPIRY_INTERVAL = float(os.getenv("HISTORY_EXPIRY_INTERVAL", "60"))  # seconds between two expiry passes
+HISTORY_MAX_PENDING = int(os.getenv("HISTORY_MAX_PENDING", "10000"))  # unwritten messages kept while the backend fails
+
+
+class SqliteSessionBackend:
+    """
+    On-disk conversation store in an embedded SQLite file (WAL mode), one connection per thread.
+    Any backend with the same methods (load, updated, write, delete, purge, count) can be plugged in.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT, ts REAL, role TEXT, content TEXT, tokens INTEGER)"
+        )
+        connection.execute("CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id)")
+        connection.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, updated REAL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, session_id: str, limit: int) -> Tuple[List[Tuple[str, Any, int]], float]:
+        """Last `limit` messages (role, content, tokens) of the session, oldest first, and its last update time."""
+        connection = self._connection()
+        rows = connection.execute(
+            "SELECT role, content, tokens FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?", (session_id, limit)
+        ).fetchall()
+        return [(role, json.loads(content), tokens) for role, content, tokens in reversed(rows)], self.updated(session_id)
+
+    def updated(self, session_id: str) -> float:
+        row = self._connection().execute("SELECT updated FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else 0.0
+
+    def write(self, messages: List[Tuple[str, float, str, str, int]]) -> Dict[str, float]:
+        """
+        Write a batch of (session_id, ts, role, content as JSON text, tokens) in one transaction;
+        returns the update time per session.
+        """
+        updated: Dict[str, float] = {}
+        for session_id, ts, _role, _content, _tokens in messages:
+            updated[session_id] = max(ts, updated.get(session_id, 0.0))
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT INTO messages (session_id, ts, role, content, tokens) VALUES (?, ?, ?, ?, ?)",
+                [(session_id, ts, role, content, tokens) for session_id, ts, role, content, tokens in messages],
+            )
+            # Another worker may have written the session later: the update time never goes back
+            connection.executemany(
+                "INSERT INTO sessions VALUES (?, ?) ON CONFLICT (session_id) DO UPDATE SET updated = MAX(updated, excluded.updated)",
+                list(updated.items()),
+            )
+        return updated
+
+    def delete(self, session_id: str):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge(self, older_than: float) -> int:
+        """Delete the sessions not updated since `older_than` (epoch seconds); returns their number."""
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.execute(
+                "DELETE FROM messages WHERE session_id IN (SELECT session_id FROM sessions WHERE updated < ?)", (older_than,)
+            )
+            return connection.execute("DELETE FROM sessions WHERE updated < ?", (older_than,)).rowcount
+
+    def count(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class PersistentSessionStore(SessionHistoryStore):
+    """
+    SessionHistoryStore (in-memory LRU, bounded per session) in front of a persistent backend:
+    - a session missing from memory is loaded lazily from the backend on its first request (restart, other worker)
+    - appends are write-behind: they go to memory and a pending list, a background thread writes the pending
+      messages in batches (every HISTORY_FLUSH_INTERVAL seconds, or HISTORY_FLUSH_BATCH messages)
+    - a session with no pending write is reloaded when the backend has a newer version (written by another worker)
+    - the same thread evicts idle sessions from memory (never the ones with pending writes) and deletes the
+      sessions idle for HISTORY_RETENTION seconds from the backend
+    - the content is serialized on append (TypeError for content that is not JSON): the writer only writes text
+    - a failed write is retried with the next batch, at most HISTORY_MAX_PENDING messages (the oldest are dropped);
+      an error never stops the writer thread
+    - clearing a session bumps its generation: messages appended before are never written, even if a batch
+      holding them was being written (the clear waits for it, then deletes)
+    """
+
+    def __init__(
+        self,
+        backend,
+        max_messages: int = HISTORY_MAX_MESSAGES,
+        max_tokens: int = HISTORY_MAX_TOKENS,
+        idle_ttl: float = HISTORY_IDLE_TTL,
+        max_sessions: int = HISTORY_MAX_SESSIONS,
+        flush_interval: float = HISTORY_FLUSH_INTERVAL,
+        flush_batch: int = HISTORY_FLUSH_BATCH,
+        retention: float = HISTORY_RETENTION,
+        expiry_interval: float = HISTORY_EXPIRY_INTERVAL,
+        max_pending: int = HISTORY_MAX_PENDING,
+    ):
+        super().__init__(max_messages, max_tokens, idle_ttl, max_sessions)
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.retention = retention
+        self.expiry_interval = expiry_interval
+        self.max_pending = max_pending
+        self.loaded_sessions = 0
+        self.reloaded_sessions = 0
+        self.flushed_messages = 0
+        self.flushes = 0
+        self.purged_sessions = 0
+        self.dropped_messages = 0
+        self.errors = 0
+        # (generation of the session, message) not written yet; a message of an older generation was cleared
+        self._pending: List[Tuple[int, Tuple[str, float, str, str, int]]] = []
+        self._generations: Dict[str, int] = {}
+        self._flush_lock = threading.Lock()  # held while a batch is written: clear() waits for it
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="session-store-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _error(self, e: Exception):
+        self.errors += 1
+        print(f"Error in the session store: {e}")
+
+    def _evict(self, now: float):
+        # Same policy as the in-memory store, but a session is kept while it has unwritten messages
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions and now - self._sessions[session_id].last_seen < self.idle_ttl:
+                break
+            if not self._sessions[session_id].pending:
+                del self._sessions[session_id]
+                self.evicted_sessions += 1
+
+    def _build_session(self, messages: List[Tuple[str, Any, int]], updated: float) -> _Session:
+        session = _Session(self.max_messages)
+        for message in messages:
+            session.messages.append(message)
+            session.tokens += message[2]
+        while session.tokens > self.max_tokens and len(session.messages) > 1:
+            session.tokens -= session.messages.popleft()[2]
+        session.synced = updated
+        return session
+
+    def _session(self, session_id: str, check_backend: bool) -> Optional[_Session]:
+        """In-memory session, loaded from the backend (or reloaded when another worker wrote it) if needed."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and (session.pending or not check_backend):
+                return session
+        try:
+            if session is not None and self.backend.updated(session_id) <= session.synced:
+                return session
+            messages, updated = self.backend.load(session_id, self.max_messages)
+        except sqlite3.Error as e:
+            self._error(e)
+            return session
+        with self._lock:
+            current = self._sessions.get(session_id)
+            if current is not None and current is not session:
+                return current  # loaded by another request meanwhile
+            if current is not None and current.pending:
+                return current  # appended to meanwhile: the newest state is in memory
+            if not messages and current is None:
+                return None
+            loaded = self._build_session(messages, updated)
+            loaded.last_seen = time.monotonic()
+            self._sessions[session_id] = loaded
+            self._sessions.move_to_end(session_id)
+            if session is None:
+                self.loaded_sessions += 1
+            else:
+                self.reloaded_sessions += 1
+            return loaded
+
+    def append(self, session_id: str, role: str, content: Any):
+        # Raises in the caller (TypeError) rather than in the writer thread, where the batch would be lost
+        serialized = json.dumps(content, ensure_ascii=False)
+        self._session(session_id, check_backend=False)
+        tokens = estimate_tokens(str(content))
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = self._build_session([], 0.0)
+            session.pending += 1
+            self._pending.append((self._generations.get(session_id, 0), (session_id, time.time(), role, serialized, tokens)))
+            self._drop_oldest()
+            wake = len(self._pending) >= self.flush_batch
+        super().append(session_id, role, content)
+        if wake:
+            self._wake.set()
+
+    def get(self, session_id: str) -> List[Dict[str, Any]]:
+        self._session(session_id, check_backend=True)
+        return super().get(session_id)
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._generations[session_id] = self._generations.get(session_id, 0) + 1
+            self._pending = [entry for entry in self._pending if entry[1][0] != session_id]
+            self._sessions.pop(session_id, None)
+        # A batch taken by the writer before the clear may hold messages of the session: deleted after it
+        with self._flush_lock:
+            try:
+                self.backend.delete(session_id)
+            except sqlite3.Error as e:
+                self._error(e)
+
+    def _current(self, entries: List[Tuple[int, Tuple[str, float, str, str, int]]]):
+        """Entries whose session was not cleared since they were appended (called with the lock held)."""
+        return [entry for entry in entries if entry[0] == self._generations.get(entry[1][0], 0)]
+
+    def _drop_oldest(self):
+        """Bound the pending messages while the backend fails or is slower than the appends (called with the lock held)."""
+        overflow = len(self._pending) - self.max_pending
+        if overflow <= 0:
+            return
+        for _generation, (session_id, _ts, _role, _content, _tokens) in self._pending[:overflow]:
+            session = self._sessions.get(session_id)
+            if session is not None and session.pending:
+                session.pending -= 1
+        self._pending = self._pending[overflow:]
+        self.dropped_messages += overflow
+        print(f"Session store: {overflow} unwritten messages dropped ({self.max_pending} pending at most)")
+
+    def flush(self):
+        """Write the pending messages now (one batch)."""
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            entries, self._pending = self._current(self._pending), []
+        if not entries:
+            return
+        batch = [message for _generation, message in entries]
+        try:
+            updated = self.backend.write(batch)
+        except Exception as e:
+            self._error(e)
+            with self._lock:
+                # Retried with the next batch, unless cleared meanwhile
+                self._pending = self._current(entries) + self._pending
+                self._drop_oldest()
+            return
+        with self._lock:
+            # The messages of a session cleared meanwhile are deleted by clear(), its new messages still pending
+            for _generation, (session_id, _ts, _role, _content, _tokens) in self._current(entries):
+                session = self._sessions.get(session_id)
+                if session is not None and session.pending:
+                    session.pending -= 1
+                    if not session.pending:
+                        session.synced = updated[session_id]
+            self.flushed_messages += len(batch)
+            self.flushes += 1
+
+    def expire(self):
+        """Evict the idle sessions from memory, delete the sessions idle for the retention time from the backend."""
+        with self._lock:
+            self._evict(time.monotonic())
+        # Generations are only needed while the session has unwritten messages (none in flight: flush lock held)
+        with self._flush_lock, self._lock:
+            pending_sessions = {message[0] for _generation, message in self._pending}
+            self._generations = {
+                session_id: generation for session_id, generation in self._generations.items() if session_id in pending_sessions
+            }
+        try:
+            self.purged_sessions += self.backend.purge(time.time() - self.retention)
+        except sqlite3.Error as e:
+            self._error(e)
+
+    def _run(self):
+        next_expiry = time.monotonic() + self.expiry_interval
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                if time.monotonic() >= next_expiry:
+                    next_expiry = time.monotonic() + self.expiry_interval
+                    self.expire()
+            except Exception as e:
+                # The thread is the only writer: it must outlive any error (a failed write is requeued by _flush)
+                self._error(e)
+
+    def close(self):
+        """Stop the writer thread and write what is pending (at exit, or shutdown of the API)."""
+        if self._stopped:
+            return
+        self._stopped = True
+        self._wake.set()
+        self._thread.join(timeout=2.0)
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        stats = super().stats()
+        with self._lock:
+            stats.update({
+                "pending": len(self._pending),
+                "flushed_messages": self.flushed_messages,
+                "flushes": self.flushes,
+                "loaded_sessions": self.loaded_sessions,
+                "reloaded_sessions": self.reloaded_sessions,
+                "purged_sessions": self.purged_sessions,
+                "dropped_messages": self.dropped_messages,
+                "errors": self.errors,
+            })
+        return stats
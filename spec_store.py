@@ -0,0 +1,253 @@
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from intent_router import MODEL_PATTERN
+from retrieval import normalize_text
+
+DEFAULT_SPEC_PATH = Path(__file__).resolve().parent / "parsed_data" / "peugeot_capacity_data.txt"
+
+# Plain spec questions ("autonomie de la e-208 ?") are answered without the model, SPEC_DIRECT_ANSWERS=0 disables it
+SPEC_DIRECT_ANSWERS = os.getenv("SPEC_DIRECT_ANSWERS", "1") not in ("", "0", "false")
+SPEC_DIRECT_MAX_WORDS = int(os.getenv("SPEC_DIRECT_MAX_WORDS", "12"))
+
+FIELD_PATTERN = re.compile(r'"([^"]+)"\s*:\s*"([^"]*)"')
+DURATION_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*(h|min)")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)?")
+POWER_PATTERN = re.compile(r"\b\d+kW$")
+# Version named in a (normalized) question: motor power or battery capacity
+QUESTION_POWER_PATTERN = re.compile(r"\b(\d+)\s*kw\b")
+QUESTION_BATTERY_PATTERN = re.compile(r"\b(\d+(?:[.,]\d+)?)\s*kwh\b")
+FAMILY_PATTERN = re.compile(r"\be?(\d{3,4})\b|\b(expert|partner)\b", re.IGNORECASE)
+
+HOME_CHARGING = "domicile"
+PUBLIC_CHARGING = "publique"
+CHARGING_FIELDS = {
+    "easy_wb_installation": HOME_CHARGING,
+    "epro_wb_installation": HOME_CHARGING,
+    "chargeur_rapide_dc": PUBLIC_CHARGING,
+}
+CHARGER_LABELS = {
+    "easy_wb_installation": "wallbox installation Easy",
+    "epro_wb_installation": "wallbox installation e-Pro",
+    "chargeur_rapide_dc": "chargeur rapide DC",
+}
+
+# What a question asks about, and words that mean it is more than a plain lookup
+ATTRIBUTE_PATTERNS = {
+    "range": re.compile(r"\b(autonomie|wltp|parcourir|rouler)\b"),
+    "battery": re.compile(r"\b(batterie|capacite|kwh)\b"),
+    HOME_CHARGING: re.compile(r"\b(domicile|maison|wallbox|wall box|prise)\b"),
+    PUBLIC_CHARGING: re.compile(r"\b(rapide|borne\w*|publique?|dc|autoroute)\b"),
+}
+CHARGING_PATTERN = re.compile(r"\b(recharg\w*|charge)\b")
+NOT_A_LOOKUP_PATTERN = re.compile(
+    r"\b(prix|cout|essai\w*|essayer|compar\w*|versus|vs|difference|pourquoi|comment|occasion|adapte\w*|suffi\w*"
+    r"|assez|conseil\w*|vacances|trajet\w*|voyage\w*|meilleure?s?|choisir|hiver|froid"
+    r"|garanti\w*|tarif\w*|euros?|loyer\w*|leasing|lld|loa|mensualit\w*|financement|bonus|aide\w*"
+    r"|thermique\w*|essence|diesel|hybride\w*|gpl|puretech|bluehdi)\b"
+)
+
+
+@dataclass(frozen=True)
+class VehicleSpec:
+    model: str  # as written in the data file, e.g. "Peugeot e208 115kW"
+    family: str  # "208", "2008", ..., "expert", "partner"
+    battery_kwh: float
+    wltp_range_km: float
+    charging_minutes: Dict[str, float] = field(default_factory=dict)  # charger -> minutes for a full charge
+
+    def fastest_charge(self, charging_type: str) -> Optional[tuple]:
+        """(charger, minutes) of the fastest charger of a type (domicile or publique), or None."""
+        options = [(minutes, charger) for charger, minutes in self.charging_minutes.items()
+                   if CHARGING_FIELDS.get(charger) == charging_type]
+        if not options:
+            return None
+        minutes, charger = min(options)
+        return charger, minutes
+
+
+def _number(value: str) -> float:
+    match = NUMBER_PATTERN.search(value)
+    return float(match.group().replace(",", ".")) if match else 0.0
+
+
+def _minutes(value: str) -> float:
+    match = DURATION_PATTERN.search(value)
+    if match is None:
+        return 0.0
+    amount = float(match.group(1).replace(",", "."))
+    return amount * 60 if match.group(2) == "h" else amount
+
+
+def family_of(model: str) -> str:
+    match = FAMILY_PATTERN.search(model)
+    if match is None:
+        return normalize_text(model)
+    return match.group(1) or match.group(2).lower()
+
+
+def short_name(family: str) -> str:
+    return f"e-{family if family.isdigit() else family.capitalize()}"
+
+
+def display_name(family: str) -> str:
+    return f"Peugeot {short_name(family)}"
+
+
+def format_duration(minutes: float) -> str:
+    if minutes < 60:
+        return f"{minutes:g} min"
+    hours, rest = divmod(minutes, 60)
+    return f"{hours:g} h" + (f" {rest:02g}" if rest else "")
+
+
+def parse_specs(text: str) -> List[VehicleSpec]:
+    """Parse the pseudo-JSON "véhicules" block of the capacity file: one spec per "modèle" entry."""
+    start = text.find('"véhicules"')
+    end = text.find("]", start)
+    block = text[start:end] if start != -1 else text
+    specs = []
+    # Each vehicle starts at its "modèle" field and runs until the next one
+    for chunk in re.split(r'(?="modèle"\s*:)', block)[1:]:
+        fields = dict(FIELD_PATTERN.findall(chunk))
+        specs.append(VehicleSpec(
+            model=fields["modèle"],
+            family=family_of(fields["modèle"]),
+            battery_kwh=_number(fields.get("capacité_batterie", "")),
+            wltp_range_km=_number(fields.get("autonomie_wltp", "")),
+            charging_minutes={charger: _minutes(fields[charger]) for charger in CHARGING_FIELDS if charger in fields},
+        ))
+    return specs
+
+
+class SpecStore:
+    """
+    Capacity data of the Peugeot EV range as a typed table, parsed once. Answers the lookups the capacity
+    prompt used to leave to the model: longest range of a model across its versions, fastest charge per type.
+    """
+
+    def __init__(self, specs: List[VehicleSpec]):
+        self.specs = specs
+        self.by_family: Dict[str, List[VehicleSpec]] = {}
+        for spec in specs:
+            self.by_family.setdefault(spec.family, []).append(spec)
+
+    def families_in(self, question: str) -> List[str]:
+        """Families of the store mentioned in a question, in order of appearance."""
+        families = []
+        for match in MODEL_PATTERN.finditer(normalize_text(question)):
+            family = match.group(2)
+            if family in self.by_family and family not in families:
+                families.append(family)
+        return families
+
+    def versions_in(self, family: str, text: str) -> Optional[List[VehicleSpec]]:
+        """
+        Versions of a model a normalized question is about: all of them, the ones of the power or battery it
+        names, or None when it names a version the data does not have or another figure (not a plain lookup).
+        """
+        versions = self.by_family.get(family, [])
+        for power in QUESTION_POWER_PATTERN.findall(text):
+            versions = [spec for spec in versions if spec.model.lower().endswith(f" {power}kw")]
+        for battery in QUESTION_BATTERY_PATTERN.findall(text):
+            versions = [spec for spec in versions if spec.battery_kwh == float(battery.replace(",", "."))]
+        rest = QUESTION_BATTERY_PATTERN.sub(" ", QUESTION_POWER_PATTERN.sub(" ", MODEL_PATTERN.sub(" ", text)))
+        if not versions or NUMBER_PATTERN.search(rest):
+            return None
+        return versions
+
+    def max_range(self, family: str, versions: Optional[List[VehicleSpec]] = None) -> Optional[VehicleSpec]:
+        versions = self.by_family.get(family) if versions is None else versions
+        return max(versions, key=lambda spec: spec.wltp_range_km) if versions else None
+
+    def max_battery(self, family: str, versions: Optional[List[VehicleSpec]] = None) -> Optional[VehicleSpec]:
+        versions = self.by_family.get(family) if versions is None else versions
+        return max(versions, key=lambda spec: spec.battery_kwh) if versions else None
+
+    def fastest_charge(
+        self, family: str, charging_type: str, versions: Optional[List[VehicleSpec]] = None
+    ) -> Optional[tuple]:
+        """(charger, minutes, spec) of the fastest charge of a type across the versions of a model."""
+        options = []
+        for spec in self.by_family.get(family, []) if versions is None else versions:
+            fastest = spec.fastest_charge(charging_type)
+            if fastest is not None:
+                options.append((fastest[1], fastest[0], spec))
+        if not options:
+            return None
+        minutes, charger, spec = min(options, key=lambda option: option[0])
+        return charger, minutes, spec
+
+    def facts(self, family: str) -> str:
+        """One line with the figures of a model already computed, to put in the prompt."""
+        best = self.max_range(family)
+        parts = [f"autonomie maximale {best.wltp_range_km:g} km WLTP (avec la batterie de {best.battery_kwh:g} kWh)"]
+        battery = self.max_battery(family)
+        parts.append(f"batterie jusqu'à {battery.battery_kwh:g} kWh")
+        for charging_type in (HOME_CHARGING, PUBLIC_CHARGING):
+            fastest = self.fastest_charge(family, charging_type)
+            if fastest is not None:
+                charger, minutes, _ = fastest
+                parts.append(f"recharge {charging_type} la plus rapide {format_duration(minutes)} ({CHARGER_LABELS[charger]})")
+        return f"{display_name(family)} : " + " ; ".join(parts)
+
+    def facts_for(self, question: str) -> str:
+        """Computed figures of the models of a question (of every model when none is named)."""
+        families = self.families_in(question) or list(self.by_family)
+        return "\n".join(self.facts(family) for family in families)
+
+    def direct_answer(self, question: str) -> Optional[Dict]:
+        """
+        ResponseModel answer of a plain lookup (one model, one figure), or None when the question needs the model.
+        A named version (power, battery) is answered with its own figures; one missing from the data goes to the model.
+        """
+        text = normalize_text(question)
+        families = self.families_in(question)
+        if len(families) != 1 or len(text.split()) > SPEC_DIRECT_MAX_WORDS or NOT_A_LOOKUP_PATTERN.search(text):
+            return None
+        attributes = [name for name, pattern in ATTRIBUTE_PATTERNS.items() if pattern.search(text)]
+        if not attributes and CHARGING_PATTERN.search(text):
+            attributes = [HOME_CHARGING, PUBLIC_CHARGING]
+        if not attributes or (len(attributes) > 1 and set(attributes) != {HOME_CHARGING, PUBLIC_CHARGING}):
+            return None
+
+        # In a charging question, a power can be the one of the charger ("borne 100 kW"): left to the model
+        if QUESTION_POWER_PATTERN.search(text) and attributes not in (["range"], ["battery"]):
+            return None
+        family = families[0]
+        versions = self.versions_in(family, text)
+        if versions is None:
+            return None
+        name = display_name(family)
+        if attributes == ["range"]:
+            spec = self.max_range(family, versions)
+            power = POWER_PATTERN.search(spec.model)
+            version = f"version {power.group()}, " if power else ""
+            response = (f"La {name} offre jusqu'à {spec.wltp_range_km:g} km d'autonomie WLTP "
+                        f"({version}batterie de {spec.battery_kwh:g} kWh).")
+            key_words = ["Temps de recharge", f"Essai {short_name(family)}"]
+        elif attributes == ["battery"]:
+            spec = self.max_battery(family, versions)
+            response = (f"La {name} dispose d'une batterie allant jusqu'à {spec.battery_kwh:g} kWh, "
+                        f"pour {spec.wltp_range_km:g} km d'autonomie WLTP.")
+            key_words = ["Autonomie", "Temps de recharge"]
+        else:
+            sentences = []
+            for charging_type in attributes:
+                fastest = self.fastest_charge(family, charging_type, versions)
+                if fastest is None:
+                    return None
+                charger, minutes, _ = fastest
+                sentences.append(f"{format_duration(minutes)} en recharge {charging_type} ({CHARGER_LABELS[charger]})")
+            response = f"Pour recharger la {name}, comptez " + " et ".join(sentences) + "."
+            key_words = ["Autonomie", "Wallbox offerte"]
+        return {"response": response, "key_words": key_words}
+
+
+@lru_cache(maxsize=None)
+def get_spec_store(spec_path: str = str(DEFAULT_SPEC_PATH)) -> SpecStore:
+    return SpecStore(parse_specs(Path(spec_path).read_text(encoding="utf-8")))
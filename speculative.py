@@ -0,0 +1,89 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+# How many answer chains are started before the classifier returns, and the minimum router probability
+# of a route to be worth a speculative call. SPECULATION_WIDTH=0 disables speculation.
+SPECULATION_WIDTH = int(os.getenv("SPECULATION_WIDTH", "1"))
+SPECULATION_MIN_PROBABILITY = float(os.getenv("SPECULATION_MIN_PROBABILITY", "0.25"))
+
+
+@dataclass
+class SpeculationStats:
+    """
+    What speculation cost and saved on one turn.
+    saved_seconds is the classifier time taken off the critical path when the right route was speculated.
+    wasted_seconds is the model time of the cancelled branches, measured until their cancellation.
+    """
+    speculated: List[str] = field(default_factory=list)
+    chosen: str = ""
+    hit: bool = False
+    classifier_seconds: float = 0.0
+    total_seconds: float = 0.0
+    saved_seconds: float = 0.0
+    wasted_seconds: float = 0.0
+    cancelled: List[str] = field(default_factory=list)
+
+
+def pick_speculative_labels(
+    probabilities: Dict[str, float],
+    width: int = SPECULATION_WIDTH,
+    min_probability: float = SPECULATION_MIN_PROBABILITY,
+) -> List[str]:
+    """Most likely labels according to the local router, at most `width` of them."""
+    ranked = sorted(probabilities, key=probabilities.get, reverse=True)
+    return [label for label in ranked if probabilities[label] >= min_probability][:width]
+
+
+async def _timed(coroutine: Awaitable[Any]) -> Tuple[Any, float]:
+    started = time.perf_counter()
+    result = await coroutine
+    return result, time.perf_counter() - started
+
+
+async def speculative_answer(
+    question: str,
+    history: str,
+    probabilities: Dict[str, float],
+    classify: Callable[[str, str], Awaitable[str]],
+    answer: Callable[[str, str, str], Awaitable[Any]],
+    width: int = SPECULATION_WIDTH,
+    min_probability: float = SPECULATION_MIN_PROBABILITY,
+) -> Tuple[str, Any, SpeculationStats]:
+    """
+    Start the classifier and the answer of the most likely route(s) at the same time, keep the branch the
+    classifier picks and cancel the others. Returns (label, answer, stats).
+    """
+    stats = SpeculationStats(speculated=pick_speculative_labels(probabilities, width, min_probability))
+    started = time.perf_counter()
+
+    branches = {label: asyncio.create_task(_timed(answer(label, question, history))) for label in stats.speculated}
+    try:
+        label, stats.classifier_seconds = await _timed(classify(question, history))
+        stats.chosen = label
+
+        for other, task in branches.items():
+            if other == label:
+                continue
+            if not task.done():
+                task.cancel()
+                stats.cancelled.append(other)
+                stats.wasted_seconds += time.perf_counter() - started
+            elif task.exception() is None:
+                stats.wasted_seconds += task.result()[1]
+
+        if label in branches:
+            stats.hit = True
+            stats.saved_seconds = stats.classifier_seconds
+            result, _ = await branches[label]
+        else:
+            result = await answer(label, question, history)
+    except BaseException:
+        for task in branches.values():
+            task.cancel()
+        raise
+
+    stats.total_seconds = time.perf_counter() - started
+    return label, result, stats
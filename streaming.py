@@ -0,0 +1,108 @@
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+KEY_WORDS_PATTERN = re.compile(r'"key_words"\s*:\s*\[')
+CODE_FENCE_PATTERN = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class IncrementalResponseParser:
+    """
+    Parse the ResponseModel JSON ({"response": ..., "key_words": [...]}) while the model streams it.
+    feed() returns the text of the "response" field decoded so far, so it can be rendered live;
+    key_words is set once the array is complete. Malformed JSON never loses the text already decoded.
+    """
+
+    def __init__(self, field: str = "response"):
+        self.buffer = ""
+        self.response = ""
+        self.key_words: Optional[List[str]] = None
+        self._field_pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._position: Optional[int] = None  # position in buffer of the next char of the field value
+        self._complete = False
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        if self._position is None:
+            match = self._field_pattern.search(self.buffer)
+            if match is not None:
+                self._position = match.end()
+        if self._position is not None and not self._complete:
+            self._decode_string()
+        if self.key_words is None:
+            self._parse_key_words()
+        return self.response
+
+    def _decode_string(self):
+        buffer, position = self.buffer, self._position
+        decoded = []
+        while position < len(buffer):
+            char = buffer[position]
+            if char == '"':
+                self._complete = True
+                position += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                position += 1
+                continue
+            # Escape sequence, possibly cut between two chunks: wait for the rest
+            if position + 1 >= len(buffer):
+                break
+            escaped = buffer[position + 1]
+            if escaped == "u":
+                if position + 6 > len(buffer):
+                    break
+                try:
+                    decoded.append(chr(int(buffer[position + 2:position + 6], 16)))
+                except ValueError:
+                    decoded.append(buffer[position:position + 6])
+                position += 6
+            else:
+                decoded.append(ESCAPES.get(escaped, escaped))
+                position += 2
+        self.response += "".join(decoded)
+        self._position = position
+
+    def _parse_key_words(self):
+        match = KEY_WORDS_PATTERN.search(self.buffer)
+        if match is None:
+            return
+        # Find the closing bracket of the array, ignoring brackets inside strings
+        in_string = escaped = False
+        for position in range(match.end(), len(self.buffer)):
+            char = self.buffer[position]
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = not in_string
+            elif char == "]" and not in_string:
+                try:
+                    self.key_words = json.loads(self.buffer[match.end() - 1:position + 1])
+                except ValueError:
+                    self.key_words = []
+                return
+
+    def is_valid(self) -> bool:
+        """True when the whole output is the expected JSON object."""
+        try:
+            parsed = json.loads(CODE_FENCE_PATTERN.sub("", self.buffer.strip()))
+        except ValueError:
+            return False
+        return isinstance(parsed, dict) and "response" in parsed
+
+    def result(self) -> Dict[str, Any]:
+        """Final result: the parsed JSON when it is valid, otherwise what could be decoded."""
+        try:
+            parsed = json.loads(CODE_FENCE_PATTERN.sub("", self.buffer.strip()))
+            if isinstance(parsed, dict) and "response" in parsed:
+                parsed.setdefault("key_words", self.key_words or [])
+                return parsed
+        except ValueError:
+            pass
+        # No JSON at all: the model answered in plain text
+        response = self.response if self._position is not None else self.buffer.strip()
+        return {"response": response, "key_words": self.key_words or []}
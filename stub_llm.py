@@ -0,0 +1,108 @@
+import asyncio
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from botocore.exceptions import ClientError
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Answer of the stub: valid for the ResponseModel JSON parser of the Streamlit chains and for the API
+STUB_RESPONSE = (
+    '{"response": "Nos véhicules électriques Peugeot offrent jusqu\'à 400 km d\'autonomie WLTP. '
+    'Souhaitez-vous essayer un modèle ?", "key_words": ["Autonomie", "Essai"]}'
+)
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Offline stand-in for ChatBedrock, to run the apps and load tests without spending Bedrock calls.
+    Waits `latency` seconds before the first token, then emits tokens at `tokens_per_second`.
+    The async path really sleeps asynchronously, like a non-blocking network call.
+    Fault injection: a share `error_rate` of the calls fail after the latency, a share `throttle_rate` are
+    rejected like throttled Bedrock calls (ClientError ThrottlingException), a share `slow_rate` take
+    `slow_latency` seconds instead of `latency` (tail latency).
+    """
+
+    response: str = STUB_RESPONSE
+    latency: float = 0.5
+    tokens_per_second: float = 0.0  # 0: the whole answer at once
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    slow_rate: float = 0.0
+    slow_latency: float = 5.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat-model"
+
+    def _tokens(self) -> List[str]:
+        # ~4 characters per token, close enough to the real tokenizer for timings
+        return [self.response[start:start + 4] for start in range(0, len(self.response), 4)]
+
+    def _generation_seconds(self) -> float:
+        return len(self._tokens()) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def _latency(self) -> float:
+        return self.slow_latency if self.slow_rate and random.random() < self.slow_rate else self.latency
+
+    def _maybe_fail(self):
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "stub throttling"}}, "InvokeModel"
+            )
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError("stub model error")
+
+    def _result(self) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._latency() + self._generation_seconds())
+        self._maybe_fail()
+        return self._result()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._latency() + self._generation_seconds())
+        self._maybe_fail()
+        return self._result()
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._latency())
+        self._maybe_fail()
+        for token in self._tokens():
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        for token in self._tokens():
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+def stub_model_enabled() -> bool:
+    """EV_STUB_MODEL=1 replaces Bedrock by the stub in choose_model()."""
+    return os.getenv("EV_STUB_MODEL", "0") not in ("", "0", "false")
+
+
+def stub_model_from_env() -> StubChatModel:
+    return StubChatModel(
+        latency=float(os.getenv("EV_STUB_LATENCY", "0.5")),
+        tokens_per_second=float(os.getenv("EV_STUB_TOKENS_PER_SECOND", "0")),
+        error_rate=float(os.getenv("EV_STUB_ERROR_RATE", "0")),
+        throttle_rate=float(os.getenv("EV_STUB_THROTTLE_RATE", "0")),
+        slow_rate=float(os.getenv("EV_STUB_SLOW_RATE", "0")),
+        slow_latency=float(os.getenv("EV_STUB_SLOW_LATENCY", "5")),
+    )
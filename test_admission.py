@@ -0,0 +1,144 @@
+import asyncio
+
+import httpx
+import pytest
+
+import admission
+from admission import AdmissionController, AdmissionRejected, client_identity, parse_networks
+from benchmark import load_api
+
+PROXIES = parse_networks("10.0.0.0/8")
+
+
+def test_forwarded_address_only_from_trusted_proxies():
+    # Set by the client itself: ignored
+    assert client_identity("203.0.113.7", "198.51.100.1", trusted_proxies=PROXIES) == "203.0.113.7"
+    # Load balancer, then an internal proxy: the first untrusted hop from the right
+    forwarded = "198.51.100.1, 203.0.113.7, 10.0.0.5"
+    assert client_identity("10.0.0.9", forwarded, trusted_proxies=PROXIES) == "203.0.113.7"
+    assert client_identity("10.0.0.9", "garbage, 10.0.0.5", trusted_proxies=PROXIES) == "10.0.0.5"
+    assert client_identity("10.0.0.9", None, trusted_proxies=PROXIES) == "10.0.0.9"
+    assert client_identity(None) == "anonymous"
+
+
+def test_only_configured_api_keys_name_a_client():
+    keys = frozenset({"secret"})
+    identity = client_identity("203.0.113.7", api_key="secret", api_keys=keys)
+    assert identity.startswith("key:") and "secret" not in identity
+    assert identity == client_identity("198.51.100.1", api_key="secret", api_keys=keys)
+    assert client_identity("203.0.113.7", api_key="made-up", api_keys=keys) == "203.0.113.7"
+
+
+def test_rate_limit_per_client():
+    async def run():
+        controller = AdmissionController(rate=1.0, burst=2)
+        for _ in range(2):
+            (await controller.admit("a")).release()
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.admit("a")
+        (await controller.admit("b")).release()
+        return controller, rejected.value
+
+    controller, rejected = asyncio.run(run())
+    assert rejected.status_code == 429 and rejected.reason == "rate_limited"
+    assert 0 < rejected.retry_after <= 1 and rejected.retry_after_header == "1"
+    assert controller.stats()["shed"] == {"rate_limited": 1}
+
+
+def test_client_buckets_are_bounded():
+    controller = AdmissionController(rate=1.0, burst=1, max_clients=2)
+    for client in ("a", "b", "c"):
+        controller.check_rate(client)
+    assert list(controller._buckets) == ["b", "c"]
+
+
+def test_interactive_lane_goes_first():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, rate=0)
+        held = await controller.admit()
+        order = []
+
+        async def wait(lane):
+            async with controller.slot(lane=lane):
+                order.append(lane)
+
+        waiters = [asyncio.ensure_future(wait("batch")), asyncio.ensure_future(wait("interactive"))]
+        await asyncio.sleep(0.01)
+        assert controller.stats()["queue_depth"] == {"interactive": 1, "batch": 1}
+        held.release()
+        await asyncio.gather(*waiters)
+        return controller, order
+
+    controller, order = asyncio.run(run())
+    assert order == ["interactive", "batch"]
+    assert controller.in_flight == 0 and controller.queued == 2
+
+
+def test_full_queue_and_deadline_are_shed():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, queue_size=1, queue_timeout=0.1, rate=0)
+        controller.hold_seconds = 0.01  # slots are expected back quickly
+        held = await controller.admit()
+        waiter = asyncio.ensure_future(controller.admit())
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as full:
+            await controller.admit()
+        with pytest.raises(AdmissionRejected) as late:
+            await waiter
+        # Slots held 1 s: a wait beyond the queue timeout is shed without queueing
+        controller.hold_seconds = 1.0
+        with pytest.raises(AdmissionRejected) as overloaded:
+            await controller.admit()
+        held.release()
+        return controller, full.value, late.value, overloaded.value
+
+    controller, full, late, overloaded = asyncio.run(run())
+    assert (full.status_code, full.reason) == (503, "queue_full")
+    assert (late.status_code, late.reason) == (503, "deadline")
+    assert (overloaded.status_code, overloaded.reason) == (503, "overloaded") and overloaded.retry_after > 0.1
+    assert controller.in_flight == 0 and controller.queue_depth() == 0
+
+
+def test_cancelled_waiter_gives_its_slot_back():
+    async def run():
+        controller = AdmissionController(max_in_flight=1, rate=0)
+        held = await controller.admit()
+        waiter = asyncio.ensure_future(controller.admit())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0)
+        held.release()
+        (await controller.admit()).release()
+        return controller
+
+    controller = asyncio.run(run())
+    assert controller.in_flight == 0 and controller.queue_depth() == 0
+
+
+def test_api_rate_limit_ignores_spoofed_headers(monkeypatch):
+    api = load_api()
+    controller = AdmissionController(rate=0.01, burst=1)
+    monkeypatch.setattr(api, "get_admission", lambda: controller)
+    monkeypatch.setattr(admission, "ADMISSION_API_KEYS", frozenset({"partner-key"}))
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://api", timeout=None) as client:
+            async def ask(question, **headers):
+                return await client.post("/EV_response", params={"user_input": question}, headers=headers)
+
+            return [
+                await ask("Prix de la e-208 (admission 1) ?"),
+                await ask("Prix de la e-208 (admission 2) ?"),
+                await ask("Prix de la e-208 (admission 3) ?", **{"X-Forwarded-For": "198.51.100.1", "X-Client-Id": "other"}),
+                await ask("Prix de la e-208 (admission 4) ?", **{"X-API-Key": "partner-key"}),
+                await ask("Prix de la e-208 (admission 1) ?"),
+            ]
+
+    first, limited, spoofed, keyed, cached = asyncio.run(run())
+    assert first.status_code == 200 and keyed.status_code == 200
+    for response in (limited, spoofed):
+        assert response.status_code == 429 and response.json()["reason"] == "rate_limited"
+        assert int(response.headers["Retry-After"]) >= 1
+    # A cached answer needs no model call: never rate limited
+    assert cached.status_code == 200
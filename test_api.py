@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+import json
+
+import httpx
+import pytest
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from benchmark import load_api
+from response_cache import ResponseCache, SharedResponseCache
+from stub_llm import STUB_RESPONSE, StubChatModel
+
+api = load_api()
+BLOCKING_SECONDS = 0.3
+
+
+class SlowCache(ResponseCache):
+    """Response cache whose reads wait like a SQLite file locked by another worker."""
+
+    def get(self, *args, **kwargs):
+        time.sleep(BLOCKING_SECONDS)
+        return super().get(*args, **kwargs)
+
+
+def slow_history(session_id):
+    time.sleep(BLOCKING_SECONDS)
+    return []
+
+
+async def request_while_blocked(path, params):
+    """Longest stall of the event loop while the request runs, and the response."""
+    stalls = []
+
+    async def heartbeat():
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stalls.append(time.perf_counter() - started)
+
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://api", timeout=None) as client:
+        beating = asyncio.create_task(heartbeat())
+        await asyncio.sleep(0)  # heartbeat started
+        response = await client.post(path, params=params)
+        beating.cancel()
+    return max(stalls), response
+
+
+@pytest.mark.parametrize("path", ["/EV_response", "/EV_response/stream"])
+@pytest.mark.parametrize("blocked", ["cache", "history"])
+def test_blocking_store_calls_leave_the_event_loop_free(monkeypatch, path, blocked):
+    if blocked == "cache":
+        monkeypatch.setattr(api, "get_response_cache", SlowCache)
+    else:
+        monkeypatch.setattr(api, "get_history_messages", slow_history)
+    params = {"user_input": f"Autonomie de la e-208 ({blocked}, {path}) ?", "session_id": "event-loop"}
+
+    stall, response = asyncio.run(request_while_blocked(path, params))
+    assert response.status_code == 200
+    assert stall < BLOCKING_SECONDS / 2
+
+
+def test_shared_cache_answers_from_the_worker_threads(monkeypatch, tmp_path):
+    cache = SharedResponseCache(str(tmp_path / "responses.sqlite3"))
+    monkeypatch.setattr(api, "get_response_cache", lambda: cache)
+
+    async def ask_twice():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://api", timeout=None) as client:
+            return [await client.post("/EV_response", params={"user_input": "Garantie de la batterie (shared) ?"}) for _ in range(2)]
+
+    first, second = asyncio.run(ask_twice())
+    assert first.json()["response"]["text"] == second.json()["response"]["text"]
+    assert cache.stats()["hits"] == 1 and cache.stats()["errors"] == 0
+
+
+def stub_chain(**kwargs):
+    """Chain of the API (prompt | model | text) on a stub model."""
+    prompt = ChatPromptTemplate.from_messages([("human", "{context}\n\n{input}")])
+    return prompt | StubChatModel(**kwargs) | StrOutputParser()
+
+
+async def post_all(path, questions):
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://api", timeout=None) as client:
+        return await asyncio.gather(*(client.post(path, params={"user_input": question}) for question in questions))
+
+
+def sse_events(response):
+    """(event, data) of a Server-Sent Events body."""
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields.get("event", "message"), json.loads(fields["data"])))
+    return events
+
+
+def test_model_calls_of_concurrent_requests_overlap(monkeypatch):
+    latency = 0.2
+    monkeypatch.setattr(api, "initialize_chain", lambda: stub_chain(latency=latency))
+    questions = [f"Autonomie de la e-208 (concurrent {index}) ?" for index in range(4)]
+
+    started = time.perf_counter()
+    responses = asyncio.run(post_all("/EV_response", questions))
+    assert [response.status_code for response in responses] == [200] * 4
+    assert time.perf_counter() - started < 2 * latency
+
+
+def test_stream_sends_tokens_then_the_whole_text(monkeypatch):
+    monkeypatch.setattr(api, "initialize_chain", lambda: stub_chain(latency=0, tokens_per_second=10000))
+    (response,) = asyncio.run(post_all("/EV_response/stream", ["Autonomie de la e-208 (stream) ?"]))
+    assert response.status_code == 200 and response.headers["content-type"].startswith("text/event-stream")
+    events = sse_events(response)
+    tokens = [data["token"] for event, data in events[:-1] if event == "message"]
+    assert len(tokens) > 1 and "".join(tokens) == STUB_RESPONSE
+    event, done = events[-1]
+    assert event == "done" and done["text"] == STUB_RESPONSE and done["session_id"]
+
+
+def test_stream_reports_a_failed_call(monkeypatch):
+    monkeypatch.setattr(api, "initialize_chain", lambda: stub_chain(latency=0, error_rate=1.0))
+    (response,) = asyncio.run(post_all("/EV_response/stream", ["Autonomie de la e-208 (stream error) ?"]))
+    assert sse_events(response) == [("error", {"detail": "stub model error"})]
+
+
+async def get_ready():
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://api") as client:
+        return await client.get("/ready")
+
+
+def test_ready_once_warmed_up(monkeypatch):
+    monkeypatch.setitem(api.warmup_state, "ready", False)
+    monkeypatch.setitem(api.warmup_state, "timings", {})
+    assert asyncio.run(get_ready()).status_code == 503
+
+    asyncio.run(api.run_warm_up())
+    response = asyncio.run(get_ready())
+    assert response.status_code == 200
+    timings = response.json()["timings"]
+    assert {"chain", "retrieval_index", "faq_store", "total"} <= set(timings)
+    assert "model_call" not in timings  # API_WARMUP_MODEL_CALL is off by default
+    # Every request shares the chain built by the warm-up
+    assert api.initialize_chain() is api.initialize_chain()
+
+
+def test_failed_warm_up_is_reported(monkeypatch):
+    def broken():
+        raise FileNotFoundError("System prompt file not found.")
+
+    monkeypatch.setattr(api, "warm_up", broken)
+    monkeypatch.setitem(api.warmup_state, "ready", False)
+    monkeypatch.setitem(api.warmup_state, "error", None)
+    asyncio.run(api.run_warm_up())
+    response = asyncio.run(get_ready())
+    assert response.status_code == 503 and response.json()["error"] == "System prompt file not found."
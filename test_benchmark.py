@@ -0,0 +1,27 @@
+import asyncio
+
+import httpx
+
+from benchmark import load_api, load_questions, make_api_request, run_level
+
+
+def test_load_questions(tmp_path):
+    (tmp_path / "questions.txt").write_text("Autonomie e-208 ?\n\nPrix de la recharge ?\n", encoding="utf-8")
+    (tmp_path / "questions.jsonl").write_text('{"user_input": "Garantie ?"}\n{"other": 1}\n', encoding="utf-8")
+    questions = load_questions([str(tmp_path / "questions.txt"), str(tmp_path / "questions.jsonl"), "examples"])
+    assert questions[:3] == ["Autonomie e-208 ?", "Prix de la recharge ?", "Garantie ?"]
+    assert len(questions) > 3
+
+
+def test_api_level_against_the_stub():
+    async def level():
+        transport = httpx.ASGITransport(app=load_api().app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            questions = ["Autonomie de la e-208 ?", "Prix de la recharge ?", "Garantie de la batterie ?"]
+            return await run_level(make_api_request(client), questions, total_requests=12, concurrency=4)
+
+    result = asyncio.run(level())
+    assert result["errors"] == 0 and result["requests"] == 12
+    assert set(result["latency"]) == {"p50", "p95", "p99", "mean", "max"}
+    # 3 distinct questions: most repeats are served by the response cache (concurrent ones may both miss it)
+    assert 0.25 <= result["model_calls_per_turn"] < 1
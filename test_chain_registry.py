@@ -0,0 +1,81 @@
+import json
+import threading
+
+import pytest
+from langchain_core.output_parsers import JsonOutputParser
+
+from chain_registry import ChainRegistry, RouteSpec
+from stub_llm import STUB_RESPONSE, StubChatModel
+
+PARSER = JsonOutputParser()
+
+
+@pytest.fixture
+def prompts(tmp_path):
+    (tmp_path / "system.txt").write_text("Tu es EV Genius.\n\n<context>{context}</context>")
+    (tmp_path / "context.txt").write_text("La e-208 parcourt 400 km.")
+    return tmp_path
+
+
+def make_registry(root, built_models):
+    def factory(tier):
+        built_models.append(tier)
+        return StubChatModel(latency=0)
+
+    registry = ChainRegistry(factory, root_directory=root)
+    registry.register("expert", RouteSpec(
+        instructions="{format_instructions}\n\nQuestion : {user_input}",
+        output_parser=PARSER,
+        system_prompt_file="system.txt",
+        static_context_file="context.txt",
+        tier="small",
+        escalate_to="large",
+    ))
+    registry.register("commercial", RouteSpec(instructions="Question : {user_input}", output_parser=PARSER))
+    return registry
+
+
+def test_building_a_chain_never_calls_the_model(prompts):
+    models = []
+    registry = make_registry(prompts, models)
+    registry.warm_up()
+    assert registry.call_counter.total == 0 and models == ["small", "large", "large"]
+    # The static context is inlined once, at build time
+    assert "La e-208 parcourt 400 km." in registry.system_prompts["expert"]
+    assert registry.get_escalation_model("expert") is not None and registry.get_escalation_model("commercial") is None
+
+
+def test_each_chain_is_built_once_and_counts_its_calls(prompts):
+    models = []
+    registry = make_registry(prompts, models)
+    chains = []
+    threads = [threading.Thread(target=lambda: chains.append(registry.get("expert"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(chain is chains[0] for chain in chains) and models == ["small", "large"]
+
+    # The prompt files are not read again on later turns
+    (prompts / "system.txt").unlink()
+    with registry.call_counter.turn() as calls:
+        assert registry.get("expert").invoke({"user_input": "Autonomie ?"})== json.loads(STUB_RESPONSE)
+    assert calls.count == 1 and registry.call_counter.total == 1
+    with pytest.raises(KeyError):
+        registry.get("unknown")
+
+
+def test_missing_prompt_file_is_reported(tmp_path):
+    registry = make_registry(tmp_path, [])
+    with pytest.raises(FileNotFoundError):
+        registry.get("expert")
+
+
+def test_app_chain_factories_only_return_the_built_chains():
+    import utils
+
+    counter = utils.get_chain_registry().call_counter
+    before = counter.total
+    for factory in (utils.initialize_chain_experts_ev, utils.initialize_chain_commercial, utils.initialize_chain_expert_data_ev_capacity):
+        assert factory() is factory()
+    assert counter.total == before
@@ -0,0 +1,63 @@
+from context_dedupe import build_canonical_context, dedupe_sections, split_units
+from retrieval import PARAGRAPH_SEPARATOR
+
+LINE = (
+    "La Peugeot e-208 offre une recharge à domicile sur une wallbox, un accès aux bornes publiques du réseau "
+    "Free2Move eSolutions partout en Europe et une autonomie WLTP de 400"
+)
+OTHER_LINE = "La recharge rapide en courant continu permet de passer de 20 à 80 % en 30 minutes environ"
+
+
+def corpus(*sections):
+    return "".join(section + "\n" + PARAGRAPH_SEPARATOR + "\n" for section in sections)
+
+
+def test_tables_are_compacted():
+    assert split_units("Titre\n|  a  |  b |\n|:--|--:|\n|  |  |\n| 1 | 2 |") == ["Titre", "| a | b |\n| --- | --- |\n| 1 | 2 |"]
+
+
+def test_duplicates_and_boilerplate_are_removed():
+    sections, counts, conflicts = dedupe_sections({
+        "corpus": corpus(f"Autonomie\n{LINE}\nEn savoir plus", f"Recharge\n{OTHER_LINE}", f"Autonomie\n{LINE}."),
+    })
+    assert sections == [f"Autonomie\n{LINE}", f"Recharge\n{OTHER_LINE}"]
+    assert counts["boilerplate"] == 1 and counts["exact_duplicates"] == 1 and counts["orphan_lines"] == 1
+    assert conflicts == []
+
+
+def test_near_duplicates_need_the_same_figures():
+    near = LINE.replace("La Peugeot", "Peugeot")
+    sections, counts, _conflicts = dedupe_sections({"corpus": corpus(LINE, near, LINE.replace("400", "410"))})
+    assert counts["near_duplicates"] == 1
+    # Other figures in the same source: both kept, a copy of the page is not a conflict
+    assert len(sections) == 2
+
+
+def test_later_source_with_other_figures_is_a_conflict():
+    _sections, _counts, conflicts = dedupe_sections({
+        "corpus": corpus(LINE), "copy": corpus(LINE.replace("400", "410")),
+    })
+    assert conflicts == [(LINE.replace("400", "410"), LINE)]
+
+
+def test_canonical_context_only_written_when_smaller_and_consistent(tmp_path):
+    source = tmp_path / "peugeot_data.txt"
+    copy = tmp_path / "copy.txt"
+    output = tmp_path / "context_canonical.txt"
+
+    source.write_text(corpus(LINE, OTHER_LINE), encoding="utf-8")
+    report = build_canonical_context([str(source)], output)
+    assert not report.servable and not output.exists()
+    assert report.tokens_served == report.tokens_before[str(source)]
+
+    source.write_text(corpus(LINE, OTHER_LINE, LINE, "En savoir plus"), encoding="utf-8")
+    report = build_canonical_context([str(source)], output)
+    assert report.servable and report.written and report.tokens_after < report.tokens_served
+    assert output.read_text(encoding="utf-8") == corpus(LINE, OTHER_LINE)
+
+    # Conflicting figures: the previous artifact is removed, the corpus is served again
+    copy.write_text(corpus(LINE.replace("400", "410")), encoding="utf-8")
+    report = build_canonical_context([str(source), str(copy)], output)
+    assert report.tokens_after < report.tokens_served and len(report.conflicts) == 1
+    assert not report.written and not output.exists()
+    assert build_canonical_context([str(source), str(copy)], output, force=True).written
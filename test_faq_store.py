@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from faq_store import FaqStore, content_version, is_valid_answer, mine_frequent_questions
+from ingestion import MANIFEST_FILE
+from model_client import CANNED_JSON_ANSWER
+
+ANSWER = {"response": "Jusqu'à 400 km.", "key_words": ["Autonomie"]}
+SETTINGS = {"models": {"large": "model-a"}, "route_tiers": {}, "stub": False}
+
+
+@pytest.fixture
+def root(tmp_path):
+    (tmp_path / "prompt").mkdir()
+    (tmp_path / "parsed_data").mkdir()
+    (tmp_path / "prompt" / "system_prompt.txt").write_text("Vous êtes EV Genius.", encoding="utf-8")
+    (tmp_path / "parsed_data" / "peugeot_data.txt").write_text("e-208 : 400 km", encoding="utf-8")
+    (tmp_path / "utils.py").write_text("ROUTES = {}\n", encoding="utf-8")
+    return tmp_path
+
+
+def version(root, settings=SETTINGS):
+    return content_version(root=root, files=("utils.py",), settings=settings)
+
+
+def test_version_ignores_the_ingestion_manifest(root):
+    before = version(root)
+    (root / "parsed_data" / MANIFEST_FILE).write_text('{"a.docx": {}}', encoding="utf-8")
+    assert version(root) == before
+
+
+@pytest.mark.parametrize("changed_file", ["prompt/system_prompt.txt", "parsed_data/peugeot_data.txt", "utils.py"])
+def test_version_changes_with_prompts_context_and_code(root, changed_file):
+    before = version(root)
+    (root / changed_file).write_text("changed", encoding="utf-8")
+    assert version(root) != before
+
+
+def test_version_changes_with_the_models(root):
+    assert version(root) != version(root, {**SETTINGS, "models": {"large": "model-b"}})
+    assert version(root) != version(root, {**SETTINGS, "route_tiers": {"commercial": "small"}})
+    assert version(root) != version(root, {**SETTINGS, "stub": True})
+
+
+def test_stale_store_is_not_served(tmp_path):
+    store = FaqStore("v1")
+    assert store.add("chains", "Quelle est l'autonomie de la e-208 ?", ANSWER)
+    assert not store.add("chains", "Bonjour", {"response": "", "key_words": []})
+    store.save(str(tmp_path / "answers.json"))
+
+    loaded = FaqStore.load(str(tmp_path / "answers.json"), "v1")
+    assert loaded.get("chains", "quelle est l autonomie de la E-208")["answer"] == ANSWER
+    assert loaded.get("api", "quelle est l autonomie de la E-208") is None
+    assert loaded.stats()["hits"] == 1 and loaded.stats()["misses"] == 1
+    assert FaqStore.load(str(tmp_path / "answers.json"), "v2").entries == {}
+
+
+def test_canned_answer_is_never_stored():
+    assert not is_valid_answer(json.loads(CANNED_JSON_ANSWER))
+    assert is_valid_answer("Bonjour, je suis EV Genius")
+
+
+def test_mine_frequent_questions(tmp_path):
+    log = tmp_path / "prompts.jsonl"
+    lines = ['{"type": "request", "user_input": "Autonomie e-208 ?"}'] * 3 + ['{"type": "request", "user_input": "Rare ?"}']
+    log.write_text("\n".join(lines + ["not json"]), encoding="utf-8")
+    assert mine_frequent_questions([log, tmp_path / "missing.jsonl"], top=10, min_count=3) == ["Autonomie e-208 ?"]
@@ -0,0 +1,57 @@
+from history_compaction import SUMMARY_HEADER, HistoryCompactor, summarize_message
+
+
+def conversation(turns):
+    """Messages of `turns` question/answer pairs, then the current question."""
+    messages = []
+    for index in range(turns):
+        messages.append({"role": "human", "content": f"Question {index} sur la e-208 ? Détails {'x' * 40}."})
+        messages.append({"role": "ai", "content": f"Réponse {index}. Elle parcourt 400 km. {'y' * 200}"})
+    messages.append({"role": "human", "content": "Et la recharge ?"})
+    return messages
+
+
+def test_summary_line_is_the_first_sentence():
+    assert summarize_message("human", "Quelle autonomie ?  Et le prix ?") == "Client: Quelle autonomie ?"
+    assert summarize_message("ai", "a " * 200, max_chars=10) == "Expert: a a a a a..."
+    assert summarize_message("", "Bonjour") == "Bonjour"
+
+
+def test_short_conversation_is_sent_verbatim():
+    messages = conversation(1)
+    views = HistoryCompactor().compact(messages)
+    assert views.answer == "\n".join(message["content"] for message in messages)
+    assert views.answer_tokens <= views.full_tokens + 1  # the line breaks
+    # The classifier gets the last turn only
+    assert views.classifier == views.answer
+
+
+def test_prompt_size_stops_growing():
+    compactor = HistoryCompactor(recent_turns=2, token_budget=400, summary_tokens=60)
+    sizes = []
+    for turns in range(1, 30):
+        views = compactor.compact(conversation(turns))
+        sizes.append(views.answer_tokens)
+        assert views.answer.endswith("Et la recharge ?")
+        assert views.classifier_tokens <= compactor.classifier_tokens
+    assert max(sizes) <= 400 + 60 and max(sizes[10:]) - min(sizes[10:]) < 10
+    assert views.full_tokens > 5 * views.answer_tokens
+    assert views.answer.startswith(SUMMARY_HEADER) and "Client: Question 26 sur la e-208 ?" in views.answer
+    assert "Question 0 " not in views.answer  # the summary is bounded too
+
+
+def test_each_message_is_summarized_once():
+    summarized = []
+
+    def summarize(role, content):
+        summarized.append(content)
+        return summarize_message(role, content)
+
+    compactor = HistoryCompactor(recent_turns=1, summarize=summarize)
+    for turns in range(1, 10):
+        compactor.compact(conversation(turns))
+    assert len(summarized) == len(set(summarized)) == compactor.folded == 2 * 9 + 1 - 3
+
+    # A new (shorter) conversation starts over
+    views = compactor.compact(conversation(1))
+    assert compactor.folded == 0 and not views.answer.startswith(SUMMARY_HEADER)
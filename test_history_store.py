@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import httpx
+
+from benchmark import load_api
+from history_store import SessionHistoryStore
+
+
+def contents(store, session_id):
+    return [message["content"] for message in store.get(session_id)]
+
+
+def test_sessions_are_kept_apart():
+    store = SessionHistoryStore()
+    store.append("a", "human", "Bonjour")
+    store.append("b", "human", "Salut")
+    store.append("a", "assistant", "Bonjour, je suis EV Genius")
+    assert store.get("a") == [{"role": "human", "content": "Bonjour"}, {"role": "assistant", "content": "Bonjour, je suis EV Genius"}]
+    assert contents(store, "b") == ["Salut"] and store.get("c") == []
+    store.clear("a")
+    assert store.get("a") == [] and contents(store, "b") == ["Salut"]
+
+
+def test_session_bounded_in_messages_and_tokens():
+    store = SessionHistoryStore(max_messages=3, max_tokens=10)
+    for index in range(5):
+        store.append("a", "human", f"m{index}")
+    assert contents(store, "a") == ["m2", "m3", "m4"]
+    store.append("a", "human", "x" * 36)  # 9 tokens: only the last short message still fits
+    assert contents(store, "a") == ["m4", "x" * 36]
+    store.append("a", "human", "y" * 80)  # alone over the budget: kept all the same
+    assert contents(store, "a") == ["y" * 80]
+
+
+def test_idle_and_least_recently_used_sessions_are_evicted():
+    store = SessionHistoryStore(max_sessions=2, idle_ttl=0.05)
+    store.append("a", "human", "1")
+    store.append("b", "human", "2")
+    store.append("a", "human", "3")
+    store.append("c", "human", "4")
+    assert store.get("b") == [] and contents(store, "a") == ["1", "3"]
+    time.sleep(0.06)
+    assert store.get("a") == [] and store.stats() == {"sessions": 0, "messages": 0, "evicted_sessions": 3}
+
+
+def test_api_keeps_one_history_per_session():
+    api = load_api()
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://api", timeout=None) as client:
+            first = await client.post("/EV_response", params={"user_input": "Autonomie de la e-208 (historique) ?"})
+            session_id = first.json()["session_id"]
+            await client.post("/EV_response", params={"user_input": "Et la recharge (historique) ?", "session_id": session_id})
+            other = await client.post("/EV_response", params={"user_input": "Garantie (historique) ?"})
+            return session_id, other.json()["session_id"]
+
+    session_id, other = asyncio.run(run())
+    assert session_id != other
+    history = api.get_history_messages(session_id)
+    assert [message.content for message in history[::2]] == ["Autonomie de la e-208 (historique) ?", "Et la recharge (historique) ?"]
+    assert [message.type for message in history] == ["human", "ai"] * 2
+    assert len(api.get_history_messages(other)) == 2
@@ -0,0 +1,81 @@
+import json
+import zipfile
+
+import pytest
+
+import retrieval
+from ingestion import CHUNKS_FILE, CORPUS_FILE, LOCAL_CORPUS_FILE, MANIFEST_FILE, LocalParser, chunk_records, run_ingestion
+from retrieval import PARAGRAPH_SEPARATOR
+
+DOCUMENT_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>
+<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>Autonomie</w:t></w:r></w:p>
+<w:p><w:r><w:t>La e-208 parcourt 400 km.</w:t></w:r></w:p>
+<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>Recharge</w:t></w:r></w:p>
+<w:p><w:r><w:t>50 min sur borne rapide.</w:t></w:r></w:p>
+</w:body></w:document>"""
+
+
+def write_docx(path):
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("word/document.xml", DOCUMENT_XML)
+
+
+@pytest.fixture
+def directories(tmp_path, monkeypatch):
+    # The search index of the test corpus is built in memory, not in the shared artifacts directory
+    monkeypatch.setattr(retrieval, "RETRIEVAL_INDEX_DIRECTORY", "")
+    retrieval.get_index.cache_clear()
+    raw, output = tmp_path / "raw", tmp_path / "parsed"
+    raw.mkdir()
+    write_docx(raw / "a.docx")
+    (raw / "a.txt").write_text(f"Garantie batterie 8 ans\n{PARAGRAPH_SEPARATOR}\nBonus écologique\n", encoding="utf-8")
+    yield raw, output
+    retrieval.get_index.cache_clear()
+
+
+def test_docx_sections_start_at_headings(tmp_path):
+    write_docx(tmp_path / "a.docx")
+    sections = LocalParser().parse(tmp_path / "a.docx").split(PARAGRAPH_SEPARATOR)
+    assert [section.strip() for section in sections if section.strip()] == [
+        "Autonomie\nLa e-208 parcourt 400 km.",
+        "Recharge\n50 min sur borne rapide.",
+    ]
+
+
+def test_chunk_offsets_point_into_the_text():
+    text = f"  un\n{PARAGRAPH_SEPARATOR}\n\n{PARAGRAPH_SEPARATOR}deux trois  "
+    records = chunk_records("a.txt", text)
+    assert [record["text"] for record in records] == ["un", "deux trois"]
+    assert all(text[record["start"]:record["end"]] == record["text"] for record in records)
+
+
+def test_incremental_run(directories):
+    raw, output = directories
+    report = run_ingestion(raw, output, parser=LocalParser(), workers=2)
+    assert report.parsed == ["a.docx", "a.txt"] and not report.failed
+    # Same stem, different extensions: two parsed files
+    manifest = json.loads((output / MANIFEST_FILE).read_text())
+    assert {entry["parsed_file"] for entry in manifest.values()} == {"a.docx.txt", "a.txt.txt"}
+    assert report.chunks == 4
+    assert len((output / CHUNKS_FILE).read_text().splitlines()) == 4
+
+    report = run_ingestion(raw, output, parser=LocalParser())
+    assert report.parsed == [] and report.unchanged == ["a.docx", "a.txt"]
+
+    (raw / "a.txt").write_text("Garantie batterie 8 ans ou 160 000 km\n", encoding="utf-8")
+    (raw / "a.docx").unlink()
+    report = run_ingestion(raw, output, parser=LocalParser())
+    assert report.parsed == ["a.txt"] and report.removed == ["a.docx"]
+    assert not (output / "sources" / "a.docx.txt").exists()
+    assert report.chunks == 1
+
+
+def test_local_parser_leaves_the_served_corpus_alone(directories):
+    raw, output = directories
+    output.mkdir()
+    (output / CORPUS_FILE).write_text("corpus LlamaParse\n", encoding="utf-8")
+    report = run_ingestion(raw, output, parser=LocalParser())
+    assert (output / CORPUS_FILE).read_text(encoding="utf-8") == "corpus LlamaParse\n"
+    assert report.corpus_file == LOCAL_CORPUS_FILE and "400 km" in (output / LOCAL_CORPUS_FILE).read_text(encoding="utf-8")
+    assert report.context_tokens_after == 0
@@ -0,0 +1,38 @@
+import pytest
+
+from intent_router import get_intent_router
+
+
+@pytest.mark.parametrize("question", ["Bonjour", "Merci beaucoup !", "Salut, comment ça va ?", "Au revoir"])
+def test_greeting_alone_goes_to_commercial(question):
+    decision = get_intent_router().rule_decision(question)
+    assert decision is not None and decision.label == "no" and decision.source == "rules"
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "Hello, parle-moi de la 3008",
+        "Merci, et la e-2008 ?",
+        "Salut la 308 est dispo ?",
+        "Bonjour, la e-Partner ?",
+        "Merci, et la recharge ?",
+    ],
+)
+def test_greeting_with_a_model_is_not_decided_as_commercial(question):
+    # Left to the classifiers (local, else LLM): never a sure "no" from the greeting rule
+    decision = get_intent_router().rule_decision(question)
+    assert decision is None or decision.label != "no"
+
+
+@pytest.mark.parametrize("question", ["Bonjour, autonomie de la e-208 ?", "Merci ! Temps de recharge de la e-2008 ?"])
+def test_greeting_with_a_capacity_question_goes_to_capacity(question):
+    assert get_intent_router().rule_decision(question).label == "ok"
+
+
+def test_route_batch_matches_route_for_rules():
+    router = get_intent_router()
+    questions = ["Bonjour", "Hello, parle-moi de la 3008", "Quelle est l'autonomie de la e-208 ?"]
+    decisions = router.route_batch(questions)
+    assert [decision.label for decision in decisions][::2] == ["no", "ok"]
+    assert decisions[1].source == "classifier"
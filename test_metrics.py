@@ -0,0 +1,59 @@
+import asyncio
+import csv
+import io
+
+from metrics import STAGES, TIERS, MetricsRecorder
+from stub_llm import STUB_RESPONSE, StubChatModel
+
+
+def test_stages_of_a_turn_add_up():
+    recorder = MetricsRecorder()
+    with recorder.stage("routing"):
+        pass  # outside of a turn: nothing recorded
+    with recorder.turn("Autonomie ?") as turn:
+        recorder.set_route("experts_ev", "rules")
+        recorder.record_cache("exact")
+        for _ in range(2):
+            with recorder.stage("parsing"):
+                pass
+    assert recorder.current is None and list(recorder.turns) == [turn]
+    assert (turn.route, turn.routing_source, turn.cache) == ("experts_ev", "rules", "exact")
+    assert set(turn.stages) == {"parsing"} and 0 <= turn.stages["parsing"] <= turn.total_seconds
+    row = turn.as_row()
+    assert {f"{stage}_seconds" for stage in STAGES} | {f"{tier}_calls" for tier in TIERS} <= set(row)
+
+
+def test_model_calls_counted_per_turn_and_tier():
+    recorder = MetricsRecorder()
+    model = StubChatModel(latency=0).with_config(callbacks=[recorder.callback], metadata={"tier": "small"})
+    model.invoke("Bonjour")  # outside of a turn: only in the totals
+
+    async def turn():
+        with recorder.turn("Bonjour") as metrics:
+            await model.ainvoke("Bonjour")
+        return metrics
+
+    metrics = asyncio.run(turn())
+    assert metrics.model_calls == 1 and metrics.tiers["small"]["calls"] == 1
+    assert metrics.input_tokens > 0 and metrics.output_tokens == len(STUB_RESPONSE) // 4
+    assert recorder.model_calls_total == 2
+    assert [row["tier"] for row in recorder.tier_rows()] == ["small"] and recorder.tier_rows()[0]["calls"] == 2
+
+    text = recorder.prometheus_text()
+    assert 'ev_model_calls_total{tier="small"} 2' in text
+    assert 'ev_turns_total{route="unknown",cache="none"} 1' in text
+    assert 'ev_turn_seconds_bucket{le="+Inf"} 1' in text
+
+
+def test_turn_of_the_chatbot_is_recorded_and_exported(tmp_path):
+    import utils
+
+    response = utils.process_input("Quelle est la garantie de la batterie (metrics) ?")
+    assert response
+    row = utils.get_metrics().rows()[-1]
+    assert row["question"] == "Quelle est la garantie de la batterie (metrics) ?" and row["route"] in utils.ROUTES.values()
+    assert row["model_calls"] >= 1 and row["routing_seconds"] > 0 and row["model_call_seconds"] > 0
+
+    text = utils.save_results_to_csv(tmp_path / "metrics.csv")
+    assert (tmp_path / "metrics.csv").read_bytes().decode("utf-8") == text
+    assert list(csv.DictReader(io.StringIO(text)))[-1]["question"] == row["question"]
@@ -0,0 +1,223 @@
+import asyncio
+from typing import List
+
+import pytest
+from botocore.exceptions import ClientError
+
+import model_client
+from model_client import CircuitBreaker, LatencyTracker, ResilientChatModel, backoff_seconds, is_retryable
+from stub_llm import STUB_RESPONSE, StubChatModel
+
+FALLBACK = "canned"
+THROTTLED = ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+
+
+class SequenceStub(StubChatModel):
+    """Stub whose successive calls take the given latencies (then `latency`)."""
+
+    latencies: List[float] = []
+
+    def _latency(self) -> float:
+        return self.latencies.pop(0) if self.latencies else self.latency
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    # The retries of the tests do not wait (backoff_seconds itself is tested below)
+    monkeypatch.setattr(model_client, "backoff_seconds", lambda attempt: 0.0)
+
+
+def resilient(stub, threshold=2, reset_seconds=0.05, max_retries=0, **kwargs):
+    return ResilientChatModel(
+        model=stub, fallback_response=FALLBACK, max_retries=max_retries,
+        breaker=CircuitBreaker(threshold, reset_seconds), **kwargs,
+    )
+
+
+def open_circuit(model):
+    model.model.throttle_rate = 1.0
+    for _ in range(model.breaker.failure_threshold):
+        with pytest.raises(ClientError):
+            model.invoke("Bonjour")
+    model.model.throttle_rate = 0.0
+    assert model.breaker.state == "open"
+
+
+def wait_reset(model):
+    asyncio.run(asyncio.sleep(model.breaker.reset_seconds * 1.5))
+
+
+def test_retryable_errors():
+    assert is_retryable(THROTTLED)
+    wrapped = ValueError("Error raised by bedrock service")
+    wrapped.__cause__ = THROTTLED
+    assert is_retryable(wrapped)
+    assert is_retryable(ValueError("An error occurred (ServiceUnavailableException) when calling InvokeModel"))
+    assert not is_retryable(RuntimeError("stub model error"))
+    assert not is_retryable(ClientError({"Error": {"Code": "ValidationException"}}, "InvokeModel"))
+
+
+def test_backoff_is_jittered_and_bounded():
+    for attempt in range(8):
+        delays = [backoff_seconds(attempt, base=0.5, maximum=8.0) for _ in range(200)]
+        assert all(0 <= delay <= min(8.0, 0.5 * 2 ** attempt) for delay in delays)
+        assert len(set(delays)) > 1
+
+
+def test_throttled_calls_are_retried():
+    model = resilient(StubChatModel(latency=0, throttle_rate=1.0), threshold=5, max_retries=2)
+    with pytest.raises(ClientError):
+        model.invoke("Bonjour")
+    assert model.counters["retries"] == 2 and model.counters["errors"] == 1
+    assert model.breaker.failures == 1 and model.breaker.state == "closed"
+
+
+def test_non_retryable_errors_are_not_retried():
+    model = resilient(StubChatModel(latency=0, error_rate=1.0), max_retries=3)
+    with pytest.raises(RuntimeError):
+        model.invoke("Bonjour")
+    assert model.counters["retries"] == 0 and model.breaker.state == "closed"
+
+
+def test_open_circuit_answers_the_fallback_then_closes():
+    model = resilient(StubChatModel(latency=0))
+    open_circuit(model)
+    assert model.invoke("Bonjour").content == FALLBACK
+    assert model.counters["fallbacks"] == 1
+    wait_reset(model)
+    assert model.invoke("Bonjour").content == STUB_RESPONSE
+    assert model.breaker.state == "closed"
+
+
+def test_throttled_trial_reopens():
+    model = resilient(StubChatModel(latency=0))
+    open_circuit(model)
+    wait_reset(model)
+    model.model.throttle_rate = 1.0
+    with pytest.raises(ClientError):
+        model.invoke("Bonjour")
+    assert model.breaker.state == "open"
+
+
+def test_non_retryable_trial_reopens_and_recovers():
+    model = resilient(StubChatModel(latency=0))
+    open_circuit(model)
+    wait_reset(model)
+    model.model.error_rate = 1.0
+    with pytest.raises(RuntimeError):
+        model.invoke("Bonjour")
+    # Not stuck in half_open: open again, then a new trial once Bedrock is back
+    assert model.breaker.state == "open"
+    assert model.invoke("Bonjour").content == FALLBACK
+    model.model.error_rate = 0.0
+    wait_reset(model)
+    assert model.invoke("Bonjour").content == STUB_RESPONSE
+    assert model.breaker.state == "closed"
+
+
+def test_cancelled_trial_reopens():
+    model = resilient(StubChatModel(latency=0))
+    open_circuit(model)
+    wait_reset(model)
+    model.model.latency = 5.0
+
+    async def cancel_trial():
+        task = asyncio.ensure_future(model.ainvoke("Bonjour"))
+        await asyncio.sleep(0.05)
+        assert model.breaker.state == "half_open"
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_trial())
+    assert model.breaker.state == "open"
+
+
+def test_failed_stream_trial_reopens():
+    model = resilient(StubChatModel(latency=0))
+    open_circuit(model)
+    wait_reset(model)
+    model.model.error_rate = 1.0
+
+    async def stream():
+        return [chunk.content async for chunk in model.astream("Bonjour")]
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(stream())
+    assert model.breaker.state == "open"
+    model.model.error_rate = 0.0
+    wait_reset(model)
+    assert "".join(asyncio.run(stream())) == STUB_RESPONSE
+    assert model.breaker.state == "closed"
+
+
+def test_abandoned_stream_trial_reopens():
+    model = resilient(StubChatModel(latency=0))
+    open_circuit(model)
+    wait_reset(model)
+    model.model.latency = 5.0
+
+    async def abandon():
+        task = asyncio.ensure_future(model.astream("Bonjour").__anext__())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(abandon())
+    assert model.breaker.state == "open"
+
+
+def test_stream_retried_before_its_first_token():
+    model = resilient(StubChatModel(latency=0, throttle_rate=1.0), threshold=5, max_retries=1)
+    with pytest.raises(ClientError):
+        list(model.stream("Bonjour"))
+    assert model.counters["retries"] == 1
+    model.model.throttle_rate = 0.0
+    assert "".join(chunk.content for chunk in model.stream("Bonjour")) == STUB_RESPONSE
+    assert model.breaker.failures == 0
+
+
+def test_hedged_request_wins_over_a_slow_call():
+    tracker = LatencyTracker(percentile=95, min_samples=5)
+    for _ in range(5):
+        tracker.add(0.02)
+    model = resilient(SequenceStub(latency=0.01, latencies=[2.0]), latencies=tracker)
+
+    async def call():
+        return await model.ainvoke("Bonjour")
+
+    assert asyncio.run(call()).content == STUB_RESPONSE
+    assert model.counters["hedges"] == 1 and model.counters["hedge_wins"] == 1
+
+
+def test_no_hedge_without_enough_samples():
+    model = resilient(StubChatModel(latency=0.01), latencies=LatencyTracker(percentile=95, min_samples=5))
+    asyncio.run(model.ainvoke("Bonjour"))
+    assert model.counters["hedges"] == 0
+
+
+@pytest.mark.parametrize("sample", [1.0, 0.01])
+def test_cancelled_hedge_cancels_its_calls(sample):
+    # sample 1.0: cancelled while waiting for the hedge delay; 0.01: once both calls are running
+    tracker = LatencyTracker(percentile=95, min_samples=5)
+    for _ in range(5):
+        tracker.add(sample)
+    model = resilient(StubChatModel(latency=0), latencies=tracker)
+    calls = []
+
+    async def slow_call():
+        calls.append(asyncio.current_task())
+        await asyncio.sleep(10)
+
+    async def run():
+        hedged = asyncio.ensure_future(model._hedged(slow_call))
+        await asyncio.sleep(0.05)
+        hedged.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await hedged
+        await asyncio.sleep(0)
+        return [call.cancelled() for call in calls]
+
+    cancelled = asyncio.run(run())
+    assert cancelled == [True] * (1 if sample == 1.0 else 2)
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from prompt_cache import (
+    CACHE_CHECKPOINT,
+    BedrockPromptCacheModel,
+    RecordingBedrockClient,
+    anthropic_request_body,
+    split_static_dynamic,
+    template_variables,
+)
+
+# Valid for every parser of the routes (classifier and answers)
+RECORDED_ANSWER = json.dumps({"relevant_yes_no": "yes", "response": "Bonjour", "key_words": []})
+
+
+def test_split_keeps_blocks_in_order():
+    template = "Tu es EV Genius.\n\n{format_instructions}\n\n<context>{context}</context>\n\nRègles.\n\nQuestion : {user_input}"
+    static, dynamic = split_static_dynamic(template)
+    assert static == "Tu es EV Genius.\n\n{format_instructions}\n\nRègles."
+    assert dynamic == "<context>{context}</context>\n\nQuestion : {user_input}"
+
+
+def test_empty_system_message_has_no_block():
+    body = anthropic_request_body([SystemMessage(content=""), HumanMessage(content="Bonjour")])
+    assert "system" not in body
+    body = anthropic_request_body([SystemMessage(content="Prefix"), HumanMessage(content="a"), HumanMessage(content="b")])
+    assert body["system"] == [{"type": "text", "text": "Prefix", "cache_control": CACHE_CHECKPOINT}]
+    assert body["messages"] == [{"role": "user", "content": [{"type": "text", "text": "a\n\nb"}]}]
+
+
+def rendered_payloads(prompt, questions):
+    """Request bodies recorded for the prompt rendered with two different questions (every variable filled)."""
+    client = RecordingBedrockClient(RECORDED_ANSWER)
+    model = BedrockPromptCacheModel(model_id="recorded", client=client)
+    for question in questions:
+        values = {name: f"<<{name} {question}>>" for name in prompt.input_variables}
+        model.invoke(prompt.format_messages(**values))
+    return client.requests
+
+
+def check_payloads(requests, questions):
+    first, second = requests
+    system = first["system"][0]
+    # One cacheable prefix, byte-identical across questions, without any per-request value
+    assert system["text"].strip() and system["cache_control"] == CACHE_CHECKPOINT
+    assert first["system"] == second["system"]
+    assert not any(question in system["text"] for question in questions)
+    # The question is in the user turn, every variable was rendered
+    for request, question in zip(requests, questions):
+        assert [turn["role"] for turn in request["messages"]] == ["user"]
+        text = request["messages"][0]["content"][0]["text"]
+        assert question in text
+        assert not template_variables(text)
+
+
+@pytest.fixture
+def stub_model(monkeypatch):
+    monkeypatch.setenv("EV_STUB_MODEL", "1")
+
+
+QUESTIONS = ["question-une", "question-deux"]
+
+
+@pytest.mark.parametrize("route", ["classifier", "experts_ev", "commercial", "expert_data_ev_capacity"])
+def test_route_prompt_payload(stub_model, route):
+    from utils import get_chain_registry
+
+    prompt, _model, _parser = get_chain_registry().get_parts(route)
+    check_payloads(rendered_payloads(prompt, QUESTIONS), QUESTIONS)
+
+
+def test_api_prompt_payload(stub_model):
+    from benchmark import load_api
+
+    prompt = load_api().initialize_chain().first
+    requests = rendered_payloads(prompt, QUESTIONS)
+    check_payloads(requests, QUESTIONS)
+    # The instructions of the system prompt stay in the system block, the context goes with the question
+    assert "EV Genius" in requests[0]["system"][0]["text"]
+    assert "<context><<context question-une>></context>" in requests[0]["messages"][0]["content"][0]["text"]
@@ -0,0 +1,81 @@
+import json
+import threading
+
+import pytest
+
+from prompt_log import PromptLogger, text_hash
+
+SYSTEM_PROMPT = "Tu es EV Genius, expert des véhicules électriques Peugeot."
+
+
+@pytest.fixture
+def make_logger(tmp_path):
+    loggers = []
+
+    def make(**kwargs):
+        logger = PromptLogger(str(tmp_path / "prompts.jsonl"), **kwargs)
+        loggers.append(logger)
+        return logger
+
+    yield make
+    for logger in loggers:
+        logger.close()
+
+
+def records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_prompt_text_written_once_then_referenced(make_logger, tmp_path):
+    logger = make_logger()
+    for question in ("Autonomie ?", "Recharge ?"):
+        logger.log("experts_ev", SYSTEM_PROMPT, question, "Bonjour", "La e-208 parcourt 400 km.", spec_facts_chars=0)
+    logger.flush()
+    prompt, first, second = records(tmp_path / "prompts.jsonl")
+    assert prompt == {"type": "prompt", "prompt_hash": text_hash(SYSTEM_PROMPT), "text": SYSTEM_PROMPT}
+    assert first["type"] == "request" and first["prompt_hash"] == prompt["prompt_hash"]
+    assert (first["user_input"], second["user_input"]) == ("Autonomie ?", "Recharge ?")
+    assert first["context_chars"] == 25 and first["history_chars"] == 7 and first["spec_facts_chars"] == 0
+    assert "La e-208" not in json.dumps(first)  # the context is referenced by hash only
+    assert logger.stats()["logged"] == 2
+
+
+def test_log_never_waits_for_the_writer(make_logger, tmp_path, monkeypatch):
+    logger = make_logger(queue_size=2)
+    release = threading.Event()
+    write = logger._write
+    monkeypatch.setattr(logger, "_write", lambda request: (release.wait(5), write(request)))
+    for index in range(10):
+        logger.log("commercial", SYSTEM_PROMPT, f"Bonjour {index}")
+    stats = logger.stats()
+    assert stats["dropped"] >= 7 and stats["dropped"] + stats["queued"] <= 10
+    release.set()
+    logger.flush()
+    assert logger.stats()["logged"] == 10 - stats["dropped"]
+
+
+def test_files_rotate_and_repeat_the_prompt(make_logger, tmp_path):
+    logger = make_logger(max_bytes=300, backups=2)
+    for index in range(12):
+        logger.log("commercial", SYSTEM_PROMPT, f"Bonjour {index} " + "x" * 50)
+        logger.flush()
+    path = tmp_path / "prompts.jsonl"
+    assert logger.stats()["rotations"] >= 3
+    assert sorted(file.name for file in tmp_path.iterdir()) == ["prompts.jsonl", "prompts.jsonl.1", "prompts.jsonl.2"]
+    # Every file can be read alone: it starts with the text of the prompt
+    for file in (path, path.with_name("prompts.jsonl.1")):
+        assert records(file)[0]["type"] == "prompt"
+    assert records(path)[-1]["user_input"].startswith("Bonjour 11 ")
+
+
+def test_sampling_and_disabled_log(make_logger, tmp_path):
+    logger = make_logger(sample_rate=0.0)
+    logger.log("commercial", SYSTEM_PROMPT, "Bonjour")
+    assert not logger.enabled and logger._thread is None
+
+    logger = make_logger(sample_rate=0.5)
+    for _ in range(200):
+        logger.log("commercial", SYSTEM_PROMPT, "Bonjour")
+    logger.flush()
+    assert 50 < logger.stats()["logged"] < 150 and logger.stats()["logged"] + logger.stats()["sampled_out"] == 200
+    assert PromptLogger("").enabled is False
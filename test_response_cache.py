@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+from response_cache import ResponseCache, SharedResponseCache, history_digest, make_key
+
+ANSWER = {"response": "8 ans ou 160 000 km.", "key_words": ["Garantie"]}
+
+
+@pytest.fixture(params=["memory", "shared"])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return ResponseCache(**kwargs)
+        return SharedResponseCache(str(tmp_path / "responses.sqlite3"), **kwargs)
+
+    return make
+
+
+def test_trivial_variants_share_a_key():
+    assert make_key("chains", "Quelle est la GARANTIE  de la batterie ?") == make_key("chains", "quelle est la garantie de la batterie")
+    assert make_key("chains", "Électrique ?") == make_key("chains", "electrique")
+    assert make_key("chains", "e-208") != make_key("chains", "e 2008")
+    assert make_key("chains", "Bonjour") != make_key("classifier", "Bonjour")
+
+
+def test_history_digest_ignores_the_current_question_and_old_lines():
+    history = "Bonjour\nQuelle autonomie pour la e-208 ?\nEt la garantie ?"
+    assert history_digest(history, "Et la garantie ?") == history_digest("Bonjour\nQuelle autonomie pour la e-208 ?")
+    assert history_digest("Ancien\n" + history, "Et la garantie ?", last_lines=2) == history_digest(history, "Et la garantie ?", last_lines=2)
+    assert history_digest(history, "Et la garantie ?", last_lines=0) == history_digest("")
+    assert history_digest("Quelle autonomie pour la e-2008 ?") != history_digest("Quelle autonomie pour la e-208 ?")
+
+
+def test_hits_misses_and_copies(make_cache):
+    cache = make_cache()
+    assert cache.get("chains", "Garantie batterie ?") is None
+    cache.set("chains", "Garantie batterie ?", "", ANSWER)
+    cached = cache.get("chains", "garantie batterie", "")
+    assert cached == ANSWER
+    cached["response"] = "modifié"
+    assert cache.get("chains", "Garantie batterie ?") == ANSWER
+    assert cache.get("chains", "Garantie batterie ?", "Parlons de la e-2008") is None
+    cache.get("chains", "Garantie batterie ?", count=False)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (2, 2, 1)
+
+
+def test_entries_expire(make_cache):
+    cache = make_cache(ttl=0.05)
+    cache.set("chains", "Garantie batterie ?", "", ANSWER)
+    assert cache.get("chains", "Garantie batterie ?") == ANSWER
+    time.sleep(0.06)
+    assert cache.get("chains", "Garantie batterie ?") is None
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResponseCache(max_size=2)
+    cache.set("chains", "a", "", 1)
+    cache.set("chains", "b", "", 2)
+    cache.get("chains", "a")
+    cache.set("chains", "c", "", 3)
+    assert cache.get("chains", "b", count=False) is None
+    assert cache.get("chains", "a", count=False) == 1 and cache.stats()["evictions"] == 1
+
+
+def test_shared_cache_is_trimmed_to_its_size(tmp_path):
+    cache = SharedResponseCache(str(tmp_path / "responses.sqlite3"), max_size=10)
+    for index in range(SharedResponseCache.TRIM_EVERY):
+        cache.set("chains", f"question {index}", "", index)
+    assert cache.stats()["size"] == 10 and cache.stats()["evictions"] == SharedResponseCache.TRIM_EVERY - 10
+    # Another process on the same file sees the entries
+    assert SharedResponseCache(cache.path).get("chains", f"question {SharedResponseCache.TRIM_EVERY - 1}") == SharedResponseCache.TRIM_EVERY - 1
@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+import retrieval
+from retrieval import (
+    DEFAULT_CONTEXT_PATH,
+    PARAGRAPH_SEPARATOR,
+    RETRIEVAL_TOKEN_BUDGET,
+    BM25Index,
+    MappedBM25Index,
+    estimate_tokens,
+    retrieve_context,
+    split_paragraphs,
+    tokenize,
+)
+
+PARAGRAPHS = [
+    "La e-208 se recharge en 30 minutes sur une borne rapide.",
+    "Le e-2008 a une autonomie de 406 km.\n" + " ".join(["La batterie du e-2008 est garantie 8 ans."] * 20),
+    "La wallbox se pose à domicile en une journée.",
+    "La batterie de la e-208 est garantie 8 ans ou 160 000 km.",
+]
+
+
+@pytest.fixture
+def context(tmp_path):
+    path = tmp_path / "context.txt"
+    path.write_text(PARAGRAPH_SEPARATOR.join(PARAGRAPHS))
+    yield path
+    retrieval.get_index.cache_clear()
+
+
+def test_split_on_markers_then_on_lines():
+    text = f"  Un  {PARAGRAPH_SEPARATOR}\n\n{PARAGRAPH_SEPARATOR}" + "\n".join(["ligne " * 5] * 4)
+    chunks = split_paragraphs(text, max_chars=70)
+    assert chunks[0] == "Un"
+    assert [chunk.count("\n") for chunk in chunks[1:]] == [1, 1]
+    assert all(len(chunk) <= 70 for chunk in chunks)
+
+
+def test_tokenize_normalizes_and_drops_stop_words():
+    assert tokenize("Quelle est l'AUTONOMIE de la Peugeot e-208 électrique ?") == ["autonomie", "peugeot", "e", "208", "electrique"]
+
+
+def test_bm25_ranks_the_matching_paragraph_first():
+    index = BM25Index(PARAGRAPHS)
+    assert index.search("wallbox à domicile")[0][0] == 2
+    assert index.search("recharge borne rapide e-208", top_k=1) == [(0, pytest.approx(index.search("recharge borne rapide e-208")[0][1]))]
+    assert index.search("de la le") == []
+
+
+def test_expert_prompt_gets_only_the_relevant_paragraphs():
+    from utils import get_answer_inputs
+
+    context = get_answer_inputs("experts_ev", "Quelle est la garantie de la batterie ?", "")["context"]
+    assert "garanti" in context.lower()
+    assert estimate_tokens(context) <= RETRIEVAL_TOKEN_BUDGET < estimate_tokens(DEFAULT_CONTEXT_PATH.read_text()) / 5
+    # The other routes do not read {context}
+    assert get_answer_inputs("commercial", "Bonjour", "")["context"] == ""
+
+
+def test_paragraphs_over_the_budget_are_skipped(context):
+    question = "garantie batterie 160 000 km recharge"
+    # Scores: the e-208 warranty, the long e-2008 paragraph, then the e-208 charge
+    text = retrieve_context(question, token_budget=100, context_path=str(context))
+    assert text == PARAGRAPHS[0] + "\n\n" + PARAGRAPHS[3]
+    text = retrieve_context(question, token_budget=300, context_path=str(context))
+    assert text == "\n\n".join([PARAGRAPHS[0], PARAGRAPHS[1], PARAGRAPHS[3]])
+
+
+def test_best_paragraph_alone_over_the_budget_is_cut(context):
+    text = retrieve_context("autonomie e-2008", token_budget=20, context_path=str(context))
+    assert text == "Le e-2008 a une autonomie de 406 km."
+    assert estimate_tokens(text) <= 20
+    assert retrieve_context("autonomie e-2008", token_budget=0, context_path=str(context)) == ""
+
+
+def test_top_k_and_no_match(context):
+    assert retrieve_context("recharge borne wallbox domicile", top_k=1, context_path=str(context)).count("\n\n") == 0
+    assert retrieve_context("hydrogène", context_path=str(context)) == ""
+
+
+def test_mapped_index_searches_like_the_in_memory_one(context, tmp_path):
+    mapped = MappedBM25Index.load_or_build(context, tmp_path / "index")
+    memory = BM25Index(split_paragraphs(context.read_text()))
+    for query in ("batterie garantie", "recharge e-208", "wallbox", "inconnu"):
+        expected = memory.search(query)
+        found = mapped.search(query)
+        assert [paragraph_id for paragraph_id, _ in found] == [paragraph_id for paragraph_id, _ in expected]
+        assert [score for _, score in found] == pytest.approx([score for _, score in expected])
+    assert list(mapped.paragraphs) == memory.paragraphs
+
+
+def test_artifacts_are_reused_then_rebuilt_for_a_new_context(context, tmp_path, monkeypatch):
+    index_directory = tmp_path / "index"
+    other = tmp_path / "other.txt"
+    other.write_text("Autre contexte")
+    MappedBM25Index.load_or_build(other, index_directory)
+    MappedBM25Index.load_or_build(context, index_directory)
+    (built,) = index_directory.glob("context-*")
+
+    writes = []
+    monkeypatch.setattr(MappedBM25Index, "write", staticmethod(lambda index, directory: writes.append(directory)))
+    MappedBM25Index.load_or_build(context, index_directory)
+    assert writes == []  # mapped, not rebuilt
+    monkeypatch.undo()
+
+    # A leftover build of a crashed worker and the artifacts of the old context are removed
+    context.write_text(context.read_text() + PARAGRAPH_SEPARATOR + "La e-3008 a une autonomie de 700 km.")
+    leftover = index_directory / f".context-0.{os.getpid()}.tmp"
+    leftover.mkdir()
+    index = MappedBM25Index.load_or_build(context, index_directory)
+    (rebuilt,) = index_directory.glob("context-*")
+    assert rebuilt != built and not built.exists()
+    assert index.paragraphs[index.search("e-3008")[0][0]] == "La e-3008 a une autonomie de 700 km."
+    # The artifacts of another context are kept, no temporary directory is left
+    assert len(list(index_directory.glob("other-*"))) == 1
+    assert not list(index_directory.glob(f".{rebuilt.name}*"))
+
+
+def test_get_index_maps_the_artifacts(context, tmp_path, monkeypatch):
+    monkeypatch.setattr(retrieval, "RETRIEVAL_INDEX_DIRECTORY", str(tmp_path / "index"))
+    retrieval.get_index.cache_clear()
+    assert isinstance(retrieval.get_index(str(context)), MappedBM25Index)
+    assert retrieval.get_index(str(context)) is retrieval.get_index(str(context))
+    with pytest.raises(FileNotFoundError):
+        retrieval.get_index(str(tmp_path / "missing.txt"))
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from semantic_cache import SemanticCache
+
+ANSWER = {"response": "Sur une wallbox à domicile.", "key_words": ["Recharge"]}
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache()
+    cache.add("chains", "Comment recharger ma voiture électrique ?", "", ANSWER)
+    cache.add("chains", "Je veux acheter une voiture", "", "achat")
+    return cache
+
+
+@pytest.mark.parametrize("question", [
+    "comment recharger ma voiture electrique",
+    "Comment recharge-t-on sa voiture électrique ?",
+    "Ma voiture électrique, comment la recharger ?",
+])
+def test_paraphrase_is_served(cache, question):
+    answer, similarity, cached = cache.lookup("chains", question)
+    assert answer == ANSWER and similarity >= cache.threshold
+    assert cached == "Comment recharger ma voiture électrique ?"
+
+
+@pytest.mark.parametrize("question", [
+    "Je ne veux pas acheter une voiture",
+    "Je veux acheter une voiture sans batterie",
+    "Comment recharger ma voiture électrique rapidement ?",
+    "Comment recharger ma voiture électrique à domicile ?",
+    "Comment recharger ma e-208 ?",
+])
+def test_near_misses_are_not_served(cache, question):
+    assert cache.lookup("chains", question) is None
+
+
+def test_models_and_history_must_match():
+    cache = SemanticCache()
+    cache.add("chains", "Autonomie de la e-208 ?", "", "208")
+    assert cache.lookup("chains", "autonomie e208")[0] == "208"
+    assert cache.lookup("chains", "Autonomie de la e-2008 ?") is None
+    assert cache.lookup("chains", "Autonomie de la e-208 ?", "Parlons de la version 100 kW") is None
+    assert cache.lookup("other", "Autonomie de la e-208 ?") is None
+
+
+def test_entries_expire():
+    cache = SemanticCache(ttl=0.05)
+    cache.add("chains", "Autonomie de la e-208 ?", "", "208")
+    assert cache.lookup("chains", "Autonomie de la e-208 ?") is not None
+    time.sleep(0.06)
+    assert cache.lookup("chains", "Autonomie de la e-208 ?") is None
+
+
+def test_new_content_version_drops_the_entries():
+    versions = ["v1"]
+    cache = SemanticCache(version_provider=lambda: versions[-1], version_interval=0)
+    cache.add("chains", "Autonomie de la e-208 ?", "", "208")
+    assert cache.lookup("chains", "Autonomie de la e-208 ?") is not None
+    versions.append("v2")
+    assert cache.lookup("chains", "Autonomie de la e-208 ?") is None
+    assert cache.stats()["version"] == "v2" and cache.stats()["entries"] == {}
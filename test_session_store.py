@@ -0,0 +1,174 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from session_store import PersistentSessionStore, SqliteSessionBackend
+
+
+class ControlledBackend(SqliteSessionBackend):
+    """SQLite backend whose writes can be held (a slow disk) or fail (a locked file)."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.failing = False
+        self.hold = threading.Event()
+        self.hold.set()
+        self.writing = threading.Event()
+
+    def write(self, messages):
+        self.writing.set()
+        self.hold.wait(5)
+        if self.failing:
+            raise sqlite3.OperationalError("database is locked")
+        return super().write(messages)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return ControlledBackend(str(tmp_path / "sessions.sqlite3"))
+
+
+@pytest.fixture
+def make_store(backend):
+    stores = []
+
+    def make(**kwargs):
+        # The writer thread never flushes by itself: the tests call flush()
+        store = PersistentSessionStore(backend, flush_interval=3600, flush_batch=10**6, **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    backend.hold.set()
+    backend.failing = False
+    for store in stores:
+        store.close()
+
+
+def stored(backend, session_id):
+    return [content for _role, content, _tokens in backend.load(session_id, 100)[0]]
+
+
+def test_messages_survive_a_restart(backend, make_store):
+    store = make_store()
+    store.append("a", "human", "Bonjour")
+    store.append("a", "assistant", "Bonjour, je suis EV Genius")
+    assert stored(backend, "a") == []
+    store.flush()
+    assert [message["content"] for message in make_store().get("a")] == ["Bonjour", "Bonjour, je suis EV Genius"]
+
+
+def test_clear_during_a_write_is_not_undone(backend, make_store):
+    store = make_store()
+    store.append("a", "human", "Bonjour")
+    store.append("b", "human", "Salut")
+    backend.hold.clear()
+    writer = threading.Thread(target=store.flush)
+    writer.start()
+    assert backend.writing.wait(5)
+
+    clearing = threading.Thread(target=store.clear, args=("a",))
+    clearing.start()
+    clearing.join(0.1)
+    assert clearing.is_alive()  # waits for the batch being written
+    backend.hold.set()
+    writer.join(5)
+    clearing.join(5)
+
+    assert stored(backend, "a") == [] and stored(backend, "b") == ["Salut"]
+    assert store.get("a") == []
+
+
+def test_cleared_messages_of_a_failed_write_are_not_retried(backend, make_store):
+    store = make_store()
+    store.append("a", "human", "Bonjour")
+    backend.failing, backend.hold = True, threading.Event()
+    writer = threading.Thread(target=store.flush)
+    writer.start()
+    assert backend.writing.wait(5)
+    clearing = threading.Thread(target=store.clear, args=("a",))
+    clearing.start()
+    clearing.join(0.1)  # cleared in memory, waiting for the batch being written
+    store.append("a", "human", "Nouvelle conversation")
+    backend.hold.set()
+    writer.join(5)
+    clearing.join(5)
+
+    backend.failing = False
+    store.flush()
+    assert stored(backend, "a") == ["Nouvelle conversation"]
+    assert store.stats()["errors"] == 1 and store.stats()["pending"] == 0
+
+
+def test_retry_backlog_is_bounded(backend, make_store):
+    store = make_store(max_pending=3)
+    for index in range(5):
+        store.append("a", "human", f"message {index}")
+    backend.failing = True
+    store.flush()
+    stats = store.stats()
+    assert stats["pending"] == 3 and stats["dropped_messages"] == 2
+
+    backend.failing = False
+    store.flush()
+    assert stored(backend, "a") == ["message 2", "message 3", "message 4"]
+    # Nothing left pending: the session can be evicted and reloaded
+    assert store._sessions["a"].pending == 0
+
+
+def test_generations_are_forgotten_once_written(backend, make_store):
+    store = make_store()
+    store.clear("a")
+    store.append("a", "human", "Bonjour")
+    store.expire()
+    assert store._generations == {"a": 1}
+    store.flush()
+    store.expire()
+    assert store._generations == {}
+    assert stored(backend, "a") == ["Bonjour"]
+
+
+def test_content_that_is_not_json_is_rejected_on_append(backend, make_store):
+    store = make_store()
+    store.append("a", "human", "Bonjour")
+    with pytest.raises(TypeError):
+        store.append("a", "human", {1, 2})
+    store.append("a", "human", {"response": "Au revoir", "key_words": []})
+    store.flush()
+    assert stored(backend, "a") == ["Bonjour", {"response": "Au revoir", "key_words": []}]
+    assert store.stats()["pending"] == 0 and store.stats()["errors"] == 0
+
+
+def test_writer_thread_survives_any_error(backend):
+    class BrokenBackend(ControlledBackend):
+        def write(self, messages):
+            if self.failing:
+                self.failing = False
+                raise RuntimeError("disk unplugged")
+            return super().write(messages)
+
+    broken = BrokenBackend(backend.path)
+    broken.failing = True
+    store = PersistentSessionStore(broken, flush_interval=0.01)
+    try:
+        store.append("a", "human", "Bonjour")
+        deadline = time.monotonic() + 5
+        while stored(broken, "a") != ["Bonjour"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert stored(broken, "a") == ["Bonjour"]
+        assert store._thread.is_alive() and store.stats()["errors"] == 1
+    finally:
+        store.close()
+
+
+def test_pending_messages_are_bounded_on_append(backend, make_store):
+    store = make_store(max_pending=3)
+    for index in range(5):
+        store.append("a", "human", f"message {index}")
+    stats = store.stats()
+    assert stats["pending"] == 3 and stats["dropped_messages"] == 2
+    store.flush()
+    assert stored(backend, "a") == ["message 2", "message 3", "message 4"]
+    assert store._sessions["a"].pending == 0
@@ -0,0 +1,88 @@
+import pytest
+
+from spec_store import (
+    DEFAULT_SPEC_PATH, HOME_CHARGING, PUBLIC_CHARGING, SpecStore, format_duration, get_spec_store, parse_specs,
+)
+
+SPECS_TEXT = """
+"véhicules": [
+  {"modèle": "Peugeot e208 100kW", "capacité_batterie": "50 kWh", "autonomie_wltp": "362 km",
+   "easy_wb_installation": "10 h", "epro_wb_installation": "7 h", "chargeur_rapide_dc": "50 min"},
+  {"modèle": "Peugeot e208 115kW", "capacité_batterie": "51 kWh", "autonomie_wltp": "400 km",
+   "epro_wb_installation": "8 h", "chargeur_rapide_dc": "30 min"},
+]
+"""
+
+
+def test_parse_specs():
+    specs = parse_specs(SPECS_TEXT)
+    assert [spec.family for spec in specs] == ["208", "208"]
+    assert specs[1].battery_kwh == 51 and specs[1].wltp_range_km == 400
+    assert specs[0].charging_minutes == {"easy_wb_installation": 600, "epro_wb_installation": 420, "chargeur_rapide_dc": 50}
+    store = SpecStore(specs)
+    assert store.max_range("208") is specs[1]
+    assert store.fastest_charge("208", HOME_CHARGING) == ("epro_wb_installation", 420, specs[0])
+    assert store.fastest_charge("208", PUBLIC_CHARGING) == ("chargeur_rapide_dc", 30, specs[1])
+
+
+def test_data_file_parsed():
+    specs = parse_specs(DEFAULT_SPEC_PATH.read_text(encoding="utf-8"))
+    assert {spec.family for spec in specs} >= {"208", "2008", "3008"}
+    assert all(spec.battery_kwh > 0 and spec.wltp_range_km > 0 for spec in specs)
+
+
+def test_longest_range_across_versions():
+    store = get_spec_store()
+    best = store.max_range("208")
+    assert best.wltp_range_km == max(spec.wltp_range_km for spec in store.by_family["208"])
+
+
+def test_fastest_charge_per_type():
+    store = get_spec_store()
+    for charging_type in (HOME_CHARGING, PUBLIC_CHARGING):
+        charger, minutes, spec = store.fastest_charge("208", charging_type)
+        assert minutes == min(
+            spec.fastest_charge(charging_type)[1] for spec in store.by_family["208"] if spec.fastest_charge(charging_type)
+        )
+
+
+def test_direct_answer_for_a_plain_lookup():
+    store = get_spec_store()
+    answer = store.direct_answer("autonomie de la e-208 ?")
+    assert f"{store.max_range('208').wltp_range_km:g} km" in answer["response"]
+    assert answer["key_words"]
+    assert "kWh" in store.direct_answer("batterie e-3008")["response"]
+    assert "domicile" in store.direct_answer("temps de recharge e-2008 à domicile")["response"]
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "Quelle e-208 choisir pour un long trajet et pourquoi ?",
+        "Autonomie de la e-208 comparée à la e-2008 ?",
+        "Prix de la e-208 ?",
+        "Parlez-moi de la e-208",
+        "Garantie batterie e-208 ?",
+        "Autonomie de la 208 thermique ?",
+        "Autonomie de la e-208 90kW ?",
+        "Autonomie de la e-208 en 2024 ?",
+        "Temps de recharge de la e-208 sur une borne 100 kW ?",
+    ],
+)
+def test_no_direct_answer_when_the_model_is_needed(question):
+    assert get_spec_store().direct_answer(question) is None
+
+
+def test_direct_answer_of_the_named_version():
+    store = get_spec_store()
+    version = next(spec for spec in store.by_family["208"] if spec.model.endswith("100kW"))
+    assert version is not store.max_range("208")
+    answer = store.direct_answer("Quelle est l autonomie de la e-208 100kW ?")
+    assert f"{version.wltp_range_km:g} km" in answer["response"] and "100kW" in answer["response"]
+    assert f"{version.battery_kwh:g} kWh" in store.direct_answer("batterie de la e-208 100 kW")["response"]
+
+
+def test_format_duration():
+    assert format_duration(50) == "50 min"
+    assert format_duration(420) == "7 h"
+    assert format_duration(450) == "7 h 30"
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import pytest
+
+from speculative import pick_speculative_labels, speculative_answer
+
+DELAY = 0.05
+
+
+def test_most_likely_labels_above_the_minimum():
+    probabilities = {"yes": 0.6, "ok": 0.3, "no": 0.1}
+    assert pick_speculative_labels(probabilities, width=2, min_probability=0.25) == ["yes", "ok"]
+    assert pick_speculative_labels(probabilities, width=1, min_probability=0.25) == ["yes"]
+    assert pick_speculative_labels(probabilities, width=0) == []
+    assert pick_speculative_labels({"yes": 0.2}, width=1, min_probability=0.25) == []
+
+
+class Pipeline:
+    """Classifier and answer chains that take DELAY seconds each and record what ran and what was cancelled."""
+
+    def __init__(self, label, classifier_error=None):
+        self.label = label
+        self.classifier_error = classifier_error
+        self.answered, self.cancelled = [], []
+
+    async def classify(self, question, history):
+        await asyncio.sleep(DELAY)
+        if self.classifier_error:
+            raise self.classifier_error
+        return self.label
+
+    async def answer(self, label, question, history):
+        self.answered.append(label)
+        try:
+            await asyncio.sleep(DELAY)
+        except asyncio.CancelledError:
+            self.cancelled.append(label)
+            raise
+        return f"answer {label}"
+
+    def run(self, probabilities, width=1):
+        async def run():
+            started = time.perf_counter()
+            result = await speculative_answer("Question", "", probabilities, self.classify, self.answer, width=width)
+            await asyncio.sleep(0)  # cancellations delivered
+            return result, time.perf_counter() - started
+
+        return asyncio.run(run())
+
+
+def test_right_speculation_takes_the_classifier_off_the_critical_path():
+    pipeline = Pipeline("yes")
+    (label, result, stats), elapsed = pipeline.run({"yes": 0.9, "no": 0.1})
+    assert (label, result) == ("yes", "answer yes") and pipeline.answered == ["yes"]
+    assert stats.hit and stats.saved_seconds > 0 and stats.cancelled == []
+    assert elapsed < 1.8 * DELAY
+
+
+def test_wrong_speculation_is_cancelled():
+    pipeline = Pipeline("no")
+    (label, result, stats), elapsed = pipeline.run({"yes": 0.5, "ok": 0.4, "no": 0.1}, width=2)
+    assert (label, result) == ("no", "answer no")
+    assert pipeline.answered == ["yes", "ok", "no"] and sorted(pipeline.cancelled) == ["ok", "yes"]
+    assert not stats.hit and sorted(stats.cancelled) == ["ok", "yes"] and stats.wasted_seconds > 0
+    assert elapsed >= 2 * DELAY
+
+
+def test_classifier_error_cancels_every_branch():
+    pipeline = Pipeline("yes", classifier_error=RuntimeError("throttled"))
+    with pytest.raises(RuntimeError):
+        pipeline.run({"yes": 0.9})
+    assert pipeline.cancelled == ["yes"]
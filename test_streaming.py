@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from streaming import IncrementalResponseParser
+
+ANSWER = {"response": "L'autonomie \"WLTP\" est de 400 km.\nÀ bientôt é", "key_words": ["Autonomie", "Essai [e-208]"]}
+
+
+def feed_chunks(text, size):
+    parser = IncrementalResponseParser()
+    seen = []
+    for start in range(0, len(text), size):
+        seen.append(parser.feed(text[start:start + size]))
+    return parser, seen
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_response_decoded_whatever_the_chunk_size(size):
+    text = json.dumps(ANSWER)  # \u escapes and quotes, cut anywhere
+    parser, seen = feed_chunks(text, size)
+    assert parser.response == ANSWER["response"]
+    assert parser.key_words == ANSWER["key_words"]
+    assert parser.is_valid() and parser.result() == ANSWER
+    # The decoded text only grows, and is always a prefix of the final answer
+    assert all(ANSWER["response"].startswith(partial) for partial in seen)
+    assert all(len(a) <= len(b) for a, b in zip(seen, seen[1:]))
+
+
+def test_unicode_escape_cut_between_chunks():
+    parser = IncrementalResponseParser()
+    assert parser.feed('{"response": "caf\\u00') == "caf"
+    assert parser.feed('e9 !"') == "café !"
+
+
+def test_code_fence_is_valid():
+    parser, _ = feed_chunks("```json\n" + json.dumps(ANSWER) + "\n```", 5)
+    assert parser.is_valid() and parser.result()["key_words"] == ANSWER["key_words"]
+
+
+def test_truncated_json_keeps_the_decoded_text():
+    parser, _ = feed_chunks('{"response": "Bonjour, la e-208 a', 4)
+    assert not parser.is_valid()
+    assert parser.result() == {"response": "Bonjour, la e-208 a", "key_words": []}
+
+
+def test_plain_text_answer():
+    parser, _ = feed_chunks("Bonjour, je suis là pour vous aider.", 6)
+    assert parser.response == ""
+    assert parser.result() == {"response": "Bonjour, je suis là pour vous aider.", "key_words": []}
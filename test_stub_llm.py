@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from model_client import is_retryable
+from stub_llm import STUB_RESPONSE, StubChatModel, stub_model_from_env
+
+
+def test_answer_and_latency():
+    stub = StubChatModel(latency=0.05)
+    started = time.perf_counter()
+    assert stub.invoke("Bonjour").content == STUB_RESPONSE
+    assert time.perf_counter() - started >= 0.05
+
+
+def test_async_calls_do_not_block_each_other():
+    stub = StubChatModel(latency=0.2)
+
+    async def calls():
+        return await asyncio.gather(*(stub.ainvoke("Bonjour") for _ in range(10)))
+
+    started = time.perf_counter()
+    assert len(asyncio.run(calls())) == 10
+    assert time.perf_counter() - started < 1.0
+
+
+def test_stream_rebuilds_the_answer():
+    stub = StubChatModel(latency=0, tokens_per_second=1000)
+    chunks = [chunk.content for chunk in stub.stream("Bonjour")]
+    assert len(chunks) > 1 and "".join(chunks) == STUB_RESPONSE
+
+
+def test_fault_injection():
+    with pytest.raises(ClientError) as error:
+        StubChatModel(latency=0, throttle_rate=1.0).invoke("Bonjour")
+    assert is_retryable(error.value)
+    with pytest.raises(RuntimeError):
+        StubChatModel(latency=0, error_rate=1.0).invoke("Bonjour")
+    slow = StubChatModel(latency=0, slow_rate=1.0, slow_latency=0.05)
+    started = time.perf_counter()
+    slow.invoke("Bonjour")
+    assert time.perf_counter() - started >= 0.05
+
+
+def test_settings_from_environment(monkeypatch):
+    monkeypatch.setenv("EV_STUB_LATENCY", "0.25")
+    monkeypatch.setenv("EV_STUB_ERROR_RATE", "0.5")
+    stub = stub_model_from_env()
+    assert stub.latency == 0.25 and stub.error_rate == 0.5
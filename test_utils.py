@@ -0,0 +1,101 @@
+import asyncio
+import dataclasses
+
+import pytest
+
+import utils
+from chain_registry import ChainRegistry
+from model_client import is_canned_answer
+from response_cache import get_response_cache
+from semantic_cache import get_semantic_cache
+from stub_llm import STUB_RESPONSE, StubChatModel
+
+TRUNCATED = STUB_RESPONSE[:60]
+GARBLED = "Désolé, voici la réponse sans JSON"
+
+
+@pytest.fixture
+def answers(monkeypatch):
+    """Model output per tier (set before the first call), every route of the app answered by the stub."""
+    responses = {"small": STUB_RESPONSE, "large": STUB_RESPONSE}
+    registry = ChainRegistry(lambda tier: StubChatModel(latency=0, tokens_per_second=10000, response=responses[tier]))
+    for route, spec in utils.get_chain_registry()._specs.items():
+        # Small model first, escalation to the large one (experts_ev keeps its default: large, no escalation)
+        registry.register(route, spec if route == "experts_ev" else dataclasses.replace(spec, tier="small", escalate_to="large"))
+    monkeypatch.setattr(utils, "get_chain_registry", lambda: registry)
+    get_response_cache().clear()
+    get_semantic_cache().clear()
+    return responses
+
+
+def streamed(label, question):
+    return list(utils.stream_answer(label, question, ""))
+
+
+def answered(path, label, question):
+    """Final answer of a question by the blocking, async or streaming path."""
+    if path == "blocking":
+        return utils.answer_question(label, question, "")
+    if path == "async":
+        return asyncio.run(utils.answer_question_async(label, question, ""))
+    response, key_words, done = streamed(label, question)[-1]
+    assert done
+    return {"response": response, "key_words": key_words}
+
+
+def is_cached(route, question):
+    return get_response_cache().get(route, question, "", count=False) is not None
+
+
+PATHS = ["blocking", "async", "stream"]
+
+
+def test_truncated_stream_is_shown_but_not_cached(answers):
+    answers["large"] = TRUNCATED
+    updates = streamed("yes", "Quelle est la garantie de la batterie ?")
+    response, key_words, done = updates[-1]
+    assert done and response and STUB_RESPONSE.startswith('{"response": "' + response)
+    assert key_words == []
+    assert not is_cached("experts_ev", "Quelle est la garantie de la batterie ?")
+    assert get_semantic_cache().lookup("experts_ev", "Quelle est la garantie de la batterie ?") is None
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_invalid_answer_without_escalation_is_shown_but_not_cached(answers, path):
+    answers["large"] = TRUNCATED
+    question = f"Quelle est la garantie de la batterie ({path}) ?"
+    result = answered(path, "yes", question)
+    assert result["response"] and STUB_RESPONSE.startswith('{"response": "' + result["response"])
+    assert result["key_words"] == []
+    assert not is_cached("experts_ev", question)
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_invalid_answer_is_answered_again_by_the_escalation_model(answers, path):
+    answers["small"] = TRUNCATED
+    question = f"Bonjour ({path}) !"
+    result = answered(path, "no", question)
+    assert result["key_words"] == ["Autonomie", "Essai"] and result["response"].startswith("Nos véhicules")
+    assert is_cached("commercial", question)
+
+
+@pytest.mark.parametrize("path", PATHS)
+def test_escalated_answer_not_parsed_is_shown_but_not_cached(answers, path):
+    answers["small"], answers["large"] = TRUNCATED, GARBLED
+    question = f"Merci beaucoup ({path})"
+    assert answered(path, "no", question) == {"response": GARBLED, "key_words": []}
+    assert not is_cached("commercial", question)
+
+
+def test_empty_answer_is_replaced_by_the_canned_answer(answers):
+    answers["large"] = ""
+    result = utils.answer_question("yes", "Quelle est la garantie ?", "")
+    assert is_canned_answer(result) and not is_cached("experts_ev", "Quelle est la garantie ?")
+
+
+def test_unparsed_answer_is_raised_by_the_chain(answers):
+    answers["small"], answers["large"] = TRUNCATED, GARBLED
+    inputs = utils.get_answer_inputs("commercial", "Merci", "")
+    with pytest.raises(utils.UnparsedAnswer) as unparsed:
+        utils.run_chain("commercial", inputs)
+    assert unparsed.value.answer["response"] == GARBLED
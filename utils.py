@@ -1,5 +1,6 @@
-import contextvars
 from pathlib import Path
+import csv
+import io
 from typing import List
 
 import boto3
@@ -7,19 +8,25 @@ import streamlit as st
 from botocore.exceptions import ClientError
 from langchain.chains import LLMChain
 from langchain.memory import ConversationBufferMemory
-from langchain_aws import ChatBedrock
 from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.exceptions import OutputParserException
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
-from langchain_core.prompts import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-    SystemMessagePromptTemplate,
-)
 from langchain_core.pydantic_v1 import BaseModel, Field, create_model
 from pydantic import BaseModel
+from chain_registry import ChainRegistry, RouteSpec
+from faq_store import get_faq_store
+from history_store import get_history_store
+from intent_router import RouteDecision, get_intent_router
+from metrics import get_metrics
+from model_client import CANNED_ANSWER, CANNED_JSON_ANSWER, get_tier_model, is_canned_answer, route_tier
+from response_cache import get_response_cache
+from retrieval import retrieve_context
+from semantic_cache import get_semantic_cache
+from spec_store import SPEC_DIRECT_ANSWERS, get_spec_store
+from speculative import speculative_answer
+from streaming import IncrementalResponseParser
+from prompt_log import get_prompt_logger
 
-# Set up a context variable to manage chat history
-chat_history_var = contextvars.ContextVar("chat_history", default=[])
 class ResponseModel(BaseModel):
     response: str = Field(description="The main response from the LLM")
     key_words: List[str] = Field(description="3-4 short keyword questions based on conversation history")
@@ -27,95 +34,37 @@ class ResponseModel(BaseModel):
 output_parser = JsonOutputParser(pydantic_object=ResponseModel)
 
 
-# Function to choose the Claude model from Bedrock
-@st.cache_resource
-def choose_model():
-    return ChatBedrock(model_id="anthropic.claude-3-5-sonnet-20240620-v1:0")
+class Relevant(BaseModel):
+    relevant_yes_no: str = Field(description="yes, no, or ok")
 
-# Function to manage memory for conversation
-def get_memory():
-    return ConversationBufferMemory(return_messages=True)
+relevant_parser = JsonOutputParser(pydantic_object=Relevant)
 
-@st.cache_resource
-def check_question_type(user_input, history):
-    class Relevant(BaseModel):
-        relevant_yes_no: str = Field(description="yes, no, or ok")
-        
-    output_parser = JsonOutputParser(pydantic_object=Relevant)
- 
-    template = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template("Based on the user query and the history of the question, determine if the question needs to be answered by an expert in vehicle electric and Peugeot. If the question is related to cars, electric cars, vehicles, or Peugeot, answer yes. If the question is a general greeting, a thank you, or a question that doesn't require a specialist in cars, answer no. If the question is related to autonomy, public charging, home charging, battery capacity, or WLTP range of Peugeot models( E-208, E-2008, E-308,E-3008,Peugeot expert and peugeot partner), reply with ok.Also reply by 'ok' if the user want information about one of these models :(  E-208, E-2008, E-308,E-3008,Peugeot expert and peugeot partner) if the question is related to the nearby location of the position of the user, reply with no.If any of these topics regarding the ADVANTAGES OF ELECTRIC VEHICLES—ADVANTAGES OF CHARGING, AUTONOMY, COST & SAVINGS, WARRANTY, ENVIRONMENTAL IMPACT, or ADVANTAGES FOR ALL SUBJECTS—are mentioned, reply with ok."),
-            HumanMessagePromptTemplate.from_template("User query: {user_query}, history: {history},and here your knowledges:<context> {format_instructions}"),
-        ],
-        input_variables=["user_query", "history"],
-        partial_variables={"format_instructions": output_parser.get_format_instructions()}
-    )
 
-    model = choose_model()
-    chain = template | model | output_parser
+# Route chosen by check_question_type ("yes", "ok" or "no") -> chain to answer with
+ROUTES = {
+    "yes": "experts_ev",
+    "ok": "expert_data_ev_capacity",
+    "no": "commercial",
+}
+DEFAULT_ROUTE = "commercial"
 
-    try:
-        result = chain.invoke({
-            "user_query": user_input,
-            "history": history,
-        })
-        print(f"AI CHOICE =>  {result}")
-        return result["relevant_yes_no"]  # It will now return "yes", "ok", or "no"
-    except Exception as e:
-        print(f"Exception: {e}")
-        return "no"  # Default to "no" in case of error
-
-# 1 - CHAIN EXPERT - FOR QUESTIONS RELATED TO PEUGEOT ELECTRIC VEHICLES - OR EV
-@st.cache_resource
-def initialize_chain_experts_ev(history,user_input):
-
-    current_directory = Path(__file__).resolve().parent  # Adjust based on your directory structure
-
-    system_prompt_path = current_directory / "prompt/system_prompt_experts_ev.txt"
-    context_path = current_directory / "parsed_data/peugeot_data.txt"
+# Example questions shown in 2_chatbot_metrics.py (also replayed by benchmark.py)
+EXAMPLE_QUESTIONS = [
+    "Quel est le prix de la recharge ?",
+    "Bonjour, je souhaite savoir quelles sont les meilleures applications ?",
+    "Quel est le taux de satisfaction client parmi les utilisateurs français qui sont passés aux véhicules électriques ?",
+    "Pouvez-vous fournir un bref historique des véhicules électriques de Peugeot ?",
+    "Quels sont les principaux facteurs influençant l'autonomie d'un véhicule électrique ?",
+    "Dites-moi quel est le prix pour recharger ma e-208, puis le temps de recharge sur une borne."
+]
 
-    # print(f"System prompt path: {system_prompt_path}")  # <-- Print the path to system_prompt.txt
-    # print(f"Context path: {context_path}")  # <-- Print the path to peugeot_data.txt
 
-    if not system_prompt_path.exists():
-        raise FileNotFoundError("System prompt file not found.")
-    if not context_path.exists():
-        raise FileNotFoundError("Context file not found.")
+# CLASSIFIER - DECIDES WHICH CHAIN ANSWERS THE QUESTION
+CLASSIFIER_SYSTEM_PROMPT = "Based on the user query and the history of the question, determine if the question needs to be answered by an expert in vehicle electric and Peugeot. If the question is related to cars, electric cars, vehicles, or Peugeot, answer yes. If the question is a general greeting, a thank you, or a question that doesn't require a specialist in cars, answer no. If the question is related to autonomy, public charging, home charging, battery capacity, or WLTP range of Peugeot models( E-208, E-2008, E-308,E-3008,Peugeot expert and peugeot partner), reply with ok.Also reply by 'ok' if the user want information about one of these models :(  E-208, E-2008, E-308,E-3008,Peugeot expert and peugeot partner) if the question is related to the nearby location of the position of the user, reply with no.If any of these topics regarding the ADVANTAGES OF ELECTRIC VEHICLES—ADVANTAGES OF CHARGING, AUTONOMY, COST & SAVINGS, WARRANTY, ENVIRONMENTAL IMPACT, or ADVANTAGES FOR ALL SUBJECTS—are mentioned, reply with ok."
+CLASSIFIER_INSTRUCTIONS = "User query: {user_query}, history: {history},and here your knowledges:<context> {format_instructions}"
 
-    # Read system prompt and context from files
-    system_prompt = system_prompt_path.read_text()
-    context = context_path.read_text()
-
-    # Replace placeholder {context} in system prompt with actual context content
-    formatted_system_prompt = system_prompt
- 
-    prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(system_prompt),
-            HumanMessagePromptTemplate.from_template(
-  
-                
-                # """
-                # Vous êtes EV Genius, un expert en véhicules électriques pour Peugeot et un conseiller amical. Engagez-vous dans une conversation en privilégiant un véritable échange plutôt qu’un simple dialogue de questions et réponses.
-                # - Si l'utilisateur commence par 'hello' ou 'bonjour', répondez simplement par un bonjour et présentez-vous en tant qu'expert en véhicules électriques. Demandez comment vous pouvez les aider aujourd'hui de manière amicale, très court et concis.
-                # - En tant que commercial pour Peugeot, mettez subtilement en avant les avantages des véhicules électriques de Peugeot et les services associés, en adaptant la conversation aux besoins spécifiques de l'utilisateur, sans être trop orienté vers la vente, donc finissez toujours par une question. Example : Quelles sont les best apps peugeot ? les bests app sont .... , avez vous deja utilisé une app peugeot ? 
-                # - Soulignez que Peugeot propose une large gamme de véhicules avec des services associés qui peuvent répondre aux besoins spécifiques du client.
-                # - **Finissez toujours la réponse par une question courte pour relancer la conversation, en fonction de la réponse précédente, comme dans une conversation normale, tout en gardant à l’esprit que vous êtes un commercial.**
-                # - Si un utilisateur te demande ton véhicule préféré, tu peux lui dire que tu aimes tous les véhicules électriques Peugeot, mais tu peux l'aider à trouver son véhicule préféré en lui posant des questions sur ses besoins et ses préférences et lui proposer un modèle qui correspond à ses besoins.
-                # - Si l'utilisateur te demandes des informations sur les prix rediriige le vers ce lien : https://store.peugeot.fr/
-
-                # Voici l'historique des échanges précédents pour contexte :
-                # {history}
-                # Nouvelle requête de l'utilisateur :
-                # {user_input}
-                # Répondez directement et de manière concise à la requête de l'utilisateur sans répéter la question. Ensuite, proposez 2-3 questions-clés courtes ou mots-clés (de préférence 2 mots-clés, mais si pertinent 3) basés sur l'historique de la conversation pour relancer le dialogue, depuis le point de vue de l'utilisateur, des questions qu'il pourrait poser.
-                # **Lorsque l'utilisateur clique sur l'un des mots-clés ou questions, répondez de manière concise et précise, et cela doit être fluide et naturel, en fonction de la réponse précédente. Finissez toujours par une question courte pour relancer la conversation, en gardant à l'esprit que vous êtes un commercial.**
-                # Pour des sujets généraux comme 'hello' ou 'comment ça va ?', proposez des mots-clés. Pour des sujets plus spécifiques, suggérez des questions courtes pour faire avancer la conversation.
-                # Formatez votre réponse selon ces instructions : {format_instructions}
-                # """
-                
-                """
+# 1 - CHAIN EXPERT - FOR QUESTIONS RELATED TO PEUGEOT ELECTRIC VEHICLES - OR EV
+EXPERTS_EV_INSTRUCTIONS = """
                 Vous êtes EV Genius, un expert en véhicules électriques pour Peugeot et un conseiller amical. Engagez-vous dans une conversation en favorisant un véritable échange plutôt qu’un simple dialogue de questions-réponses. Donc pas de "bien sûr ... éléments de réponse" mais plutôt une conversation naturelle.
                 - En tant que commercial pour Peugeot, mettez subtilement en avant les avantages des véhicules électriques de Peugeot et les services associés. Adaptez la conversation aux besoins spécifiques de l'utilisateur sans être trop orienté vers la vente, en finissant toujours par une question. Par exemple : "Quelles sont les meilleures applications Peugeot ?" Vous pouvez répondre : "Les meilleures applications sont... Avez-vous déjà utilisé une application Peugeot ?"
                 - Soulignez que Peugeot propose une large gamme de véhicules et de services associés qui peuvent répondre aux besoins spécifiques de chaque client.
@@ -149,76 +98,8 @@ def initialize_chain_experts_ev(history,user_input):
                 Formatez votre réponse selon ces instructions : {format_instructions}
                 """
 
-            ),
-        ],
-        input_variables=["user_input", "history"],
-        partial_variables={"format_instructions": output_parser.get_format_instructions()},
-    )
-    bedrock_llm = choose_model()
-    chain = prompt | bedrock_llm | output_parser
-    chain.invoke({
-            "user_input": user_input,
-            "history": history,
-            "context": context,
-        })
-    
-    # print(f"Type of chain: {type(chain)}")
-    
-      # Save the 2 prompts in a log file
-    with open('log_ev.txt', 'w') as f:
-        f.write(formatted_system_prompt)
-        f.write("\n")
-        f.write("User query: " + user_input + ", history: " + str(history) + ", context: " + context)
-        
-    return chain
-
-
 # 2 -CHAIN COMMERCIAL - FOR QUESTIONS LIKE "HELLO", "GOOD MORNING", "THANK YOU", ETC. DON'T NEED TO SEND CONTEXT
-@st.cache_resource
-def initialize_chain_commercial(history, user_input):
-    """ Initialize the conservation chain with system prompt, message history, and user input for commercial team"""
-    
-    current_directory = Path(__file__).resolve().parent 
-    system_prompt_path = current_directory / "prompt/system_prompt_commercial.txt"
-    context = current_directory / "parsed_data/peugeot_data.txt"
-    
-
-    
-    if not system_prompt_path.exists():
-        raise FileNotFoundError("System prompt file not found.")
-
-    
-    # Read system prompt 
-    system_prompt = system_prompt_path.read_text()
-    context = context.read_text()
-    
-    formatted_system_prompt = system_prompt
-    
-  
-    prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(system_prompt),
-            HumanMessagePromptTemplate.from_template(
-                # """"  
-                #     Vous êtes EV Genius, un expert en véhicules électriques pour Peugeot et un conseiller amical. Engagez-vous dans une conversation en privilégiant un véritable échange plutôt qu’un simple dialogue de questions et réponses.
-                #     - Si l'utilisateur commence par 'hello' ou 'bonjour', répondez simplement par un bonjour et présentez-vous en tant qu'expert en véhicules électriques. Demandez comment vous pouvez les aider aujourd'hui de manière amicale, tres court et concis.
-                #     - En tant que commercial pour Peugeot, mettez subtilement en avant les avantages des véhicules électriques de Peugeot et les services associés, en adaptant la conversation aux besoins spécifiques de l'utilisateur, sans être trop orienté vers la vente, donc finissez toujours par une question. Example : Quelles sont les best apps peugeot ? les bests app sont .... , avez vous deja utilisé une app peugeot ? 
-                #     - Soulignez que Peugeot propose une large gamme de véhicules avec des services associés qui peuvent répondre aux besoins spécifiques du client.
-                #     - Finissez toujours par une question courte pour relancer la conversation, en fonction de la réponse précédente, comme dans une conversation normale, tout en gardant à l’esprit que vous êtes un commercial, donc la réponse de la question doit toujours finir par une question pour relancer la conversation.
-                #     - Ne répondez pas aux questions hors sujet ou trop générales, mais posez une question pour affiner la demande, ou changez de sujet pour parler des véhicules électriques Peugeot, des services associés, ou des avantages des véhicules électriques.
-                #     - Si l'utilisateur te demande des informations sur le concessionnaire le plus proche, rediriger le vers ce lien : https://concessions.peugeot.fr/
-                #     - Si l'utilisateur te demande des informations sur comment essayer un véhicule ou prendre rendez-vous pour un essai,ou qu'il manifeste l'envie de tester le véhicule redirige-le vers ce lien, ou même lorsqu'il te demande des infos sur un modele n'hesite pas à lui dire qu'il peut tester le modele : https://essai.peugeot.fr/
-                #     - Si l'utilisateur te demande ton véhicule préféré, tu peux lui dire que tu aimes tous les véhicules électriques Peugeot, mais tu peux l'aider à trouver son véhicule préféré en lui posant des questions sur ses besoins et ses préférences et lui proposer un modèle qui correspond à ses besoins.
-
-                #     Voici l'historique des échanges précédents pour contexte :
-                #     {history}
-                #     Nouvelle requête de l'utilisateur :
-                #     {user_input}
-                #     Répondez directement et de manière concise à la requête de l'utilisateur sans répéter la question. Ensuite, proposez 2-3 questions-clés courtes ou mots-clés (de préférence 2 mots-clés, mais si pertient 3) basés sur l'historique de la conversation pour relancer le dialogue, depuis le point de vue de l'utilisateur, des questions qu'il pourrait poser.
-                #     Lorsque lu'utilisateur clique sur l'un des mots-clés ou questions, répondez de manière concise et précise, et cela doit être fluide et naturel, en fonction de la réponse précédente.
-                #     Pour des sujets généraux comme 'hello' ou 'comment ça va ?', proposez des mots-clés. Pour des sujets plus spécifiques, suggérez des questions courtes pour faire avancer la conversation.
-                #     Formatez votre réponse selon ces instructions : {format_instructions}"""
-                """
+COMMERCIAL_INSTRUCTIONS = """
                 Vous êtes EV Genius, un expert en véhicules électriques pour Peugeot et un conseiller amical. Engagez-vous dans une conversation en privilégiant un véritable échange plutôt qu’un simple dialogue de questions et réponses. donc pas de "bien sur ... elements de reponse" mais plutot une conversation naturelle.
                 
                 - Si l'utilisateur commence par "hello" ou "bonjour", répondez simplement par : "Je suis Genius, votre assistant digital.Vous avez des questions concernant l’achat d’un véhicule électrique ? Je suis là pour y répondre."
@@ -259,83 +140,8 @@ def initialize_chain_commercial(history, user_input):
                 Formatez votre réponse selon ces instructions : {format_instructions}
                 """
 
-            ),
-        ],
-        input_variables=["user_input", "history"],
-        partial_variables={"format_instructions": output_parser.get_format_instructions()},
-    )
-    
-    # Get the Bedrock model
-    bedrock_llm = choose_model()
-    chain = prompt | bedrock_llm | output_parser
-    
-    chain.invoke({
-            "user_input": user_input,
-            "history": history,
-        })
-    
-    # print(f"Type of chain: {type(chain)}")
-    
-    # Save the 2 prompts in a log file
-    with open('log_commercial.txt', 'w') as f:
-        f.write(formatted_system_prompt)
-        f.write("\n")
-        f.write("User query: " + user_input + ", history: " + str(history) + ", context: " + context)
-    
-    
-    return chain
-    
-# Function to add message to chat history
-def add_message_to_history(role, content):
-    chat_history = chat_history_var.get()
-    chat_history.append({"role": role, "content": content})
-    chat_history_var.set(chat_history)
-
-
 # 3 - CHAIN EXPERT DATA EV CAPACITY : FOR QUESTIONS RELATED TO EV CAPACITY - BATTERY CAPACITY... FOR  CERTAINS PEUGEOT MODELS
-@st.cache_resource
-def initialize_chain_expert_data_ev_capacity(history, user_input):
-    current_directory = Path(__file__).resolve().parent  
-
-    system_prompt_path = current_directory / "prompt/system_prompt_expert_data_ev_capacity.txt"
-    context_path = current_directory / "parsed_data/peugeot_capacity_data.txt"
-
-    if not system_prompt_path.exists():
-        raise FileNotFoundError("System prompt file not found.")
-    if not context_path.exists():
-        raise FileNotFoundError("Context file not found.")
-
-    system_prompt = system_prompt_path.read_text()
-    
-    context = context_path.read_text()
-    
-    # replace placeholder {context} in system prompt with actual context content
-    
-    system_prompt = system_prompt.replace("{context}", context)
-    # Save the system prompt locally
-    with open('log_system_prompt_expert_data_ev_capacity.txt', 'w') as f:
-        f.write("System Prompt:\n")
-        f.write(system_prompt)
-
-    
-    
-    prompt = ChatPromptTemplate(
-        messages=[
-            SystemMessagePromptTemplate.from_template(system_prompt),
-            HumanMessagePromptTemplate.from_template(
-                # """  
-                # Vous êtes EV Genius, un expert en véhicules électriques pour Peugeot et un conseiller amical...
-                # {history}
-                # Nouvelle requête de l'utilisateur :
-                # {user_input}
-                # Répondez directement et de manière concise à la requête de l'utilisateur sans répéter la question.
-                # Réponse courte de max 2-3 lignes, car c'est une conversation ! 
-                # Quand vous ne savez pas, posez une question pour affiner la demande comme dans une conversation normal, et ajouter une touche d'humour si possible et rediriger l'utilisateur vers le site de Peugeot.
-                # N'hesitez pas à rediriger l'utilisateur vers le site de Peugeot lorsque c'est pertinent et lorsque tu n'as pas la réponse, par example si l'utilisateur demande des informations sur comment essayer le vehicule le rediriger vers le bon lien, en disant vous pouvez consulter cette page ...
-                
-                # Ensuite, proposez 2-3 questions-clés courtes ou mots-clés basés sur l'historique de la conversation pour relancer le dialogue, mais ce sont des suggestions, depuis le point de vue de l'utilisateur, des questions qu'il pourrait poser.
-                # Formatez votre réponse selon ces instructions : {format_instructions}"""
-                """
+EXPERT_DATA_EV_CAPACITY_INSTRUCTIONS = """
                 Vous êtes EV Genius, un expert en véhicules électriques pour Peugeot et un conseiller amical...
 
                 {history}
@@ -343,6 +149,9 @@ def initialize_chain_expert_data_ev_capacity(history, user_input):
                 Nouvelle requête de l'utilisateur :  
                 {user_input}
 
+                Chiffres déjà calculés à partir des données (autonomie maximale et recharge la plus rapide par modèle), à reprendre tels quels sans les recalculer :
+                {spec_facts}
+
                 - Répondez directement et de manière concise à la requête de l'utilisateur sans répéter la question.  donc pas de "bien sur ... elements de reponse" mais plutot une conversation naturelle.
                 - Vulgarisez les informations techniques sur la capacité de la batterie des véhicules électriques Peugeot de manière simple et compréhensible pour un public non technique.
                 - Réponse courte de max 2-3 lignes, car c'est une conversation entre deux personnes !
@@ -368,23 +177,424 @@ def initialize_chain_expert_data_ev_capacity(history, user_input):
                 Formatez votre réponse selon ces instructions : {format_instructions}
                 """
 
-            ),
-        ],
-        input_variables=["user_input", "history"],
-        partial_variables={"format_instructions": output_parser.get_format_instructions()},
-    )
 
-    bedrock_llm = choose_model()
+# Function to choose the Claude model of a tier ("small" or "large") from Bedrock (or the offline stub, EV_STUB_MODEL=1)
+# Shared model client (model_client.py): pooled connections, retries, circuit breaker with a canned answer
+@st.cache_resource
+def choose_model(tier="large"):
+    return get_tier_model(tier, CANNED_JSON_ANSWER)
+
+# Function to manage memory for conversation
+def get_memory():
+    return ConversationBufferMemory(return_messages=True)
+
+# Registry of the compiled chains: prompt files are read and chains built once per process
+@st.cache_resource
+def get_chain_registry():
+    registry = ChainRegistry(choose_model, callbacks=[get_metrics().callback])
+    registry.register("classifier", RouteSpec(
+        system_prompt=CLASSIFIER_SYSTEM_PROMPT,
+        instructions=CLASSIFIER_INSTRUCTIONS,
+        output_parser=relevant_parser,
+        tier=route_tier("classifier"),
+        escalate_to="large",
+    ))
+    registry.register("experts_ev", RouteSpec(
+        system_prompt_file="prompt/system_prompt_experts_ev.txt",
+        instructions=EXPERTS_EV_INSTRUCTIONS,
+        output_parser=output_parser,
+        tier=route_tier("experts_ev"),
+        escalate_to="large",
+    ))
+    registry.register("commercial", RouteSpec(
+        system_prompt_file="prompt/system_prompt_commercial.txt",
+        instructions=COMMERCIAL_INSTRUCTIONS,
+        output_parser=output_parser,
+        tier=route_tier("commercial"),
+        escalate_to="large",
+    ))
+    registry.register("expert_data_ev_capacity", RouteSpec(
+        system_prompt_file="prompt/system_prompt_expert_data_ev_capacity.txt",
+        instructions=EXPERT_DATA_EV_CAPACITY_INSTRUCTIONS,
+        output_parser=output_parser,
+        static_context_file="parsed_data/peugeot_capacity_data.txt",
+        tier=route_tier("expert_data_ev_capacity"),
+        escalate_to="large",
+    ))
+    registry.warm_up()
+    # Answers of the known questions (warm_faq.py), loaded once per process with the chains
+    get_faq_store()
+    return registry
+
+def check_question_type(user_input, history):
+    cache = get_response_cache()
+    cached = cache.get("classifier", user_input, history)
+    if cached is not None:
+        return cached
+
+    try:
+        result = run_chain("classifier", {
+            "user_query": user_input,
+            "history": history,
+        })
+        print(f"AI CHOICE =>  {result}")
+        cache.set("classifier", user_input, history, result["relevant_yes_no"])
+        return result["relevant_yes_no"]  # It will now return "yes", "ok", or "no"
+    except Exception as e:
+        print(f"Exception: {e}")
+        return "no"  # Default to "no" in case of error
+
+async def check_question_type_async(user_input, history):
+    """Same as check_question_type, without blocking the event loop."""
+    cache = get_response_cache()
+    cached = cache.get("classifier", user_input, history)
+    if cached is not None:
+        return cached
 
-    chain = prompt | bedrock_llm | output_parser
-    chain.invoke({
-            "user_input": user_input,
+    try:
+        result = await arun_chain("classifier", {
+            "user_query": user_input,
             "history": history,
-            "context": context,
         })
-    
-    return chain
+        print(f"AI CHOICE =>  {result}")
+        cache.set("classifier", user_input, history, result["relevant_yes_no"])
+        return result["relevant_yes_no"]
+    except Exception as e:
+        print(f"Exception: {e}")
+        return "no"
+
+# Route of a question of the FAQ store (answered offline by warm_faq.py), or None
+def get_faq_decision(user_input):
+    entry = get_faq_store().get("chains", user_input, count=False)
+    return RouteDecision(entry["label"], 1.0, "faq") if entry is not None else None
+
+def classify_question(user_input, history):
+    """
+    Route the question with the local router (rules, then linear classifier) and only fall back to the
+    LLM classifier (check_question_type) when the router is unsure.
+    """
+    with get_metrics().stage("routing"):
+        decision = get_faq_decision(user_input) or get_intent_router().route(user_input)
+        if decision is None:
+            decision = RouteDecision(check_question_type(user_input, history), 1.0, "llm")
+    get_metrics().set_route(ROUTES.get(decision.label, DEFAULT_ROUTE), decision.source)
+    print(f"ROUTER => {decision.label} (source: {decision.source}, confidence: {decision.confidence:.2f})")
+    return decision
 
+# 1 - CHAIN EXPERT - FOR QUESTIONS RELATED TO PEUGEOT ELECTRIC VEHICLES - OR EV
+def initialize_chain_experts_ev():
+    return get_chain_registry().get("experts_ev")
 
+# 2 -CHAIN COMMERCIAL - FOR QUESTIONS LIKE "HELLO", "GOOD MORNING", "THANK YOU", ETC. DON'T NEED TO SEND CONTEXT
+def initialize_chain_commercial():
+    """ Return the conversation chain for the commercial team (built once, see get_chain_registry)"""
+    return get_chain_registry().get("commercial")
 
+# 3 - CHAIN EXPERT DATA EV CAPACITY : FOR QUESTIONS RELATED TO EV CAPACITY - BATTERY CAPACITY... FOR  CERTAINS PEUGEOT MODELS
+def initialize_chain_expert_data_ev_capacity():
+    return get_chain_registry().get("expert_data_ev_capacity")
+
+# Model that answers again when the output of the route's model fails to parse (None: no escalation)
+def get_escalation_model(route, error):
+    model = get_chain_registry().get_escalation_model(route)
+    if model is not None:
+        print(f"ESCALATION => {route}: {get_chain_registry().tier(route)} model output not parsed ({error})")
+        get_metrics().record_escalation()
+    return model
+
+# Parse the output of a route: the parser accepts truncated JSON, so every field of its model must be there
+def parse_complete(parser, message):
+    result = parser.invoke(message)
+    model = getattr(parser, "pydantic_object", None)
+    if model is not None:
+        fields = getattr(model, "model_fields", None) or model.__fields__
+        missing = [name for name in fields if not isinstance(result, dict) or name not in result]
+        if missing:
+            raise OutputParserException(f"Incomplete output, missing {missing}", llm_output=str(message.content))
+    return result
+
+# Output of a route not parsed, even after the escalation: carries what could be decoded, shown but never cached
+class UnparsedAnswer(OutputParserException):
+    def __init__(self, error, answer):
+        super().__init__(str(error), llm_output=error.llm_output)
+        self.answer = answer
+
+# What can be shown of an output that failed to parse: the decoded text, the canned answer when there is none
+def best_effort_answer(content):
+    parser = IncrementalResponseParser()
+    parser.feed(content)
+    result = parser.result()
+    return result if result["response"].strip() else {"response": CANNED_ANSWER, "key_words": []}
+
+# Parse the answer of the escalation model (escalated=False: there was none), else raise UnparsedAnswer
+def parse_escalated(route, parser, error, message, escalated):
+    if escalated:
+        try:
+            with get_metrics().stage("parsing"):
+                return parse_complete(parser, message)
+        except OutputParserException as e:
+            print(f"ESCALATION => {route}: output still not parsed ({e})")
+            error = e
+    raise UnparsedAnswer(error, best_effort_answer(str(message.content)))
+
+# Run the chain of a route step by step, timing each step in the metrics of the current turn.
+# An output not parsed is sent once to the escalation model, then raises UnparsedAnswer
+def run_chain(route, inputs):
+    prompt, model, parser = get_chain_registry().get_parts(route)
+    metrics = get_metrics()
+    with metrics.stage("prompt_build"):
+        prompt_value = prompt.invoke(inputs)
+    with metrics.stage("model_call"):
+        message = model.invoke(prompt_value)
+    try:
+        with metrics.stage("parsing"):
+            return parse_complete(parser, message)
+    except OutputParserException as e:
+        error, escalation_model = e, get_escalation_model(route, e)
+    if escalation_model is not None:
+        with metrics.stage("model_call"):
+            message = escalation_model.invoke(prompt_value)
+    return parse_escalated(route, parser, error, message, escalation_model is not None)
+
+async def arun_chain(route, inputs):
+    """Same as run_chain, without blocking the event loop."""
+    prompt, model, parser = get_chain_registry().get_parts(route)
+    metrics = get_metrics()
+    with metrics.stage("prompt_build"):
+        prompt_value = prompt.invoke(inputs)
+    with metrics.stage("model_call"):
+        message = await model.ainvoke(prompt_value)
+    try:
+        with metrics.stage("parsing"):
+            return parse_complete(parser, message)
+    except OutputParserException as e:
+        error, escalation_model = e, get_escalation_model(route, e)
+    if escalation_model is not None:
+        with metrics.stage("model_call"):
+            message = await escalation_model.ainvoke(prompt_value)
+    return parse_escalated(route, parser, error, message, escalation_model is not None)
+
+# Queue the prompt of a request for the prompt log (prompt_log.py writes it in the background)
+def log_prompt(route, inputs):
+    get_prompt_logger().log(
+        route,
+        get_chain_registry().system_prompts[route],
+        inputs["user_input"],
+        inputs["history"],
+        inputs["context"],
+        spec_facts_chars=len(inputs.get("spec_facts", "")),
+    )
 
+def get_direct_answer(route, user_input):
+    """Deterministic answer of a plain spec lookup on the capacity route (spec_store.py), or None."""
+    if route != "expert_data_ev_capacity" or not SPEC_DIRECT_ANSWERS:
+        return None
+    return get_spec_store().direct_answer(user_input)
+
+def get_cached_answer(route, user_input, history):
+    """
+    Answer without a model call: the FAQ store, a spec lookup computed from the capacity data, the response
+    cache, or the semantic cache for a paraphrase of this route.
+    """
+    metrics = get_metrics()
+    with metrics.stage("cache"):
+        faq = get_faq_store().get("chains", user_input)
+        if faq is not None and faq["route"] == route:
+            metrics.record_cache("faq")
+            return faq["answer"]
+
+        direct = get_direct_answer(route, user_input)
+        if direct is not None:
+            print(f"spec store answer: {direct['response']}")
+            metrics.record_cache("spec")
+            return direct
+
+        cache = get_response_cache()
+        cached = cache.get(route, user_input, history)
+        if cached is not None:
+            metrics.record_cache("exact")
+            return cached
+
+        match = get_semantic_cache().lookup(route, user_input, history)
+        if match is not None:
+            result, similarity, cached_question = match
+            print(f"semantic cache hit ({similarity:.2f}): {cached_question}")
+            cache.set(route, user_input, history, result)
+            metrics.record_cache("semantic")
+            return result
+    return None
+
+def get_answer_inputs(route, user_input, history):
+    # Only the expert chain reads {context}: send it the top-k paragraphs relevant to the question
+    with get_metrics().stage("retrieval"):
+        context = retrieve_context(user_input) if route == "experts_ev" else ""
+    # The capacity chain gets the figures of the models of the question already computed
+    spec_facts = get_spec_store().facts_for(user_input) if route == "expert_data_ev_capacity" else ""
+    return {
+        "user_input": user_input,
+        "history": history,
+        "context": context,
+        "spec_facts": spec_facts,
+    }
+
+def store_answer(route, inputs, result):
+    log_prompt(route, inputs)
+    # The canned answer of the circuit breaker is not an answer to this question
+    if is_canned_answer(result):
+        return
+    get_response_cache().set(route, inputs["user_input"], inputs["history"], result)
+    get_semantic_cache().add(route, inputs["user_input"], inputs["history"], result)
+
+# An answer not parsed is shown but never cached: it would be served to every paraphrase
+def unparsed_answer(route, inputs, error):
+    log_prompt(route, inputs)
+    return error.answer
+
+def answer_question(relevance_result, user_input, history):
+    """
+    Answer the user with the chain of the route chosen by classify_question (or check_question_type).
+    This is the only model call of the turn besides the classifier, none when the answer is cached.
+    """
+    route = ROUTES.get(relevance_result, DEFAULT_ROUTE)
+    cached = get_cached_answer(route, user_input, history)
+    if cached is not None:
+        return cached
+
+    inputs = get_answer_inputs(route, user_input, history)
+    try:
+        result = run_chain(route, inputs)
+    except UnparsedAnswer as e:
+        return unparsed_answer(route, inputs, e)
+    store_answer(route, inputs, result)
+    return result
+
+async def answer_question_async(relevance_result, user_input, history):
+    """Same as answer_question, without blocking the event loop (and cancellable)."""
+    route = ROUTES.get(relevance_result, DEFAULT_ROUTE)
+    cached = get_cached_answer(route, user_input, history)
+    if cached is not None:
+        return cached
+
+    inputs = get_answer_inputs(route, user_input, history)
+    try:
+        result = await arun_chain(route, inputs)
+    except UnparsedAnswer as e:
+        return unparsed_answer(route, inputs, e)
+    store_answer(route, inputs, result)
+    return result
+
+def stream_answer(relevance_result, user_input, history):
+    """
+    Same as answer_question, but stream the answer: yields (response text so far, key_words or None, done).
+    The last update (done=True) carries the final result, stored in the caches only when it parsed (see run_chain).
+    """
+    route = ROUTES.get(relevance_result, DEFAULT_ROUTE)
+    cached = get_cached_answer(route, user_input, history)
+    if cached is not None:
+        yield cached["response"], cached["key_words"], True
+        return
+
+    inputs = get_answer_inputs(route, user_input, history)
+    prompt, model, route_parser = get_chain_registry().get_parts(route)
+    metrics = get_metrics()
+    with metrics.stage("prompt_build"):
+        prompt_value = prompt.invoke(inputs)
+    parser = IncrementalResponseParser()
+    with metrics.stage("model_call"):
+        for chunk in model.stream(prompt_value):
+            previous = parser.response
+            if parser.feed(chunk.content) != previous:
+                yield parser.response, parser.key_words, False
+
+    # Same policy as run_chain: an output not parsed is answered again once by the escalation model
+    message = AIMessage(content=parser.buffer)
+    try:
+        with metrics.stage("parsing"):
+            result = parse_complete(route_parser, message)
+    except OutputParserException as e:
+        escalation_model = get_escalation_model(route, e)
+        if escalation_model is not None:
+            with metrics.stage("model_call"):
+                message = escalation_model.invoke(prompt_value)
+        try:
+            result = parse_escalated(route, route_parser, e, message, escalation_model is not None)
+        except UnparsedAnswer as unparsed:
+            result = unparsed_answer(route, inputs, unparsed)
+            yield result["response"], result["key_words"], True
+            return
+    store_answer(route, inputs, result)
+    yield result["response"], result["key_words"], True
+
+async def route_and_answer_async(user_input, history, classifier_history=None):
+    """
+    Async pipeline of a turn. When the question is in the FAQ store or the local router is sure, answer directly. Otherwise start the LLM
+    classifier and the answer chain(s) of the most likely route(s) at the same time (speculative.py),
+    so the classifier round trip leaves the critical path. Returns (decision, result, speculation stats).
+    classifier_history is the shorter history view sent to the classifier (default: history).
+    """
+    if classifier_history is None:
+        classifier_history = history
+
+    router = get_intent_router()
+    metrics = get_metrics()
+    with metrics.stage("routing"):
+        decision = get_faq_decision(user_input) or router.route(user_input)
+    if decision is not None:
+        metrics.set_route(ROUTES.get(decision.label, DEFAULT_ROUTE), decision.source)
+        return decision, await answer_question_async(decision.label, user_input, history), None
+
+    label, result, stats = await speculative_answer(
+        user_input,
+        history,
+        router.predict_proba(user_input),
+        classify=lambda question, _history: check_question_type_async(question, classifier_history),
+        answer=answer_question_async,
+    )
+    print(f"SPECULATION => {stats}")
+    metrics.set_route(ROUTES.get(label, DEFAULT_ROUTE), "llm")
+    return RouteDecision(label, 1.0, "llm"), result, stats
+
+# Function to add message to chat history (bounded, per session)
+# Also accepts a single HumanMessage/AIMessage
+def add_message_to_history(role, content=None, session_id="default"):
+    if isinstance(role, (HumanMessage, AIMessage)):
+        role, content = ("human" if isinstance(role, HumanMessage) else "assistant"), role.content
+    get_history_store().append(session_id, role, content)
+
+
+# Function to get the chat history of a session
+def get_chat_history(session_id="default"):
+    return get_history_store().get(session_id)
+
+
+# Function to get the chat history of a session as messages (the Streamlit client resuming a conversation)
+def get_chat_messages(session_id="default"):
+    return [
+        HumanMessage(content=message["content"]) if message["role"] == "human" else AIMessage(content=message["content"])
+        for message in get_chat_history(session_id)
+    ]
+
+
+# Function to answer one question and record the metrics of the turn (2_chatbot_metrics.py)
+def process_input(user_input, history=""):
+    """Route and answer a question, append the metrics of the turn to st.session_state.metrics."""
+    with get_metrics().turn(user_input) as turn_metrics:
+        decision = classify_question(user_input, history)
+        result = answer_question(decision.label, user_input, history)
+    if "metrics" in st.session_state:
+        st.session_state.metrics.append(turn_metrics.as_row())
+    print(f"METRICS => {turn_metrics.as_row()}")
+    return result["response"]
+
+
+# Function to export the metrics of the session as CSV (returns the CSV text, also written to path if given)
+def save_results_to_csv(path=None):
+    rows = st.session_state.get("metrics") or get_metrics().rows()
+    output = io.StringIO()
+    if rows:
+        writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    if path is not None:
+        Path(path).write_text(output.getvalue(), encoding="utf-8")
+    return output.getvalue()
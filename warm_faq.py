@@ -0,0 +1,105 @@
+"""
+Offline warm-up of the FAQ answer store (faq_store.py): known questions are run through the real routing and
+chains, the valid answers are stored in faq/answers.json and served by every app instance without a model call.
+
+    python warm_faq.py
+    python warm_faq.py --target chains api --top 50 --min-count 3 --concurrency 4
+
+Questions: utils.EXAMPLE_QUESTIONS, faq_store.FAQ_QUESTIONS and the most frequent questions of the prompt logs.
+The store is tied to a hash of the prompts, the parsed context, the chain code and the models (faq_store.content_version):
+run the job again after changing them.
+"""
+import argparse
+import asyncio
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Load environment variables (before the settings of the modules are read)
+load_dotenv()
+
+from faq_store import FAQ_QUESTIONS, FAQ_STORE_FILE, FaqStore, content_version, mine_frequent_questions
+from prompt_log import PROMPT_LOG_FILE
+from response_cache import normalize_question
+
+
+def prompt_log_files():
+    # The prompt log and its rotated files (prompts.jsonl, prompts.jsonl.1...)
+    if not PROMPT_LOG_FILE:
+        return []
+    path = Path(PROMPT_LOG_FILE)
+    return sorted(path.parent.glob(path.name + "*")) if path.parent.exists() else []
+
+
+async def answer_chains(question):
+    """Route (local router, else LLM classifier) and answer with the chain of the route, caches bypassed."""
+    from intent_router import RouteDecision, get_intent_router
+    from utils import DEFAULT_ROUTE, ROUTES, arun_chain, check_question_type_async, get_answer_inputs, get_direct_answer
+
+    decision = get_intent_router().route(question)
+    if decision is None:
+        decision = RouteDecision(await check_question_type_async(question, ""), 1.0, "llm")
+    route = ROUTES.get(decision.label, DEFAULT_ROUTE)
+    answer = get_direct_answer(route, question)
+    if answer is None:
+        answer = await arun_chain(route, get_answer_inputs(route, question, ""))
+    return answer, {"label": decision.label, "route": route, "routed_by": decision.source}
+
+
+def make_answer_api():
+    """Answer with the chain of the API (no session history), imported in-process like benchmark.py does."""
+    from benchmark import load_api
+
+    api = load_api()
+
+    async def answer_api(question):
+        inputs, _history = api.prepare_inputs(None, question)
+        return await api.initialize_chain().ainvoke(inputs), {}
+    return answer_api
+
+
+async def warm(store, targets, questions, concurrency):
+    slots = asyncio.Semaphore(concurrency)
+    answerers = {"chains": answer_chains}
+    if "api" in targets:
+        answerers["api"] = make_answer_api()
+
+    async def warm_one(target, question):
+        async with slots:
+            try:
+                answer, fields = await answerers[target](question)
+            except Exception as e:
+                print(f"[{target}] error  {question}: {e}")
+                return
+        stored = store.add(target, question, answer, **fields)
+        print(f"[{target}] {'stored ' if stored else 'invalid'} {question} {fields.get('route', '')}")
+
+    await asyncio.gather(*(warm_one(target, question) for target in targets for question in questions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", nargs="+", choices=["chains", "api"], default=["chains", "api"])
+    parser.add_argument("--top", type=int, default=50, help="most frequent questions mined from the prompt logs")
+    parser.add_argument("--min-count", type=int, default=3, help="min occurrences of a mined question")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--output", default=FAQ_STORE_FILE)
+    parser.add_argument("--fresh", action="store_true", help="drop the answers already in the store")
+    args = parser.parse_args()
+
+    from utils import EXAMPLE_QUESTIONS
+
+    mined = mine_frequent_questions(prompt_log_files(), args.top, args.min_count)
+    # Same question (after normalization) only once
+    questions = list({normalize_question(question): question for question in EXAMPLE_QUESTIONS + FAQ_QUESTIONS + mined}.values())
+    print(f"{len(questions)} questions ({len(mined)} mined from the prompt logs)")
+
+    version = content_version()
+    store = FaqStore(version) if args.fresh else FaqStore.load(args.output, version)
+    asyncio.run(warm(store, args.target, questions, args.concurrency))
+    store.save(args.output)
+    print(f"FAQ store {args.output} (version {version}): {store.stats()['entries']} answers")
+
+
+if __name__ == "__main__":
+    main()